@@ -0,0 +1,120 @@
+import asyncio
+from interpreter import evaluate_guard, execute_statement, new_registers, Unset
+from embed import to_value
+
+# asyncio execution of StackTo programs, so that one event loop can run
+# many interactive programs at once
+# run_async runs a program a statement at a time with the step of the tree
+# engine (interpreter.execute_statement), but waits for input
+# lines from an asyncio StreamReader and writes output to an asyncio
+# StreamWriter without blocking the loop. output is collected and written
+# in blocks, waiting for the writer to drain when the other side reads
+# slowly, and it is always written before waiting for input so that a
+# prompt shows up. every switch_interval backward jumps the program also
+# gives the other tasks a turn, so that a long loop cannot hold up the
+# whole event loop
+
+class AsyncStreamSink:
+    # output sink that collects lines and writes them to a StreamWriter on flush
+    def __init__(self, writer, encoding='utf-8'):
+        self.writer = writer
+        self.encoding = encoding
+        self.pending = []
+        self.pending_size = 0
+
+    def write_line(self, line):
+        self.pending.append(line)
+        self.pending_size += len(line) + 1
+
+    async def flush(self):
+        if self.pending:
+            self.pending.append('')
+            self.writer.write('\n'.join(self.pending).encode(self.encoding))
+            self.pending = []
+            self.pending_size = 0
+            await self.writer.drain()
+
+async def run_async(program, reader, writer, variables=None, limits=None, switch_interval=1000, buffer_size=65536, encoding='utf-8'):
+    # run an embed.Program reading input lines from reader and writing
+    # output lines to writer, starting from variables (none by default) and
+    # returning the variables it ends with, like Interpreter.run
+    # limits (see limits.py) stop the program with LimitExceeded
+    # like Interpreter.run, an optimized program is specialized again for
+    # variables of types it was not proven for
+    start = {} if variables is None else {varname: to_value(value) for varname, value in variables.items()}
+    program = program.for_variables(start)
+    on_jump = None
+    if limits is None:
+        statements, variable_names, marker_dict = program.compile('tree')
+    else:
+        from limits import Budget
+        (statements, variable_names, marker_dict), budget_args = program.compile('tree', True)
+    registers = new_registers(variable_names)
+    for slot, varname in enumerate(variable_names):
+        if varname in start:
+            registers[slot] = start[varname]
+    if limits is not None:
+        on_jump = Budget(limits, *budget_args, registers, variable_names).jump
+    output = AsyncStreamSink(writer, encoding)
+    write_line = output.write_line
+
+    async def read_input():
+        # the next input line, after writing the output so far
+        await output.flush()
+        line = await reader.readline()
+        if not line:
+            raise EOFError('EOF when reading a line')
+        line = line.decode(encoding)
+        if line.endswith('\n'):
+            line = line[:-1]
+            if line.endswith('\r'):
+                line = line[:-1]
+        return line
+
+    # the statements run synchronously, with input read before a statement
+    # that needs it
+    line = None
+
+    def read_line():
+        return line
+
+    backward_jumps = 0
+    statement_index = 0
+    try:
+        while statement_index < len(statements):
+            statement = statements[statement_index]
+            prefix = ''
+            if statement[0] == 'if':
+                guard = statement[1]
+                if guard.code is None:
+                    line = await read_input()
+                if not evaluate_guard(guard, registers, read_line):
+                    statement_index += 1
+                    continue
+                statement = statement[2]
+                prefix = 'if '
+            if statement[0] in ('set', 'outputexp') and statement[-1].code is None:
+                line = await read_input()
+            next_index = execute_statement(statement_index, statement, marker_dict, registers, write_line, read_line, on_jump, prefix)
+            if output.pending_size >= buffer_size:
+                await output.flush()
+            if next_index <= statement_index:
+                backward_jumps += 1
+                if backward_jumps >= switch_interval:
+                    backward_jumps = 0
+                    await output.flush()
+                    await asyncio.sleep(0)
+            statement_index = next_index
+    except Exception as error:
+        # write the output from before the error, without letting a writer
+        # that fails as well hide it
+        try:
+            await output.flush()
+        except Exception as flush_error:
+            raise error from flush_error
+        raise
+    await output.flush()
+    ended = {varname: value for varname, value in zip(variable_names, registers) if type(value) is not Unset}
+    result = dict(start)
+    result.update(ended)
+    return result
@@ -0,0 +1,258 @@
+import os
+import sys
+import glob
+import time
+import difflib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from interpreter import MemorySink, ListSource, StreamSource, parse_content
+from limits import add_limit_arguments, limits_from_arguments
+
+# batch runner for many StackTo programs
+# every program runs in a pool of worker processes with its output kept in
+# memory, and is compared with the expected output in a file next to it
+#   name.stackto    program
+#   name.in         input lines for input and inputnum (optional)
+#   name.out        expected output (optional)
+#   name.err        expected error message (optional)
+# without a .in file, input fails as at the end of input instead of waiting
+# on stdin. all files are utf-8, and a program passes when its output is
+# exactly the text of the .out file (every line ending in \n) and it raises
+# the expected error (or none without a .err file), and only runs when it
+# has neither file
+
+PROGRAM_EXTENSION = '.stackto'
+INPUT_EXTENSION = '.in'
+EXPECTED_EXTENSION = '.out'
+ERROR_EXTENSION = '.err'
+
+class BatchJob:
+    # a program to run with the files that go with it (None when missing)
+    __slots__ = ('path', 'input_path', 'expected_path', 'error_path')
+
+    def __init__(self, path, input_path, expected_path, error_path):
+        self.path = path
+        self.input_path = input_path
+        self.expected_path = expected_path
+        self.error_path = error_path
+
+class BatchResult:
+    # status is 'pass', 'fail', 'error' (the program raised an unexpected
+    # error) or 'ran' (nothing to compare with), expected is the text of the
+    # .out file, error is the message of the error raised and seconds
+    # includes loading
+    __slots__ = ('path', 'status', 'seconds', 'lines', 'expected', 'error', 'expected_error')
+
+    def __init__(self, path, status, seconds, lines, expected, error, expected_error):
+        self.path = path
+        self.status = status
+        self.seconds = seconds
+        self.lines = lines
+        self.expected = expected
+        self.error = error
+        self.expected_error = expected_error
+
+def find_programs(patterns):
+    # programs named by directories (every program directly inside), glob
+    # patterns and file names, in order and without duplicates
+    # finding none at all is an error, so that a mistyped pattern cannot
+    # pass as an empty batch
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(
+                os.path.join(pattern, name) for name in os.listdir(pattern)
+                if name.endswith(PROGRAM_EXTENSION)
+            )
+        else:
+            matches = sorted(glob.glob(pattern, recursive=True))
+            if not matches and not glob.has_magic(pattern):
+                raise ValueError('batch: no such file or directory: %s' % pattern)
+        paths.extend(matches)
+    seen = set()
+    paths = [path for path in paths if not (path in seen or seen.add(path))]
+    if not paths:
+        raise ValueError('batch: no programs found for %s' % ' '.join(patterns))
+    return paths
+
+def companion_path(path, extension):
+    # name.stackto -> name.extension
+    base = path[:-len(PROGRAM_EXTENSION)] if path.endswith(PROGRAM_EXTENSION) else path
+    return base + extension
+
+def make_job(path):
+    companions = []
+    for extension in (INPUT_EXTENSION, EXPECTED_EXTENSION, ERROR_EXTENSION):
+        companion = companion_path(path, extension)
+        companions.append(companion if os.path.isfile(companion) else None)
+    return BatchJob(path, *companions)
+
+def load_statements(path, optimized, use_cache, cache_dir):
+    if use_cache:
+        from cache import load_program_cached
+        return load_program_cached(path, optimized, cache_dir)
+    # decoded as utf-8, like the cached path
+    with open(path, 'rb') as f:
+        statements = parse_content(f)
+    if optimized:
+        from optimize import optimize
+        statements = optimize(statements)
+    return statements
+
+def run_statements(statements, engine, output, input_source, limits):
+    if engine == 'vm':
+        from vm import process_statements_vm
+        process_statements_vm(statements, output, input_source, limits)
+    elif engine == 'py':
+        from translate import process_statements_py
+        process_statements_py(statements, output, input_source, None, limits)
+    else:
+        from interpreter import process_statements
+        process_statements(statements, output, input_source, limits=limits)
+
+def run_job(job, engine='tree', optimized=False, use_cache=True, cache_dir=None, limits=None):
+    # run one program and return its BatchResult, never raises for errors in the program
+    # limits (see limits.py) apply to every program, going over them is an error
+    output = MemorySink()
+    error = None
+    start = time.perf_counter()
+    try:
+        statements = load_statements(job.path, optimized, use_cache, cache_dir)
+        if job.input_path is None:
+            run_statements(statements, engine, output, ListSource([]), limits)
+        else:
+            with open(job.input_path, 'r', encoding='utf-8') as inputfile:
+                run_statements(statements, engine, output, StreamSource(inputfile), limits)
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+    seconds = time.perf_counter() - start
+    expected = None
+    if job.expected_path is not None:
+        # newline='' keeps \r\n, which the output never has
+        with open(job.expected_path, 'r', encoding='utf-8', newline='') as f:
+            expected = f.read()
+    expected_error = None
+    if job.error_path is not None:
+        with open(job.error_path, 'r', encoding='utf-8') as f:
+            expected_error = f.read().strip()
+    if error is not None and expected_error is None:
+        status = 'error'
+    elif error != expected_error or (expected is not None and output.getvalue() != expected):
+        status = 'fail'
+    elif expected is None and expected_error is None:
+        status = 'ran'
+    else:
+        status = 'pass'
+    return BatchResult(job.path, status, seconds, output.lines, expected, error, expected_error)
+
+def run_job_with_options(arguments):
+    # worker entry point, takes a single picklable tuple
+    return run_job(*arguments)
+
+def run_batch(jobs, engine='tree', optimized=False, use_cache=True, cache_dir=None, workers=None, limits=None):
+    # yield the BatchResult of every job in order, as soon as it and every
+    # job before it are done
+    # workers defaults to the number of cores, a single worker runs the
+    # programs in this process
+    if workers is None:
+        workers = os.cpu_count() or 1
+    arguments = [(job, engine, optimized, use_cache, cache_dir, limits) for job in jobs]
+    if workers <= 1 or len(jobs) <= 1:
+        for job_arguments in arguments:
+            yield run_job_with_options(job_arguments)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+        yield from executor.map(run_job_with_options, arguments)
+
+def output_text(result):
+    # the output of a program as the text of its .out file
+    return ''.join(line + '\n' for line in result.lines)
+
+def format_result(result, label=None):
+    # label replaces the status
+    lines = ['%-5s %9.1f ms  %s' % (label or result.status.upper(), result.seconds * 1000, result.path)]
+    if result.error != result.expected_error:
+        if result.expected_error is not None:
+            lines.append('      expected error: %s' % result.expected_error)
+        lines.append('      error: %s' % result.error)
+    return '\n'.join(lines)
+
+def format_diff(result):
+    # unified diff of the expected and the actual output, split on \n only
+    # so that a missing last newline or a stray \r shows up too
+    diff = difflib.unified_diff(
+        result.expected.split('\n'), output_text(result).split('\n'),
+        companion_path(result.path, EXPECTED_EXTENSION), 'output', lineterm=''
+    )
+    return '\n'.join('      ' + line for line in diff)
+
+def write_expected(result):
+    # save the output and error of a program as the expected ones
+    with open(companion_path(result.path, EXPECTED_EXTENSION), 'w', encoding='utf-8', newline='') as f:
+        f.write(output_text(result))
+    error_path = companion_path(result.path, ERROR_EXTENSION)
+    if result.error is not None:
+        with open(error_path, 'w', encoding='utf-8') as f:
+            f.write(result.error + '\n')
+    elif os.path.isfile(error_path):
+        os.remove(error_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many StackTo programs and compare their output with the expected output.')
+    parser.add_argument('programs', nargs='+', help='Program files, directories or glob patterns (e.g. "examples/tests" or "examples/**/*.stackto")')
+    parser.add_argument('-e', '--engine', help='Execution engine to run the programs with', choices=['tree', 'vm', 'py'], default='tree')
+    parser.add_argument('-O', '--optimize', help='Optimize the programs before running, like interpreter.py --optimize', action='store_true')
+    parser.add_argument('-j', '--jobs', help='Number of worker processes (default: number of cores)', type=int, default=None)
+    parser.add_argument('-d', '--diff', help='Show a diff of the expected and the actual output of failing programs', action='store_true')
+    parser.add_argument('-q', '--quiet', help='Only report programs that fail or raise an error', action='store_true')
+    parser.add_argument('--update', help='Write the output and error of every program to its .out and .err files, for later runs to compare with', action='store_true')
+    parser.add_argument('--no-cache', help='Always parse the programs instead of using the compiled program cache', action='store_true')
+    parser.add_argument('--cache-dir', metavar='DIR', help='Directory for compiled program cache files')
+    # the limits apply to every program
+    add_limit_arguments(parser)
+    args = parser.parse_args()
+    try:
+        paths = find_programs(getattr(args, 'programs'))
+    except ValueError as e:
+        parser.error(str(e))
+    jobs = [make_job(path) for path in paths]
+    workers = getattr(args, 'jobs') or os.cpu_count() or 1
+    limits = limits_from_arguments(args)
+
+    counts = {'pass': 0, 'fail': 0, 'error': 0, 'ran': 0}
+    updated = 0
+    start = time.perf_counter()
+    results = run_batch(
+        jobs, getattr(args, 'engine'), getattr(args, 'optimize'),
+        not getattr(args, 'no_cache'), getattr(args, 'cache_dir'), workers, limits
+    )
+    for result in results:
+        counts[result.status] += 1
+        if getattr(args, 'update'):
+            # programs that pass already have the output files they would get
+            if result.status != 'pass':
+                write_expected(result)
+                updated += 1
+                print(format_result(result, 'WROTE'))
+            continue
+        if getattr(args, 'quiet') and result.status in ('pass', 'ran'):
+            continue
+        print(format_result(result))
+        if getattr(args, 'diff') and result.expected is not None and output_text(result) != result.expected:
+            print(format_diff(result))
+    elapsed = time.perf_counter() - start
+
+    if getattr(args, 'update'):
+        print('%s programs in %.2f s (%s workers): %s updated, %s unchanged' % (
+            len(jobs), elapsed, min(workers, len(jobs)) or 1, updated, counts['pass']
+        ))
+        return
+    print('%s programs in %.2f s (%s workers): %s passed, %s failed, %s errors, %s without expected output' % (
+        len(jobs), elapsed, min(workers, len(jobs)) or 1,
+        counts['pass'], counts['fail'], counts['error'], counts['ran']
+    ))
+    if counts['fail'] or counts['error']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import argparse
+
+# synthetic StackTo programs whose size scales with n, for the benchmark runner
+
+def straight_line(n):
+    # n set statements without any jumps, mostly measures parsing and dispatch
+    lines = ['set $v0 [1];']
+    for i in range(1, n):
+        lines.append('set $v%s [$v%s %s + 2 %% 1 +];' % (i, i-1, i))
+    lines.append('output $v%s;' % (n-1))
+    return '\n'.join(lines) + '\n'
+
+def deep_expression(n):
+    # one expression with n operators, evaluated 100 times
+    terms = ' '.join('%s %s' % (i % 7 + 1, '+-*%'[i % 4]) for i in range(n))
+    lines = [
+        'set $i [0];',
+        'mark top;',
+        'if [$i 100 =] then goto done;',
+        'set $x [$i %s 1000003 %%];' % terms,
+        'set $i [$i 1 +];',
+        'goto top;',
+        'mark done;',
+        'output $x;'
+    ]
+    return '\n'.join(lines) + '\n'
+
+def jump_chain(n):
+    # n marks laid out in reverse, each block jumping to the next one
+    lines = ['set $c [0];', 'goto m0;']
+    for i in reversed(range(n)):
+        lines.append('mark m%s;' % i)
+        lines.append('set $c [$c 1 +];')
+        lines.append('goto %s;' % ('done' if i == n-1 else 'm%s' % (i+1)))
+    lines.append('mark done;')
+    lines.append('output $c;')
+    return '\n'.join(lines) + '\n'
+
+def commented(n):
+    # n statements, each after a two line comment
+    lines = ['set $c [0];']
+    for i in range(n):
+        lines.append('# comment line one for statement %s' % i)
+        lines.append('# comment line two for statement %s' % i)
+        lines.append('set $c [$c %s +];' % i)
+    lines.append('output $c;')
+    return '\n'.join(lines) + '\n'
+
+GENERATORS = {
+    'straight_line':    straight_line,
+    'deep_expression':  deep_expression,
+    'jump_chain':       jump_chain,
+    'commented':        commented
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Print a synthetic StackTo benchmark program.')
+    parser.add_argument('generator', help='Program generator to use', choices=sorted(GENERATORS))
+    parser.add_argument('size', help='Program size', type=int)
+    args = parser.parse_args()
+    print(GENERATORS[getattr(args, 'generator')](getattr(args, 'size')), end='')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from fnmatch import fnmatch
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from interpreter import parse_content, process_statements, MemorySink, ListSource
+from vm import compile_statements, run_code, process_statements_vm, instruction_expression, JUMP_UNLESS, COMPARE_JUMP_UNLESS
+from translate import process_statements_py
+from limits import expression_operators
+from generate import GENERATORS
+
+# benchmark runner for the StackTo interpreter
+# every workload is parsed and run with output kept in memory, and reported
+# as executed statements and operators per second of run time, parse time
+# and peak memory. results can be saved as json and compared with an
+# earlier run
+
+DEFAULT_SIZES = [1000, 10000]
+
+class CountingCode(list):
+    # vm instruction list that counts how often each offset is fetched
+    def __init__(self, code):
+        super().__init__(code)
+        self.counts = [0] * len(code)
+
+    def __getitem__(self, offset):
+        self.counts[offset] += 1
+        return list.__getitem__(self, offset)
+
+def count_work(statements):
+    # run the program once on the vm and count executed statements and operators
+    code, variable_names = compile_statements(statements)
+    counting_code = CountingCode(code)
+    run_code(counting_code, variable_names, MemorySink(), ListSource([]))
+    # the body of an if is its own instruction after the JUMP_UNLESS,
+    # but part of the same statement
+    bodies = {offset + 1 for offset, instruction in enumerate(code) if instruction[0] in (JUMP_UNLESS, COMPARE_JUMP_UNLESS)}
+    executed_statements = sum(count for offset, count in enumerate(counting_code.counts) if offset not in bodies)
+    executed_operators = sum(count * expression_operators(instruction_expression(code[offset])) for offset, count in enumerate(counting_code.counts))
+    return executed_statements, executed_operators
+
+def prepare(content, optimize):
+    statements = parse_content(content)
+    if optimize:
+        from optimize import optimize
+        statements = optimize(statements)
+    return statements
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def run_once(statements, engine):
+    output = MemorySink()
+    start = time.perf_counter()
+    if engine == 'vm':
+        process_statements_vm(statements, output, ListSource([]))
+    elif engine == 'py':
+        # includes translating and compiling, like the vm includes compiling
+        process_statements_py(statements, output, ListSource([]))
+    else:
+        process_statements(statements, output, ListSource([]))
+    return time.perf_counter() - start
+
+def run_benchmark(content, engine, optimize, repeats):
+    parse_seconds = min(timed(parse_content, content) for _ in range(repeats))
+    statements = prepare(content, optimize)
+    run_seconds = min(run_once(statements, engine) for _ in range(repeats))
+    executed_statements, executed_operators = count_work(statements)
+    tracemalloc.start()
+    try:
+        run_once(prepare(content, optimize), engine)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'statements': executed_statements,
+        'operators': executed_operators,
+        'parse_seconds': parse_seconds,
+        'run_seconds': run_seconds,
+        'statements_per_second': executed_statements / run_seconds,
+        'operators_per_second': executed_operators / run_seconds,
+        'peak_memory_kib': peak_memory / 1024
+    }
+
+def workloads(sizes):
+    # yield (name, program text) for every benchmark file and generated program
+    for filename in sorted(os.listdir(BENCHMARK_DIR)):
+        if filename.endswith('.stackto'):
+            with open(os.path.join(BENCHMARK_DIR, filename), 'r') as f:
+                yield filename[:-len('.stackto')], f.read()
+    for generator_name, generator in sorted(GENERATORS.items()):
+        for size in sizes:
+            yield '%s/%s' % (generator_name, size), generator(size)
+
+def format_rate(rate):
+    if rate >= 1e6:
+        return '%.2fM' % (rate / 1e6)
+    if rate >= 1e3:
+        return '%.1fk' % (rate / 1e3)
+    return '%.0f' % rate
+
+def print_results(results):
+    print('%-24s %10s %10s %10s %10s %10s %10s' % ('benchmark', 'stmts', 'stmts/s', 'ops/s', 'parse ms', 'run ms', 'peak KiB'))
+    for name, result in results.items():
+        print('%-24s %10s %10s %10s %10.1f %10.1f %10.0f' % (
+            name, result['statements'],
+            format_rate(result['statements_per_second']), format_rate(result['operators_per_second']),
+            result['parse_seconds'] * 1000, result['run_seconds'] * 1000, result['peak_memory_kib']
+        ))
+
+def compare_results(old, new, threshold):
+    # print the run and parse time ratios new/old for every benchmark in both
+    # and return the names of the ones that got slower by more than threshold percent
+    regressions = []
+    print('%-24s %10s %10s %10s %10s' % ('benchmark', 'old ms', 'new ms', 'run', 'parse'))
+    for name in old['results']:
+        if name not in new['results']:
+            continue
+        old_result = old['results'][name]
+        new_result = new['results'][name]
+        run_ratio = new_result['run_seconds'] / old_result['run_seconds']
+        parse_ratio = new_result['parse_seconds'] / old_result['parse_seconds']
+        slower = max(run_ratio, parse_ratio) > 1 + threshold / 100
+        if slower:
+            regressions.append(name)
+        print('%-24s %10.1f %10.1f %9.2fx %9.2fx%s' % (
+            name, old_result['run_seconds'] * 1000, new_result['run_seconds'] * 1000,
+            run_ratio, parse_ratio, '  REGRESSION' if slower else ''
+        ))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the StackTo interpreter benchmarks.')
+    parser.add_argument('-e', '--engine', help='Execution engine to benchmark', choices=['tree', 'vm', 'py'], default='tree')
+    parser.add_argument('-O', '--optimize', help='Benchmark programs optimized like interpreter.py --optimize', action='store_true')
+    parser.add_argument('-r', '--repeats', help='Number of timed runs per benchmark, the fastest is reported', type=int, default=3)
+    parser.add_argument('-s', '--sizes', help='Sizes of the generated programs', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('-k', '--filter', help='Only run benchmarks whose name matches this glob pattern', default='*')
+    parser.add_argument('-o', '--outfile', help='JSON file to save the results to')
+    parser.add_argument('--compare', help='Compare NEW (or a fresh run) against the saved results in OLD', nargs='+', metavar=('OLD', 'NEW'))
+    parser.add_argument('-t', '--threshold', help='Slowdown in percent reported as a regression by --compare', type=float, default=10)
+    args = parser.parse_args()
+    compare = getattr(args, 'compare')
+    if compare and len(compare) > 2:
+        parser.error('--compare takes OLD and optionally NEW')
+
+    if compare and len(compare) == 2:
+        with open(compare[1], 'r') as f:
+            new = json.load(f)
+    else:
+        engine = getattr(args, 'engine')
+        optimize = getattr(args, 'optimize')
+        repeats = getattr(args, 'repeats')
+        results = {}
+        for name, content in workloads(getattr(args, 'sizes')):
+            if fnmatch(name, getattr(args, 'filter')):
+                results[name] = run_benchmark(content, engine, optimize, repeats)
+        new = {
+            'engine': engine,
+            'optimize': optimize,
+            'python': platform.python_version(),
+            'results': results
+        }
+        print_results(results)
+        outfilename = getattr(args, 'outfile')
+        if outfilename:
+            with open(outfilename, 'w') as f:
+                json.dump(new, f, indent=2)
+
+    if compare:
+        with open(compare[0], 'r') as f:
+            old = json.load(f)
+        if len(compare) == 1:
+            print()
+        regressions = compare_results(old, new, getattr(args, 'threshold'))
+        if regressions:
+            print('%s regression(s) above %s%%: %s' % (len(regressions), getattr(args, 'threshold'), ', '.join(regressions)))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import gc
+import os
+import sys
+import marshal
+import hashlib
+from interpreter import OPERATORS, FAST_OPERATORS, Expression, ListValue, SetValue, DictValue, new_list, new_set, new_dict, load_program
+
+# on-disk cache of parsed (and optimized) StackTo programs, like .pyc files
+# the cache file of a program lives in a __stackto_cache__ directory next
+# to it (or in the given cache directory) and holds the parsed statements,
+# plus the optimized statements once they have been asked for, under a key
+# made from the program source, the source of the interpreter modules that
+# produce them and the python version (marshal is not portable between
+# versions)
+# a stale, corrupt or unreadable cache file is ignored and rewritten, and
+# failing to write one (e.g. a read-only directory) only skips caching
+# the warnings printed while parsing are kept as well and printed again
+# when the program is loaded from the cache
+
+CACHE_DIRNAME = '__stackto_cache__'
+CACHE_FORMAT = 3
+# modules whose code decides the parsed and optimized statements
+SOURCE_MODULES = ('interpreter.py', 'optimize.py', 'typecheck.py', 'cfg.py')
+
+_interpreter_version = None
+
+def interpreter_version():
+    # digest of the interpreter modules, so that changing them invalidates every cache file
+    global _interpreter_version
+    if _interpreter_version is None:
+        digest = hashlib.sha256(('%s %s %s' % (CACHE_FORMAT, sys.version, marshal.version)).encode())
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in SOURCE_MODULES:
+            with open(os.path.join(directory, name), 'rb') as f:
+                digest.update(f.read())
+        _interpreter_version = digest.hexdigest()
+    return _interpreter_version
+
+def cache_path(filename, cache_dir=None):
+    filename = os.path.abspath(filename)
+    directory, name = os.path.split(filename)
+    if cache_dir is None:
+        return os.path.join(directory, CACHE_DIRNAME, name + '.stc')
+    # programs from different directories share the cache directory
+    path_digest = hashlib.sha256(filename.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, '%s-%s.stc' % (name, path_digest))
+
+# statements are stored as plain tuples, lists and values: expressions as
+# (source, code) with operators as ('op', token) or ('fast', token), list
+# values as tuples of their items, and set and dict values as {'set': items}
+# and {'dict': (key, value) pairs} (a python set would merge true and 1)
+
+def encode_value(value):
+    if type(value) is ListValue:
+        return tuple(encode_value(item) for item in value)
+    if type(value) is SetValue:
+        return {'set': tuple(value)}
+    if type(value) is DictValue:
+        return {'dict': tuple((key, encode_value(item)) for key, item in value.items())}
+    return value
+
+def decode_value(value):
+    if type(value) is tuple:
+        return new_list([decode_value(item) for item in value])
+    if type(value) is dict:
+        if 'set' in value:
+            return new_set(value['set'])
+        return new_dict((key, decode_value(item)) for key, item in value['dict'])
+    return value
+
+def encode_exp(expression):
+    if expression.code is None:
+        return expression.source, None
+    code = []
+    for kind, arg in expression.code:
+        if kind == 'value':
+            code.append(('value', encode_value(arg)))
+        elif kind == 'var':
+            code.append(('var', arg))
+        else:
+            code.append(('op' if kind is OPERATORS[arg] else 'fast', arg))
+    return expression.source, code
+
+def decode_exp(encoded):
+    source, encoded_code = encoded
+    if encoded_code is None:
+        return Expression(source, None)
+    code = []
+    for kind, arg in encoded_code:
+        if kind == 'value':
+            code.append(('value', decode_value(arg)))
+        elif kind == 'var':
+            code.append(('var', arg))
+        else:
+            code.append(((OPERATORS if kind == 'op' else FAST_OPERATORS)[arg], arg))
+    return Expression(source, code)
+
+def encode_statement(statement):
+    statement_type = statement[0]
+    if statement_type == 'set':
+        return 'set', statement[1], encode_exp(statement[2])
+    if statement_type == 'outputexp':
+        return 'outputexp', encode_exp(statement[1])
+    if statement_type == 'if':
+        return 'if', encode_exp(statement[1]), encode_statement(statement[2])
+    return statement
+
+def decode_statement(encoded):
+    statement_type = encoded[0]
+    if statement_type == 'set':
+        return 'set', encoded[1], decode_exp(encoded[2])
+    if statement_type == 'outputexp':
+        return 'outputexp', decode_exp(encoded[1])
+    if statement_type == 'if':
+        return 'if', decode_exp(encoded[1]), decode_statement(encoded[2])
+    return tuple(encoded)
+
+def read_cache(path, key):
+    # forms stored under key, or None when the file is missing, stale or corrupt
+    try:
+        with open(path, 'rb') as f:
+            cache_format, cache_key, forms = marshal.loads(f.read())
+        if cache_format != CACHE_FORMAT or cache_key != key or type(forms) is not dict:
+            return None
+        return forms
+    except Exception:
+        return None
+
+def write_cache(path, key, forms):
+    # write to a temporary file first so that concurrent runs never see a partial file
+    temporary = '%s.%s.tmp' % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temporary, 'wb') as f:
+            f.write(marshal.dumps((CACHE_FORMAT, key, forms)))
+        os.replace(temporary, path)
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+def load_program_cached(filename, optimized=False, cache_dir=None, warn=print):
+    # parsed statements of a program file (optimized as by --optimize with
+    # optimized), from its cache file when that is up to date
+    # warn is called with the text of every warning, as for load_program
+    # loading creates a tuple or two per statement and nothing cyclic, so the
+    # garbage collector is paused instead of scanning them over and over
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return _load_program_cached(filename, optimized, cache_dir, warn)
+    finally:
+        if collecting:
+            gc.enable()
+
+def _load_program_cached(filename, optimized, cache_dir, warn):
+    with open(filename, 'rb') as f:
+        content = f.read()
+    key = hashlib.sha256(interpreter_version().encode() + content).hexdigest()
+    form = 'optimized' if optimized else 'parsed'
+    path = cache_path(filename, cache_dir)
+    forms = read_cache(path, key) or {}
+    statements = None
+    try:
+        if form in forms:
+            statements = [decode_statement(statement) for statement in forms[form]]
+            for warning in forms['warnings']:
+                warn(warning)
+            return statements
+        if 'parsed' in forms:
+            statements = [decode_statement(statement) for statement in forms['parsed']]
+            for warning in forms['warnings']:
+                warn(warning)
+    except Exception:
+        forms = {}
+        statements = None
+    if statements is None:
+        warnings = []
+        statements = load_program(content, warn=warnings.append)[0]
+        for warning in warnings:
+            warn(warning)
+        forms['parsed'] = [encode_statement(statement) for statement in statements]
+        forms['warnings'] = warnings
+    if optimized:
+        from optimize import optimize
+        statements = optimize(statements)
+        forms['optimized'] = [encode_statement(statement) for statement in statements]
+    write_cache(path, key, forms)
+    return statements
@@ -0,0 +1,244 @@
+from collections import defaultdict
+
+# control flow graph of parsed StackTo statements
+# statements are grouped into basic blocks, which start at the first
+# statement, at every mark and after every goto or if ... goto, so that
+# control only enters a block at its first statement and only leaves it
+# after its last one
+# every edge has a kind:
+#   'fallthrough'   to the next block
+#   'goto'          from a goto to the block of its mark
+#   'true'          from an if ... goto to the block of its mark
+#   'false'         from an if ... goto to the next block
+# an if with any other body is a single statement without branches, and a
+# goto to an undefined mark has no edge (it fails when reached)
+# building the graph is linear in the number of statements, dominators
+# are near-linear (Lengauer-Tarjan with path compression) and listing loop
+# bodies is linear in their total size
+
+class BasicBlock:
+    # statements[start:end] of the program, successors are (block, kind)
+    # pairs and predecessors are block indices
+    __slots__ = ('index', 'start', 'end', 'successors', 'predecessors')
+
+    def __init__(self, index, start, end):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.successors = []
+        self.predecessors = []
+
+    def __repr__(self):
+        return '<block %s: statements %s..%s>' % (self.index, self.start, self.end - 1)
+
+class Loop:
+    # natural loop: the header block, every block in the loop (sorted), and
+    # the back edges (from block, header) that close it
+    __slots__ = ('header', 'blocks', 'back_edges')
+
+    def __init__(self, header, blocks, back_edges):
+        self.header = header
+        self.blocks = blocks
+        self.back_edges = back_edges
+
+    def __repr__(self):
+        return '<loop at block %s: blocks %s>' % (self.header, self.blocks)
+
+class ControlFlowGraph:
+    # blocks[0] is the entry block, block_of[i] is the block of statement i
+    # and marks maps mark names to statement indices
+    def __init__(self, statements, blocks, block_of, marks):
+        self.statements = statements
+        self.blocks = blocks
+        self.block_of = block_of
+        self.marks = marks
+        self._idom = None
+        self._dominator_intervals = None
+
+    def statement_edges(self):
+        # yield (from statement, to statement, kind) for every edge between statements
+        for block in self.blocks:
+            for index in range(block.start, block.end - 1):
+                yield index, index + 1, 'fallthrough'
+            for successor, kind in block.successors:
+                yield block.end - 1, self.blocks[successor].start, kind
+
+    def immediate_dominators(self):
+        # idom[b] is the immediate dominator of block b, the entry block is
+        # its own and unreachable blocks have None
+        if self._idom is None:
+            self._idom = immediate_dominators(self.blocks)
+        return self._idom
+
+    def dominates(self, a, b):
+        # whether every path from the entry to block b goes through block a
+        if self._dominator_intervals is None:
+            self._dominator_intervals = dominator_tree_intervals(self.immediate_dominators())
+        enter, leave = self._dominator_intervals
+        if enter[a] is None or enter[b] is None:
+            return False
+        return enter[a] <= enter[b] and leave[b] <= leave[a]
+
+    def loops(self):
+        # natural loops, one per header, sorted by header
+        idom = self.immediate_dominators()
+        back_edges = defaultdict(list)
+        for block in self.blocks:
+            if idom[block.index] is None:
+                continue
+            for successor, _ in block.successors:
+                if self.dominates(successor, block.index):
+                    back_edges[successor].append((block.index, successor))
+        loops = []
+        for header in sorted(back_edges):
+            body = {header}
+            worklist = [source for source, _ in back_edges[header]]
+            while worklist:
+                block_index = worklist.pop()
+                if block_index in body:
+                    continue
+                body.add(block_index)
+                worklist.extend(p for p in self.blocks[block_index].predecessors if idom[p] is not None)
+            loops.append(Loop(header, sorted(body), back_edges[header]))
+        return loops
+
+def branch_target(statement):
+    # (mark name, conditional) for goto and if ... goto, None otherwise
+    if statement[0] == 'goto':
+        return statement[1], False
+    if statement[0] == 'if' and statement[2][0] == 'goto':
+        return statement[2][1], True
+    return None
+
+def build_cfg(statements):
+    marks = {}
+    for statement_index, statement in enumerate(statements):
+        if statement[0] == 'mark':
+            markname = statement[1]
+            if markname in marks:
+                raise SyntaxError('mark: duplicate marker "%s" (statements %s, %s)' % (markname, marks[markname], statement_index))
+            marks[markname] = statement_index
+
+    leaders = [False] * len(statements)
+    for statement_index, statement in enumerate(statements):
+        if statement_index == 0 or statement[0] == 'mark':
+            leaders[statement_index] = True
+        if branch_target(statement) is not None and statement_index + 1 < len(statements):
+            leaders[statement_index + 1] = True
+
+    blocks = []
+    block_of = [0] * len(statements)
+    for statement_index in range(len(statements)):
+        if leaders[statement_index]:
+            if blocks:
+                blocks[-1].end = statement_index
+            blocks.append(BasicBlock(len(blocks), statement_index, len(statements)))
+        block_of[statement_index] = len(blocks) - 1
+
+    def add_edge(block, successor, kind):
+        block.successors.append((successor, kind))
+        blocks[successor].predecessors.append(block.index)
+
+    for block in blocks:
+        has_next = block.index + 1 < len(blocks)
+        branch = branch_target(statements[block.end - 1])
+        if branch is None:
+            if has_next:
+                add_edge(block, block.index + 1, 'fallthrough')
+            continue
+        markname, conditional = branch
+        if markname in marks:
+            add_edge(block, block_of[marks[markname]], 'true' if conditional else 'goto')
+        if conditional and has_next:
+            add_edge(block, block.index + 1, 'false')
+    return ControlFlowGraph(statements, blocks, block_of, marks)
+
+def immediate_dominators(blocks):
+    # Lengauer-Tarjan with path compression, without recursion so that
+    # programs with many blocks do not hit the recursion limit
+    if not blocks:
+        return []
+    count = len(blocks)
+    # depth-first numbering from the entry block
+    semi = [-1] * count
+    parent = [-1] * count
+    vertex = []
+    stack = [(0, -1)]
+    while stack:
+        block_index, from_index = stack.pop()
+        if semi[block_index] != -1:
+            continue
+        semi[block_index] = len(vertex)
+        vertex.append(block_index)
+        parent[block_index] = from_index
+        for successor, _ in reversed(blocks[block_index].successors):
+            if semi[successor] == -1:
+                stack.append((successor, block_index))
+
+    ancestor = [-1] * count
+    label = list(range(count))
+    idom = [None] * count
+    bucket = [[] for _ in range(count)]
+
+    def evaluate(v):
+        if ancestor[v] == -1:
+            return v
+        # compress the path from v to the root of its tree
+        path = []
+        w = v
+        while ancestor[ancestor[w]] != -1:
+            path.append(w)
+            w = ancestor[w]
+        for w in reversed(path):
+            a = ancestor[w]
+            if semi[label[a]] < semi[label[w]]:
+                label[w] = label[a]
+            ancestor[w] = ancestor[a]
+        return label[v]
+
+    for number in range(len(vertex) - 1, 0, -1):
+        w = vertex[number]
+        for v in blocks[w].predecessors:
+            if semi[v] == -1:
+                # unreachable predecessor
+                continue
+            u = evaluate(v)
+            if semi[u] < semi[w]:
+                semi[w] = semi[u]
+        bucket[vertex[semi[w]]].append(w)
+        ancestor[w] = parent[w]
+        for v in bucket[parent[w]]:
+            u = evaluate(v)
+            idom[v] = u if semi[u] < semi[v] else parent[w]
+        bucket[parent[w]] = []
+    for number in range(1, len(vertex)):
+        w = vertex[number]
+        if idom[w] != vertex[semi[w]]:
+            idom[w] = idom[idom[w]]
+    idom[0] = 0
+    return idom
+
+def dominator_tree_intervals(idom):
+    # entry and exit times of every block in a walk of the dominator tree,
+    # so that a dominates b when b's interval lies inside a's
+    children = [[] for _ in idom]
+    for block_index, dominator in enumerate(idom):
+        if dominator is not None and block_index != dominator:
+            children[dominator].append(block_index)
+    enter = [None] * len(idom)
+    leave = [None] * len(idom)
+    if not idom:
+        return enter, leave
+    clock = 0
+    stack = [(0, False)]
+    while stack:
+        block_index, done = stack.pop()
+        if done:
+            leave[block_index] = clock
+            clock += 1
+            continue
+        enter[block_index] = clock
+        clock += 1
+        stack.append((block_index, True))
+        stack.extend((child, False) for child in children[block_index])
+    return enter, leave
@@ -0,0 +1,185 @@
+from interpreter import (
+    TYPE_NAMES, StreamSink, Unset, load_program, new_list, new_set, new_dict, resolve_slots, find_marks, type_of,
+    new_registers, execute_statements
+)
+
+# embedding api for running StackTo programs from python
+# a Program is loaded (and optimized) once and compiled for an engine the
+# first time it runs on it, and an Interpreter runs programs with its
+# output sink and input source, as often as needed, each run starting from
+# no variables or from the variables it is given
+#   program = Program.from_source('output [$n 2 *];')
+#   interpreter = Interpreter(output=MemorySink())
+#   interpreter.run(program, {'n': 21})
+# variables are passed and returned as dicts of StackTo values (bool,
+# int or float, str, lists, sets and dicts, which can be given as python
+# lists, sets and dicts)
+# an Interpreter with limits (see limits.py) stops every run that goes over
+# them with LimitExceeded
+# an optimized program runs the operators typecheck.py proves correct
+# without their checks, and that proof only knows about the values the
+# program sets itself, so a run starting from variables of other types
+# runs a copy of the program specialized for them
+
+ENGINES = ('tree', 'vm', 'py')
+
+class Program:
+    # parsed statements, plus what each engine compiled them to
+    # optimized programs also keep the variable types their operators were
+    # proven for and their copies specialized for other starting types
+    __slots__ = ('statements', 'compiled', 'optimized', 'variable_types', 'specialized')
+
+    def __init__(self, statements, optimized=False):
+        self.statements = statements
+        self.compiled = {}
+        self.optimized = optimized
+        self.variable_types = None
+        self.specialized = {}
+
+    @classmethod
+    def from_source(cls, source, optimize=False):
+        # source is a str, bytes or a file, as for load_program
+        statements = load_program(source)[0]
+        if optimize:
+            from optimize import optimize as optimize_statements
+            statements = optimize_statements(statements)
+        return cls(statements, optimize)
+
+    @classmethod
+    def from_file(cls, filename, optimize=False, use_cache=True, cache_dir=None):
+        # load a program file, through the compiled program cache with use_cache
+        if use_cache:
+            from cache import load_program_cached
+            return cls(load_program_cached(filename, optimize, cache_dir), optimize)
+        with open(filename, 'rb') as f:
+            return cls.from_source(f, optimize)
+
+    def for_variables(self, variables):
+        # the program to run starting from variables (a dict of StackTo
+        # values): this program, or for an optimized program and variables
+        # of types it was not proven for, a copy specialized for them
+        if not self.optimized or not variables:
+            return self
+        from typecheck import infer_variable_types, specialize
+        if self.variable_types is None:
+            self.variable_types = infer_variable_types(self.statements)
+        other_types = frozenset(
+            (varname, type_of(value)) for varname, value in variables.items()
+            if type_of(value) not in self.variable_types.get(varname, ())
+        )
+        if not other_types:
+            return self
+        if other_types not in self.specialized:
+            initial_types = {}
+            for varname, type_name in other_types:
+                initial_types[varname] = self.variable_types.get(varname, frozenset()) | {type_name}
+            self.specialized[other_types] = Program(specialize(self.statements, initial_types), True)
+        return self.specialized[other_types]
+
+    def compile(self, engine, limited=False):
+        # what engine runs, compiled on first use
+        # with limited, also the arguments for limits.Budget that do not
+        # change between runs, and the py engine translates the program with
+        # its jumps reported
+        key = engine, limited
+        if key not in self.compiled:
+            if engine == 'tree':
+                statements, variable_names = resolve_slots(self.statements)
+                compiled = statements, variable_names, find_marks(statements)
+            elif engine == 'vm':
+                from vm import compile_statements
+                compiled = compile_statements(self.statements)
+            elif engine == 'py':
+                from translate import compile_program
+                compiled = compile_program(self.statements, limited=limited)[0]
+            else:
+                raise ValueError('program: unknown engine "%s" (should be one of %s)' % (engine, ', '.join(ENGINES)))
+            if limited:
+                if engine == 'vm':
+                    from vm import code_counts
+                    budget_args = code_counts(compiled[0])
+                else:
+                    from limits import statement_counts
+                    budget_args = statement_counts(self.statements)
+                if engine == 'py':
+                    from translate import variable_names
+                    budget_args += None, sorted(variable_names(self.statements))
+                compiled = compiled, budget_args
+            self.compiled[key] = compiled
+        return self.compiled[key]
+
+def to_value(value):
+    # StackTo value of a python value
+    if type(value) in (list, tuple):
+        return new_list([to_value(item) for item in value])
+    if type(value) in (set, frozenset):
+        return new_set([to_key(item) for item in value])
+    if type(value) is dict:
+        return new_dict((to_key(key), to_value(item)) for key, item in value.items())
+    if type(value) not in TYPE_NAMES:
+        raise ValueError('interpreter: value of unsupported type %s: %r' % (type(value).__name__, value))
+    return value
+
+def to_key(value):
+    # StackTo set item or dict key of a python value
+    if type(value) not in (bool, int, float, str):
+        raise ValueError('interpreter: value of type %s cannot be a key: %r' % (type(value).__name__, value))
+    return value
+
+class Interpreter:
+    # runs programs on one engine, writing to output (a buffered stdout
+    # StreamSink by default) and reading from input_source (input() by
+    # default)
+    # variables holds the variables as the last run that finished left them
+    def __init__(self, output=None, input_source=None, engine='tree', limits=None):
+        if engine not in ENGINES:
+            raise ValueError('interpreter: unknown engine "%s" (should be one of %s)' % (engine, ', '.join(ENGINES)))
+        self.output = StreamSink() if output is None else output
+        self.input_source = input_source
+        self.engine = engine
+        self.limits = limits
+        self.variables = {}
+
+    def run(self, program, variables=None):
+        # run program starting from variables (none by default) and return
+        # the variables it ends with, which are also kept in self.variables
+        # to carry them over, pass them to the next run
+        start = {} if variables is None else {varname: to_value(value) for varname, value in variables.items()}
+        program = program.for_variables(start)
+        limits = self.limits
+        compiled = program.compile(self.engine, limits is not None)
+        if limits is not None:
+            from limits import Budget
+            compiled, budget_args = compiled
+        read_line = input if self.input_source is None else self.input_source.read_line
+        try:
+            if self.engine == 'py':
+                from translate import UNSET
+                if limits is None:
+                    ended = compiled(self.output.write_line, read_line, start)
+                else:
+                    budget = Budget(limits, *budget_args)
+                    ended = compiled(self.output.write_line, read_line, start, budget.jump, budget.check_values)
+                ended = {varname: value for varname, value in ended.items() if value is not UNSET}
+            else:
+                if self.engine == 'tree':
+                    statements, variable_names, marker_dict = compiled
+                else:
+                    code, variable_names = compiled
+                registers = new_registers(variable_names)
+                for slot, varname in enumerate(variable_names):
+                    if varname in start:
+                        registers[slot] = start[varname]
+                on_jump = None if limits is None else Budget(limits, *budget_args, registers, variable_names).jump
+                if self.engine == 'tree':
+                    execute_statements(statements, marker_dict, registers, self.output.write_line, read_line, on_jump)
+                else:
+                    from vm import run_code
+                    run_code(code, variable_names, self.output, self.input_source, registers, on_jump)
+                ended = {varname: value for varname, value in zip(variable_names, registers) if type(value) is not Unset}
+        finally:
+            self.output.flush()
+        # variables the program does not use are passed through
+        self.variables = dict(start)
+        self.variables.update(ended)
+        return self.variables
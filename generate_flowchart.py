@@ -1,15 +1,11 @@
 import sys
 import os
-from itertools import tee
 import argparse
 import graphviz
 from interpreter import parse_content
+from cfg import build_cfg
 
-def pairwise(iterable):
-    # pairwise('ABCDEFG') --> AB BC CD DE EF FG
-    a, b = tee(iterable)
-    next(b, None)
-    return zip(a, b)
+EDGE_LABELS = {'true': 'True', 'false': 'False'}
 
 def node_str(statement):
     return str(statement).replace(':', '..')
@@ -27,6 +23,17 @@ if __name__ == '__main__':
     if outfilename is None:
         outfilename = 'flowchart_{}.gv'.format(sys.argv[1].split(os.path.sep)[-1])
     statements = parse_content(filecontent)
+    cfg = build_cfg(statements)
+    # jump edges are drawn with the node they leave from, and the other
+    # edges after all the nodes, in statement order
+    jump_edges = {}
+    next_edges = []
+    for a, b, kind in cfg.statement_edges():
+        if kind in ('goto', 'true'):
+            jump_edges[a] = b, kind
+        else:
+            next_edges.append((a, b, kind))
+    next_edges.sort(key=lambda edge: edge[0])
 
     # print('statements:', statements)
 
@@ -64,7 +71,7 @@ if __name__ == '__main__':
             g.node(node_str(statement))
             g.attr('node', {'shape' : DEFAULT})
 
-    for statement in statements:
+    for index, statement in enumerate(statements):
         statement_type, *args = statement
         if statement_type in ['mark', 'outputvar', 'outputexp', 'set']:
             if statement_type == 'mark':
@@ -84,7 +91,7 @@ if __name__ == '__main__':
                 raise SyntaxError('undefined mark: ' + mark)
             g.attr('node', {'shape' : 'oval'})
             g.node(node_str(statement))
-            g.edge(node_str(statement), node_str(('mark', mark)))
+            g.edge(node_str(statement), node_str(statements[jump_edges[index][0]]))
             g.attr('node', {'shape' : DEFAULT})
         elif statement_type == 'if':
             guard, body = args
@@ -96,24 +103,12 @@ if __name__ == '__main__':
                 mark = bodyargs[0]
                 if mark not in markers:
                     raise SyntaxError('undefined mark: ' + mark)
-                g.edge(node_str(statement), node_str(('mark', mark)), 'True')
+                g.edge(node_str(statement), node_str(statements[jump_edges[index][0]]), 'True')
         else:
             raise ValueError('unknown statement type: ' + statement_type)
 
-    for a,b in pairwise(statements):
-        # print('pair [', a, ',', b, ']')
-        a_type, *rest = a
-        if a_type == 'if':
-            _, body = rest
-            bodytype, *_ = body
-            if bodytype == 'goto':
-                g.edge(node_str(a), node_str(b), 'False')
-            else:
-                g.edge(node_str(a), node_str(b))
-        elif a_type == 'goto':
-            continue
-        else:
-            g.edge(node_str(a), node_str(b))
+    for a, b, kind in next_edges:
+        g.edge(node_str(statements[a]), node_str(statements[b]), EDGE_LABELS.get(kind))
 
     g.render(outfilename, format='png', engine='dot')
 
@@ -1,42 +1,32 @@
 import sys
 import os
 import argparse
-from interpreter import parse_content, tokenize_exp, is_number
-from interpreter import UNOPS, BINOPS, TRINOPS, NOPS
-
-def combine_keys(*args):
-    keys = set()
-    for iterable in args:
-        if type(iterable) == set:
-            keys |= iterable
-        elif type(iterable) == dict:
-            keys |= set(iterable.keys())
-        elif type(iterable) == list:
-            keys |= set(iterable)
-        else:
-            raise ValueError('cannot get keys of type %s' % type(iterable))
-    return keys
+from interpreter import parse_content, scan_exp
+
+# css class of each token type
+TOKEN_CLASSES = {
+    'string':   'string',
+    'var':      'var',
+    'number':   'number',
+    'unop':     'op',
+    'binop':    'op',
+    'trinop':   'op',
+    'nop':      'op',
+    'bool':     'bool'
+}
 
 def hl_expr(exp):
-    if exp == 'input': return '<span class="op">input</span>'
+    exp = exp.source
+    if exp in ['input', 'inputnum']: return '<span class="op">%s</span>' % exp
     brackets = '<span class="bracket">[</span>%s<span class="bracket">]</span>'
     inner = exp[1:-1]
     # empty expression, just return '[]'
     if not inner: return brackets % ''
     # highlight all tokens
-    tokens = tokenize_exp(exp[1:-1])
     highlighted_tokens = []
-    for token in tokens:
-        if token[0] in ["'", '"']:
-            highlighted_tokens.append('<span class="string">%s</span>' % token)
-        elif token[0] == '$':
-            highlighted_tokens.append('<span class="var">%s</span>' % token)
-        elif is_number(token):
-            highlighted_tokens.append('<span class="number">%s</span>' % token)
-        elif token in combine_keys(UNOPS, BINOPS, TRINOPS, NOPS):
-            highlighted_tokens.append('<span class="op">%s</span>' % token)
-        elif token.lower() in ['f', 'false', 't', 'true']:
-            highlighted_tokens.append('<span class="bool">%s</span>' % token)
+    for tokentype, token, _ in scan_exp(inner):
+        if tokentype in TOKEN_CLASSES:
+            highlighted_tokens.append('<span class="%s">%s</span>' % (TOKEN_CLASSES[tokentype], token))
         else:
             highlighted_tokens.append(token)
     return brackets % (' '.join(highlighted_tokens))
@@ -1,17 +1,298 @@
+import io
+import os
 import sys
+import stat
 import re
+import codecs
+import math
 import random
 import argparse
-from itertools import product
+from array import array
+from itertools import product, islice
 
-DATA_TYPES = {'bool', 'number', 'string', 'list'}
+DATA_TYPES = {'bool', 'number', 'string', 'list', 'set', 'dict'}
 
-# ? casts to bool, ! is not, ~ is unary minus, # is len(list)
+# types of set items and dict keys
+KEY_TYPES = {'bool', 'number', 'string'}
+
+# values are stored as plain python objects and their StackTo type is
+# derived from the python type: bool, number (int or float), string (str),
+# list (ListValue), set (SetValue) and dict (DictValue)
+# numbers produced by '#' are ints, which print without a decimal point
+
+class ListValue:
+    # immutable list value
+    # lists built from each other share one item buffer: a value only sees
+    # the first length items, and the value whose length reaches the end of
+    # the buffer owns it, so appending to it (':' and '@') extends the buffer
+    # in place without affecting older values
+    # any other change (setnth, appending to a non-owner) copies first
+    # lists made up only of floats keep their items in an array('d')
+    __slots__ = ('items', 'length')
+
+    def __init__(self, items):
+        self.items = items
+        self.length = len(items)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        if self.length == len(self.items):
+            return iter(self.items)
+        return islice(self.items, self.length)
+
+    def __getitem__(self, index):
+        # only called with 0 <= index < length
+        return self.items[index]
+
+    def is_numeric(self):
+        return type(self.items) is array
+
+    def owned_items(self):
+        # item buffer that can be extended in place
+        if self.length == len(self.items):
+            return self.items
+        return self.items[:self.length]
+
+    def append(self, item):
+        items = self.owned_items()
+        if type(items) is array and type(item) is not float:
+            items = list(items)
+        items.append(item)
+        return ListValue(items)
+
+    def concat(self, other):
+        items = self.owned_items()
+        if type(items) is array and not other.is_numeric():
+            items = list(items)
+        items.extend(other.items if other.length == len(other.items) else other)
+        return ListValue(items)
+
+    def replace(self, index, item):
+        items = self.items[:self.length]
+        if type(items) is array and type(item) is not float:
+            items = list(items)
+        items[index] = item
+        return ListValue(items)
+
+    def __eq__(self, other):
+        if not isinstance(other, ListValue):
+            return NotImplemented
+        if self.length != other.length:
+            return False
+        if self.is_numeric() and other.is_numeric():
+            return self.items[:self.length] == other.items[:other.length]
+        return all(values_equal(a, b) for a, b in zip(self, other))
+
+    __hash__ = None
+
+    # formatted like a python list of (type, value) pairs
+    def __repr__(self):
+        return '[%s]' % ', '.join(typed_repr(item) for item in self)
+
+    __str__ = __repr__
+
+def new_list(values):
+    # values is a fresh python list that the new ListValue may take over
+    if all(type(value) is float for value in values):
+        return ListValue(array('d', values))
+    return ListValue(values)
+
+def hash_key(key):
+    # python dict key of a set item or dict key, keeping true and false
+    # apart from 1 and 0
+    if type(key) is bool:
+        return (key,)
+    return key
+
+def key_order(key):
+    # sort key of set items and dict keys: bools, then numbers, then strings
+    return TYPE_NAMES[type(key)], key
+
+class HashBuffer:
+    # hash table shared by set or dict values built from each other, and
+    # the log of (hash key, previous entry or None) of every change to it
+    __slots__ = ('table', 'log')
+
+    def __init__(self, table):
+        self.table = table
+        self.log = []
+
+class HashValue:
+    # immutable set or dict value, the table maps the hash_key of every
+    # item or key to its entry
+    # values built from each other share one HashBuffer: the table holds
+    # the newest value, whose version is the length of the log, so changing
+    # it (add, put, remove) changes the table in place and logs how to undo
+    # the change. an older value first takes a copy of the table with the
+    # later changes undone
+    # a buffer whose log grows past twice its table starts over with a copy
+    # of the table, so changes stay amortized O(1) and older values keep
+    # the log they need
+    __slots__ = ('buffer', 'version')
+
+    def __init__(self, buffer, version=0):
+        self.buffer = buffer
+        self.version = version
+
+    def table(self):
+        buffer = self.buffer
+        if self.version == len(buffer.log):
+            return buffer.table
+        table = dict(buffer.table)
+        log = buffer.log
+        for index in range(len(log) - 1, self.version - 1, -1):
+            key, entry = log[index]
+            if entry is None:
+                del table[key]
+            else:
+                table[key] = entry
+        self.buffer = HashBuffer(table)
+        self.version = 0
+        return table
+
+    def changed(self, key, entry):
+        # value with the entry of hash key replaced, or removed for None
+        table = self.table()
+        buffer = self.buffer
+        if len(buffer.log) > 2 * len(table) + 16:
+            table = dict(table)
+            buffer = HashBuffer(table)
+        buffer.log.append((key, table.get(key)))
+        if entry is None:
+            del table[key]
+        else:
+            table[key] = entry
+        return type(self)(buffer, len(buffer.log))
+
+    def __contains__(self, key):
+        return hash_key(key) in self.table()
+
+    def __len__(self):
+        return len(self.table())
+
+    __hash__ = None
+
+class SetValue(HashValue):
+    # entries are the items
+    __slots__ = ()
+
+    def __iter__(self):
+        # items in key_order
+        return iter(sorted(self.table().values(), key=key_order))
+
+    def add(self, item):
+        key = hash_key(item)
+        if key in self.table():
+            return self
+        return self.changed(key, item)
+
+    def remove(self, item):
+        return self.changed(hash_key(item), None)
+
+    def __eq__(self, other):
+        if not isinstance(other, SetValue):
+            return NotImplemented
+        return self.table().keys() == other.table().keys()
+
+    # formatted like a python set of (type, value) pairs
+    def __repr__(self):
+        return '{%s}' % ', '.join(typed_repr(item) for item in self)
+
+    __str__ = __repr__
+
+class DictValue(HashValue):
+    # entries are (key, value) pairs
+    __slots__ = ()
+
+    def __iter__(self):
+        # keys in key_order
+        return (key for key, _ in self.items())
+
+    def items(self):
+        return iter(sorted(self.table().values(), key=lambda entry: key_order(entry[0])))
+
+    def get(self, key):
+        # only called with keys in the dict
+        return self.table()[hash_key(key)][1]
+
+    def put(self, key, value):
+        return self.changed(hash_key(key), (key, value))
+
+    def remove(self, key):
+        return self.changed(hash_key(key), None)
+
+    def __eq__(self, other):
+        if not isinstance(other, DictValue):
+            return NotImplemented
+        table = self.table()
+        other_table = other.table()
+        if table.keys() != other_table.keys():
+            return False
+        return all(values_equal(value, other_table[key][1]) for key, (_, value) in table.items())
+
+    # formatted like a python dict of (type, value) pairs
+    def __repr__(self):
+        return '{%s}' % ', '.join('%s: %s' % (typed_repr(key), typed_repr(value)) for key, value in self.items())
+
+    __str__ = __repr__
+
+def new_set(items):
+    return SetValue(HashBuffer({hash_key(item): item for item in items}))
+
+def new_dict(items):
+    # items are (key, value) pairs, later pairs replace earlier ones
+    return DictValue(HashBuffer({hash_key(key): (key, value) for key, value in items}))
+
+TYPE_NAMES = {
+    bool: 'bool', int: 'number', float: 'number', str: 'string', ListValue: 'list',
+    SetValue: 'set', DictValue: 'dict'
+}
+
+PYTHON_TYPES = {
+    'bool': (bool,), 'number': (int, float), 'string': (str,), 'list': (ListValue,),
+    'set': (SetValue,), 'dict': (DictValue,)
+}
+
+def type_of(value):
+    return TYPE_NAMES[type(value)]
+
+def values_equal(a, b):
+    return TYPE_NAMES[type(a)] == TYPE_NAMES[type(b)] and a == b
+
+def typed_repr(value):
+    return '(%r, %r)' % (TYPE_NAMES[type(value)], value)
+
+def format_stack(stack):
+    # stack contents for error messages
+    return '[%s]' % ', '.join(typed_repr(value) for value in stack)
+
+def python_typesigs(typesigs):
+    # expand a set of type name signatures into python type signatures
+    expanded = set()
+    for typesig in typesigs:
+        if type(typesig) is str:
+            expanded.update(PYTHON_TYPES[typesig])
+        else:
+            expanded.update(product(*(PYTHON_TYPES[name] for name in typesig)))
+    return expanded
+
+# operators work on a single mutable stack of values
+# each operator token maps to a function in OPERATORS that pops its
+# arguments, checks their types against UNOPS/BINOPS/TRINOPS and pushes
+# its results in place, so an operator costs the same at any stack depth
+
+# ? casts to bool, ! is not, ~ is unary minus, # is the length of a list, set or dict
 # num casts to number, splat puts all the elements of the list into the stack
 # dup duplicates the top element, drop drops the top element of the stack
 # str casts to string, round rounds numbers to nearest int
+# toset makes a set of the items of a list, todict a dict of a list of
+# alternating keys and values, keys is the sorted list of the items of a
+# set or the keys of a dict and values the list of the values of a dict
+# in the order of their keys
 UNOPS = {
-    '#':{'list'},
+    '#':{'list', 'set', 'dict'},
     '~':{'number'}, 
     '!':{'bool'}, 
     '?':{'bool', 'number', 'string'},
@@ -23,52 +304,103 @@ UNOPS = {
     'round':{'number'},
     'sum':{'list'},
     'prod':{'list'},
-    'type':DATA_TYPES
+    'type':DATA_TYPES,
+    'toset':{'list'},
+    'todict':{'list'},
+    'keys':{'set', 'dict'},
+    'values':{'dict'}
 } 
 
-def process_unop(token, stack):
-    if len(stack) < 1:
-        raise ValueError('unop: stack too short (height %s, need >= 1): %s' % (len(stack), stack))
-    argtype, arg = stack.pop()
-    typesig = argtype
-    if not typesig in UNOPS[token]:
-        raise SyntaxError('unop: %s cannot process type "%s"' % (token, argtype))
-    if token == '#':            return stack + [('number', len(arg))]
-    if token == '~':            return stack + [('number', -arg)]
-    if token == '!':            return stack + [('bool', not arg)]
-    if token == 'dup':          return stack + [(argtype, arg), (argtype, arg)]
-    if token == 'drop':         return stack
-    if token == '?':            return stack + [('bool', bool(arg))]
-    if token == 'str':
-        if argtype == 'list':
-            return stack + [('string', '[%s]' % ', '.join(str(val) for _, val in arg))]
-        else:                   return stack + [('string', str(arg))]
-    if token == 'round':        return stack + [('number', round(arg, 0))]
-    if token == 'num':
-        if argtype == 'bool':   return stack + [('number', float(arg))]
-        if argtype == 'number': return stack + [('number', arg)]
-        if argtype == 'string':
-            if is_number(arg):
-                return stack + [('number', float(arg))]
+def unop_str(arg, stack):
+    if type(arg) is ListValue:
+        stack.append('[%s]' % ', '.join(str(val) for val in arg))
+    elif type(arg) is SetValue:
+        stack.append('{%s}' % ', '.join(str(val) for val in arg))
+    elif type(arg) is DictValue:
+        stack.append('{%s}' % ', '.join('%s: %s' % (key, val) for key, val in arg.items()))
+    else:
+        stack.append(str(arg))
+
+def unop_num(arg, stack):
+    if type(arg) is str:
+        if not is_number(arg):
             raise ValueError('unop: %s cannot be converted to type "number"' % arg)
-    if token == 'splat':        return stack + arg
-    if token == 'sum':
-        total = 0
-        for subtype, subarg in arg:
-            if not subtype == 'number':
-                raise ValueError('unop: %s of type %s cannot be processed as a number by "%s"' % (subarg, subtype, token))
-            total += subarg
-        return stack + [('number', total)]
-    if token == 'prod':
-        total = 1
-        for subtype, subarg in arg:
-            if not subtype == 'number':
-                raise ValueError('unop: %s of type %s cannot be processed as a number by "%s"' % (subarg, subtype, token))
-            total *= subarg
-        return stack + [('number', total)]
-    if token == 'type':         return stack + [('string', argtype)]
-    raise SyntaxError('unop: %s cannot be processed as a unop' % token)
+        stack.append(float(arg))
+    elif type(arg) is bool:
+        stack.append(float(arg))
+    else:
+        stack.append(arg)
+
+def check_numeric(token, arg):
+    if not arg.is_numeric():
+        for subarg in arg:
+            if not TYPE_NAMES[type(subarg)] == 'number':
+                raise ValueError('unop: %s of type %s cannot be processed as a number by "%s"' % (subarg, type_of(subarg), token))
+
+def unop_sum(arg, stack):
+    check_numeric('sum', arg)
+    # a plain left to right fold, since the builtin sum adds floats with
+    # compensated summation from python 3.12 on
+    total = 0
+    for subarg in arg:
+        total += subarg
+    stack.append(total)
 
+def unop_prod(arg, stack):
+    check_numeric('prod', arg)
+    stack.append(math.prod(arg))
+
+def check_key(token, key):
+    if not TYPE_NAMES[type(key)] in KEY_TYPES:
+        raise ValueError('unop: %s of type %s cannot be a key in "%s"' % (key, type_of(key), token))
+
+def unop_toset(arg, stack):
+    for item in arg:
+        check_key('toset', item)
+    stack.append(new_set(arg))
+
+def unop_todict(arg, stack):
+    if len(arg) % 2 != 0:
+        raise ValueError('unop: list of odd length %s passed to "todict" (should be keys and values)' % len(arg))
+    keys = arg.items[0:len(arg):2]
+    for key in keys:
+        check_key('todict', key)
+    stack.append(new_dict(zip(keys, arg.items[1:len(arg):2])))
+
+UNOP_FUNCTIONS = {
+    '#':        lambda arg, stack: stack.append(len(arg)),
+    '~':        lambda arg, stack: stack.append(-arg),
+    '!':        lambda arg, stack: stack.append(not arg),
+    '?':        lambda arg, stack: stack.append(bool(arg)),
+    'num':      unop_num,
+    'splat':    lambda arg, stack: stack.extend(arg),
+    'dup':      lambda arg, stack: stack.extend((arg, arg)),
+    'drop':     lambda arg, stack: None,
+    'str':      unop_str,
+    'round':    lambda arg, stack: stack.append(round(arg, 0)),
+    'sum':      unop_sum,
+    'prod':     unop_prod,
+    'type':     lambda arg, stack: stack.append(TYPE_NAMES[type(arg)]),
+    'toset':    unop_toset,
+    'todict':   unop_todict,
+    'keys':     lambda arg, stack: stack.append(new_list(list(arg))),
+    'values':   lambda arg, stack: stack.append(new_list([val for _, val in arg.items()]))
+}
+
+def make_unop(token, function):
+    allowed = python_typesigs(UNOPS[token])
+    def unop(stack):
+        if len(stack) < 1:
+            raise ValueError('unop: stack too short (height %s, need >= 1): %s' % (len(stack), format_stack(stack)))
+        arg = stack.pop()
+        if not type(arg) in allowed:
+            raise SyntaxError('unop: %s cannot process type "%s"' % (token, type_of(arg)))
+        function(arg, stack)
+    return unop
+
+# contains tests for an item of a list or set or a key of a dict (in O(1)
+# for sets and dicts), add adds an item to a set, get is the value of a
+# key of a dict and remove removes an item of a set or a key of a dict
 BINOPS = {
     '<':{('number', 'number')}, 
     '>':{('number', 'number')}, 
@@ -93,81 +425,126 @@ BINOPS = {
     'nth':{('list', 'number')},
     'min':{('number', 'number')},
     'max':{('number', 'number')},
-    'split':{('string', 'string')}
+    'split':{('string', 'string')},
+    'contains':{p for p in product(['list'], DATA_TYPES)} | {p for p in product(['set', 'dict'], KEY_TYPES)},
+    'add':{p for p in product(['set'], KEY_TYPES)},
+    'get':{p for p in product(['dict'], KEY_TYPES)},
+    'remove':{p for p in product(['set', 'dict'], KEY_TYPES)}
 }
 
-def process_binop(token, stack):
-    if len(stack) < 2:
-        raise ValueError('binop: stack too short for "%s" (height %s, need >= 2): %s' % (token, len(stack), stack))
-    argtype_b, arg_b = stack.pop()
-    argtype_a, arg_a = stack.pop()
-    typesig = (argtype_a, argtype_b)
-    if not typesig in BINOPS[token]:
-        raise SyntaxError('binop: %s cannot process types "%s"' % (token, typesig))
-    if token == '<':                return stack + [('bool', arg_a < arg_b)]
-    if token == '>':                return stack + [('bool', arg_a > arg_b)]
-    if token == '<=':               return stack + [('bool', arg_a <= arg_b)]
-    if token == '>=':               return stack + [('bool', arg_a >= arg_b)]
-    if token in ('=', '=='):        return stack + [('bool', (argtype_a == argtype_b) and (arg_a == arg_b))]
-    if token in ('!=', '<>'):       return stack + [('bool', argtype_a != argtype_b or arg_a != arg_b)]
-    if token == '&':                return stack + [('bool', arg_a and arg_b)]
-    if token == '^':                return stack + [('bool', arg_a ^ arg_b)]
-    if token == '|':                return stack + [('bool', arg_a or arg_b)]
-    if token == '+':
-        if argtype_a == 'string':   return stack + [('string', arg_a + arg_b)]
-        else:                       return stack + [('number', arg_a + arg_b)]
-    if token == '-':                return stack + [('number', arg_a - arg_b)]
-    if token == '/': 
-        if arg_b == 0: raise ZeroDivisionError('binop: zero division (%s) between %s and %s' % (token, arg_a, arg_b)) 
-        else:                       return stack + [('number', arg_a / arg_b)]
-    if token == '//':
-        if arg_b == 0: raise ZeroDivisionError('binop: zero division (%s) between %s and %s' % (token, arg_a, arg_b)) 
-        else:                       return stack + [('number', arg_a // arg_b)]
-    if token == '%':                return stack + [('number', arg_a % arg_b)]
-    if token == '*':
-        if argtype_a == 'string':
-            n = int(arg_b)
-            if n != arg_b: raise ValueError('binop: non-integer argument "%s" passed to binop "*" in string multiplication (string %s)' % (arg_b, arg_a))
-            return stack + [(argtype_a, arg_a * n)]
-        return stack + [(argtype_a, arg_a * arg_b)]
-    if token == '@':                return stack + [('list', arg_a + arg_b)]
-    if token == ':':                return stack + [('list', arg_a + [(argtype_b, arg_b)])]
-    if token == 'swap':             return stack + [(argtype_b, arg_b), (argtype_a, arg_a)]
-    if token == 'nth':
+def binop_divide(arg_a, arg_b, stack):
+    if arg_b == 0: raise ZeroDivisionError('binop: zero division (%s) between %s and %s' % ('/', arg_a, arg_b))
+    stack.append(arg_a / arg_b)
+
+def binop_floor_divide(arg_a, arg_b, stack):
+    if arg_b == 0: raise ZeroDivisionError('binop: zero division (%s) between %s and %s' % ('//', arg_a, arg_b))
+    stack.append(arg_a // arg_b)
+
+def binop_multiply(arg_a, arg_b, stack):
+    if type(arg_a) is str:
         n = int(arg_b)
-        if n != arg_b: raise ValueError('binop: non-integer argument "%s" passed to binop "nth"' % arg_b)
-        elif n >= len(arg_a): raise ValueError('binop: n "%s" greater than max list index (%s) in binop "nth"' % (n, len(arg_a)-1))
-        elif n < 0:
-            raise ValueError('binop: %s cannot process negative list index "%s"' % (token, n))                       
-        else:                       return stack + [arg_a[n]]
-    if token == 'min':              return stack + [('number', min(arg_a, arg_b))]
-    if token == 'max':              return stack + [('number', max(arg_a, arg_b))]
-    if token == 'split':            return stack + [('list', [('string', element) for element in arg_a.split(arg_b)])]
-    raise SyntaxError('binop: %s cannot be processed as a binop' % token)
+        if n != arg_b: raise ValueError('binop: non-integer argument "%s" passed to binop "*" in string multiplication (string %s)' % (arg_b, arg_a))
+        stack.append(arg_a * n)
+    else:
+        stack.append(arg_a * arg_b)
+
+def binop_nth(arg_a, arg_b, stack):
+    n = int(arg_b)
+    if n != arg_b: raise ValueError('binop: non-integer argument "%s" passed to binop "nth"' % arg_b)
+    elif n >= len(arg_a): raise ValueError('binop: n "%s" greater than max list index (%s) in binop "nth"' % (n, len(arg_a)-1))
+    elif n < 0:
+        raise ValueError('binop: %s cannot process negative list index "%s"' % ('nth', n))
+    stack.append(arg_a[n])
 
+def binop_contains(arg_a, arg_b, stack):
+    if type(arg_a) is ListValue:
+        stack.append(any(values_equal(item, arg_b) for item in arg_a))
+    else:
+        stack.append(arg_b in arg_a)
+
+def binop_get(arg_a, arg_b, stack):
+    if arg_b not in arg_a: raise ValueError('binop: key %s not in dict in binop "get"' % arg_b)
+    stack.append(arg_a.get(arg_b))
+
+def binop_remove(arg_a, arg_b, stack):
+    if arg_b not in arg_a: raise ValueError('binop: %s not in %s in binop "remove"' % (arg_b, type_of(arg_a)))
+    stack.append(arg_a.remove(arg_b))
+
+BINOP_FUNCTIONS = {
+    '<':        lambda arg_a, arg_b, stack: stack.append(arg_a < arg_b),
+    '>':        lambda arg_a, arg_b, stack: stack.append(arg_a > arg_b),
+    '<=':       lambda arg_a, arg_b, stack: stack.append(arg_a <= arg_b),
+    '>=':       lambda arg_a, arg_b, stack: stack.append(arg_a >= arg_b),
+    '=':        lambda arg_a, arg_b, stack: stack.append(values_equal(arg_a, arg_b)),
+    '==':       lambda arg_a, arg_b, stack: stack.append(values_equal(arg_a, arg_b)),
+    '<>':       lambda arg_a, arg_b, stack: stack.append(not values_equal(arg_a, arg_b)),
+    '!=':       lambda arg_a, arg_b, stack: stack.append(not values_equal(arg_a, arg_b)),
+    '&':        lambda arg_a, arg_b, stack: stack.append(arg_a and arg_b),
+    '^':        lambda arg_a, arg_b, stack: stack.append(arg_a ^ arg_b),
+    '|':        lambda arg_a, arg_b, stack: stack.append(arg_a or arg_b),
+    '+':        lambda arg_a, arg_b, stack: stack.append(arg_a + arg_b),
+    '-':        lambda arg_a, arg_b, stack: stack.append(arg_a - arg_b),
+    '*':        binop_multiply,
+    '/':        binop_divide,
+    '//':       binop_floor_divide,
+    '%':        lambda arg_a, arg_b, stack: stack.append(arg_a % arg_b),
+    '@':        lambda arg_a, arg_b, stack: stack.append(arg_a.concat(arg_b)),
+    ':':        lambda arg_a, arg_b, stack: stack.append(arg_a.append(arg_b)),
+    'swap':     lambda arg_a, arg_b, stack: stack.extend((arg_b, arg_a)),
+    'nth':      binop_nth,
+    'min':      lambda arg_a, arg_b, stack: stack.append(min(arg_a, arg_b)),
+    'max':      lambda arg_a, arg_b, stack: stack.append(max(arg_a, arg_b)),
+    'split':    lambda arg_a, arg_b, stack: stack.append(ListValue(arg_a.split(arg_b))),
+    'contains': binop_contains,
+    'add':      lambda arg_a, arg_b, stack: stack.append(arg_a.add(arg_b)),
+    'get':      binop_get,
+    'remove':   binop_remove
+}
+
+def make_binop(token, function):
+    allowed = python_typesigs(BINOPS[token])
+    def binop(stack):
+        if len(stack) < 2:
+            raise ValueError('binop: stack too short for "%s" (height %s, need >= 2): %s' % (token, len(stack), format_stack(stack)))
+        arg_b = stack.pop()
+        arg_a = stack.pop()
+        if not (type(arg_a), type(arg_b)) in allowed:
+            raise SyntaxError('binop: %s cannot process types "%s"' % (token, (type_of(arg_a), type_of(arg_b))))
+        function(arg_a, arg_b, stack)
+    return binop
+
+# put sets the value of a key of a dict
 TRINOPS = {
-    'setnth' : {p for p in product(['list'], ['number'], DATA_TYPES)}
+    'setnth' : {p for p in product(['list'], ['number'], DATA_TYPES)},
+    'put' : {p for p in product(['dict'], KEY_TYPES, DATA_TYPES)}
 }
 
-def process_trinop(token, stack):
-    if len(stack) < 3:
-        raise ValueError('trinop: stack too short (height %s, need >= 3): %s' % (len(stack), stack))
-    argtype_c, arg_c = stack.pop()
-    argtype_b, arg_b = stack.pop()
-    argtype_a, arg_a = stack.pop()
-    typesig = (argtype_a, argtype_b, argtype_c)
-    if not typesig in TRINOPS[token]:
-        raise SyntaxError('trinop: %s cannot process type "%s"' % (token, typesig))
-    if token == 'setnth':
-        n = int(arg_b)
-        if n != arg_b: raise ValueError('trinop: non-integer argument "%s" passed to trinop "setnth"' % arg_b)
-        elif n >= len(arg_a): raise ValueError('trinop: n "%s" greater than max list index (%s) in trinop "setnth"' % (n, len(arg_a)-1))
-        elif n < 0:
-            raise ValueError('trinop: %s cannot process negative list index "%s"' % (token, n))                       
-        else:
-            arg_a[n] = (argtype_c, arg_c)
-            return stack + [(argtype_a, arg_a)]
-    raise SyntaxError('trinop: %s cannot be processed as a trinop' % token)
+def trinop_setnth(arg_a, arg_b, arg_c, stack):
+    n = int(arg_b)
+    if n != arg_b: raise ValueError('trinop: non-integer argument "%s" passed to trinop "setnth"' % arg_b)
+    elif n >= len(arg_a): raise ValueError('trinop: n "%s" greater than max list index (%s) in trinop "setnth"' % (n, len(arg_a)-1))
+    elif n < 0:
+        raise ValueError('trinop: %s cannot process negative list index "%s"' % ('setnth', n))
+    # copy so that other variables holding this list keep their value
+    stack.append(arg_a.replace(n, arg_c))
+
+TRINOP_FUNCTIONS = {
+    'setnth':   trinop_setnth,
+    'put':      lambda arg_a, arg_b, arg_c, stack: stack.append(arg_a.put(arg_b, arg_c))
+}
+
+def make_trinop(token, function):
+    allowed = python_typesigs(TRINOPS[token])
+    def trinop(stack):
+        if len(stack) < 3:
+            raise ValueError('trinop: stack too short (height %s, need >= 3): %s' % (len(stack), format_stack(stack)))
+        arg_c = stack.pop()
+        arg_b = stack.pop()
+        arg_a = stack.pop()
+        if not (type(arg_a), type(arg_b), type(arg_c)) in allowed:
+            raise SyntaxError('trinop: %s cannot process type "%s"' % (token, (type_of(arg_a), type_of(arg_b), type_of(arg_c))))
+        function(arg_a, arg_b, arg_c, stack)
+    return trinop
 
 NOPS = { '\\', 'dropn', 'top', 'topn', 'rand' }
 # '\' creates a list of the first n elements of the current stack and pushes it onto the stack
@@ -178,62 +555,179 @@ NOPS = { '\\', 'dropn', 'top', 'topn', 'rand' }
 # topn drops all the elements of the stack below the top n
 # rand puts a random decimal between 0 and 1 on the stack
 
+def pop_stack_height(token, stack):
+    # pop the count argument of \, dropn and topn
+    if len(stack) < 1:
+        raise ValueError('nop: stack too short for op %s (height %s): %s' % (token, len(stack), format_stack(stack)))
+    arg = stack.pop()
+    if not TYPE_NAMES[type(arg)] == 'number':
+        raise SyntaxError('nop: %s cannot process type %s as stack height' % (token, type_of(arg)))
+    if not int(arg) == arg:
+        raise SyntaxError('nop: %s cannot process non-integer %s as stack height' % (token, arg))
+    length = int(arg)
+    if len(stack) < length:
+        raise ValueError('nop: stack too short for op %s and height %s (height left is %s): %s' % (token, length, len(stack), format_stack(stack)))
+    if length < 0:
+        raise ValueError('nop: %s cannot process negative stack height "%s"' % (token, length))
+    return length
+
+def nop_make_list(stack):
+    length = pop_stack_height('\\', stack)
+    if length == 0:
+        stack.append(new_list([]))
+        return
+    args = stack[-length:]
+    del stack[-length:]
+    stack.append(new_list(args))
+
+def nop_dropn(stack):
+    length = pop_stack_height('dropn', stack)
+    del stack[-length:]
+
+def nop_top(stack):
+    if len(stack) < 1:
+        raise ValueError('nop: stack too short for op %s (height %s): %s' % ('top', len(stack), format_stack(stack)))
+    del stack[:-1]
+
+def nop_topn(stack):
+    length = pop_stack_height('topn', stack)
+    del stack[:-length]
+
+NOP_FUNCTIONS = {
+    '\\':       nop_make_list,
+    'dropn':    nop_dropn,
+    'top':      nop_top,
+    'topn':     nop_topn,
+    'rand':     lambda stack: stack.append(random.random())
+}
+
+# token -> function(stack) for every operator
+OPERATORS = {}
+for token, function in UNOP_FUNCTIONS.items():
+    OPERATORS[token] = make_unop(token, function)
+for token, function in BINOP_FUNCTIONS.items():
+    OPERATORS[token] = make_binop(token, function)
+for token, function in TRINOP_FUNCTIONS.items():
+    OPERATORS[token] = make_trinop(token, function)
+OPERATORS.update(NOP_FUNCTIONS)
+
+# unchecked versions of the operators, used by typecheck.py for operators
+# whose stack height and argument types are proven before the program runs
+# these skip the stack height and type signature checks but keep the value
+# checks (zero division, list indices, stack height arguments)
+
+def make_fast_unop(function):
+    def unop(stack):
+        function(stack.pop(), stack)
+    return unop
+
+def make_fast_binop(function):
+    def binop(stack):
+        arg_b = stack.pop()
+        function(stack.pop(), arg_b, stack)
+    return binop
+
+def make_fast_trinop(function):
+    def trinop(stack):
+        arg_c = stack.pop()
+        arg_b = stack.pop()
+        function(stack.pop(), arg_b, arg_c, stack)
+    return trinop
+
+def fast_add(stack):
+    arg_b = stack.pop()
+    stack[-1] = stack[-1] + arg_b
+
+def fast_subtract(stack):
+    arg_b = stack.pop()
+    stack[-1] = stack[-1] - arg_b
+
+def fast_modulo(stack):
+    arg_b = stack.pop()
+    stack[-1] = stack[-1] % arg_b
+
+def fast_less(stack):
+    arg_b = stack.pop()
+    stack[-1] = stack[-1] < arg_b
+
+def fast_greater(stack):
+    arg_b = stack.pop()
+    stack[-1] = stack[-1] > arg_b
+
+def fast_less_equal(stack):
+    arg_b = stack.pop()
+    stack[-1] = stack[-1] <= arg_b
+
+def fast_greater_equal(stack):
+    arg_b = stack.pop()
+    stack[-1] = stack[-1] >= arg_b
+
+def fast_equal(stack):
+    arg_b = stack.pop()
+    stack[-1] = values_equal(stack[-1], arg_b)
+
+def fast_not_equal(stack):
+    arg_b = stack.pop()
+    stack[-1] = not values_equal(stack[-1], arg_b)
+
+def fast_append(stack):
+    arg_b = stack.pop()
+    stack[-1] = stack[-1].append(arg_b)
+
+def fast_len(stack):
+    stack[-1] = len(stack[-1])
+
+def fast_not(stack):
+    stack[-1] = not stack[-1]
+
+FAST_OPERATORS = {}
+for token, function in UNOP_FUNCTIONS.items():
+    FAST_OPERATORS[token] = make_fast_unop(function)
+for token, function in BINOP_FUNCTIONS.items():
+    FAST_OPERATORS[token] = make_fast_binop(function)
+for token, function in TRINOP_FUNCTIONS.items():
+    FAST_OPERATORS[token] = make_fast_trinop(function)
+FAST_OPERATORS.update(NOP_FUNCTIONS)
+FAST_OPERATORS.update({
+    '+':    fast_add,
+    '-':    fast_subtract,
+    '%':    fast_modulo,
+    '<':    fast_less,
+    '>':    fast_greater,
+    '<=':   fast_less_equal,
+    '>=':   fast_greater_equal,
+    '=':    fast_equal,
+    '==':   fast_equal,
+    '<>':   fast_not_equal,
+    '!=':   fast_not_equal,
+    ':':    fast_append,
+    '#':    fast_len,
+    '!':    fast_not
+})
+
+def process_unop(token, stack):
+    if token not in UNOPS:
+        raise SyntaxError('unop: %s cannot be processed as a unop' % token)
+    OPERATORS[token](stack)
+    return stack
+
+def process_binop(token, stack):
+    if token not in BINOPS:
+        raise SyntaxError('binop: %s cannot be processed as a binop' % token)
+    OPERATORS[token](stack)
+    return stack
+
+def process_trinop(token, stack):
+    if token not in TRINOPS:
+        raise SyntaxError('trinop: %s cannot be processed as a trinop' % token)
+    OPERATORS[token](stack)
+    return stack
+
 def process_nop(token, stack):
     if token not in NOPS:
         raise SyntaxError('nop: %s cannot be processed as an n-op' % token)
-    if token == '\\':
-        if len(stack) < 1:
-            raise ValueError('nop: stack too short for op %s (height %s): %s' % (token, len(stack), stack))
-        argtype, arg = stack.pop()
-        if argtype != 'number':
-            raise SyntaxError('nop: %s cannot process type %s as stack height' % (token, argtype))
-        if not int(arg) == arg:
-            raise SyntaxError('nop: %s cannot process non-integer %s as stack height' % (token, arg))
-        length = int(arg)
-        if len(stack) < length:
-            raise ValueError('nop: stack too short for op %s and height %s (height left is %s): %s' % (token, length, len(stack), stack))
-        if length < 0:
-            raise ValueError('nop: %s cannot process negative stack height "%s"' % (token, length))
-        if length == 0:
-            return stack + [('list', [])]
-        args = stack[-length:]
-        return stack[:-length] + [('list', args)]
-    elif token == 'dropn':
-        if len(stack) < 1:
-            raise ValueError('nop: stack too short for op %s (height %s): %s' % (token, len(stack), stack))
-        argtype, arg = stack.pop()
-        if argtype != 'number':
-            raise SyntaxError('nop: %s cannot process type %s as stack height' % (token, argtype))
-        if not int(arg) == arg:
-            raise SyntaxError('nop: %s cannot process non-integer %s as stack height' % (token, arg))
-        length = int(arg)
-        if len(stack) < length:
-            raise ValueError('nop: stack too short for op %s and height %s (height left is %s): %s' % (token, length, len(stack), stack))
-        if length < 0:
-            raise ValueError('nop: %s cannot process negative stack height "%s"' % (token, length))
-        return stack[:-length]
-    elif token == 'top':
-        if len(stack) < 1:
-            raise ValueError('nop: stack too short for op %s (height %s): %s' % (token, len(stack), stack))
-        argtype, arg = stack.pop()
-        return [(argtype, arg)]
-    elif token == 'topn':
-        if len(stack) < 1:
-            raise ValueError('nop: stack too short for op %s (height %s): %s' % (token, len(stack), stack))
-        argtype, arg = stack.pop()
-        if argtype != 'number':
-            raise SyntaxError('nop: %s cannot process type %s as stack height' % (token, argtype))
-        if not int(arg) == arg:
-            raise SyntaxError('nop: %s cannot process non-integer %s as stack height' % (token, arg))
-        length = int(arg)
-        if len(stack) < length:
-            raise ValueError('nop: stack too short for op %s and height %s (height left is %s): %s' % (token, length, len(stack), stack))
-        if length < 0:
-            raise ValueError('nop: %s cannot process negative stack height "%s"' % (token, length))
-        return stack[-length:]
-    elif token == 'rand':
-        return stack + [('number', random.random())]
-    raise SyntaxError('nop: %s cannot be processed as an n-op' % token)
+    OPERATORS[token](stack)
+    return stack
 
 REGEX = {
     'var' : r'\$([a-zA-Z][a-zA-Z0-9\_]*)',
@@ -252,94 +746,106 @@ def is_number(exp_token):
     m = re.fullmatch(r_number, exp_token)
     return m is not None
 
-def get_type(exp_token):
-    # print('getting token type of', exp_token)
-    # get type of an inter-expression string
-    # returns (tokentype, parsed token)
-    exp_token = exp_token.strip()
-    if exp_token in ['f', 'false']:
-        return 'bool', False
-    if exp_token in ['t', 'true']:
-        return 'bool', True
-    if exp_token in UNOPS:
-        return 'unop', exp_token
-    if exp_token in BINOPS:
-        return 'binop', exp_token
-    if exp_token in TRINOPS:
-        return 'trinop', exp_token
-    if exp_token in NOPS:
-        return 'nop', exp_token
-    if is_number(exp_token):
-        return 'number', float(exp_token)
-    if exp_token[0] == '$':
-        r_var = REGEX['var']
-        m_var = re.fullmatch(r_var, exp_token)
-        if not m_var:
-            raise SyntaxError('type: invalid variable name "%s"' % exp_token)
-        return 'var', m_var[1]
-    if exp_token[0] == '"':
-        r_string = REGEX['string_doublequote']
-        m_string = re.fullmatch(r_string, exp_token)
-        if not m_string:
-            raise SyntaxError('type: invalid string syntax (%s)' % exp_token)
-        return 'string', m_string[0][1:-1] # remove quotes
-    if exp_token[0] == "'":
-        r_string = REGEX['string_singlequote']
-        m_string = re.fullmatch(r_string, exp_token)
-        if not m_string:
-            raise SyntaxError('type: invalid string syntax (%s)' % exp_token)
-        return 'string', m_string[0][1:-1] # remove quotes
-    raise ValueError('type: value of unknown type ' + exp_token)
-
-def tokenize_exp(exp):
-    # print('tokenizing `%s`' % exp)
-    in_double_quote = False
-    in_single_quote = False
-    # need to explicitly close out strings
-    # otherwise could end up starting single quoted strings
-    # just_finished_string = False
+# single pass expression scanner, one alternative per kind of token
+# number and variable tokens must end at whitespace, a quote or the end of
+# the expression, anything else is scanned as a plain word
+TOKEN_REGEX = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<string>"[^"]*"|'[^']*')
+  | (?P<quote>["'])
+  | (?P<number>-?\d+\.?\d*)(?![^\s"'])
+  | (?P<var>\$[a-zA-Z][a-zA-Z0-9_]*)(?![^\s"'])
+  | (?P<word>[^\s"']+)
+""", re.VERBOSE)
+
+# (tokentype, value) of every word with a fixed meaning
+WORD_TYPES = {'f': ('bool', False), 'false': ('bool', False), 't': ('bool', True), 'true': ('bool', True)}
+WORD_TYPES.update((token, ('unop', token)) for token in UNOPS)
+WORD_TYPES.update((token, ('binop', token)) for token in BINOPS)
+WORD_TYPES.update((token, ('trinop', token)) for token in TRINOPS)
+WORD_TYPES.update((token, ('nop', token)) for token in NOPS)
+
+def scan_exp(exp):
+    # split the inside of an expression into (tokentype, text, value) tokens
+    # tokentype is a data type, 'var', an operator type or 'error' for
+    # tokens that are not valid, whose value is the exception to raise when
+    # the token is compiled (after the whole expression has been scanned)
     tokens = []
-    current_token = ''
-    index = 0
-    while index < len(exp):
-        # when in a string, continue until end delim seen
-        c = exp[index]
-        if in_double_quote:
-            if c == '"':
-                in_double_quote = False
-            current_token += c
-        elif in_single_quote:
-            if c == "'":
-                in_single_quote = False
-            current_token += c
+    string_end = -1
+    for m in TOKEN_REGEX.finditer(exp):
+        kind = m.lastgroup
+        if kind == 'space':
+            continue
+        start = m.start()
+        text = m.group()
+        if kind == 'string' or kind == 'quote':
+            # <token>"..." is not allowed - requires whitespace, e.g. <token> "..."
+            if start > 0 and not exp[start-1].isspace():
+                raise SyntaxError('tokenize exp: string starting without whitespace after previous item (...%s...)' % exp[max(0,start-5):min(start+5,len(exp))])
+            if kind == 'quote':
+                raise SyntaxError('tokenize exp: expression ended while parsing %s quoted string (...%s)' % ('double' if text == '"' else 'single', exp[-5:]))
+            tokens.append(('string', text, text[1:-1])) # remove quotes
+            string_end = m.end()
+        elif start == string_end:
+            # "..."<token> scans as a single invalid string
+            text = tokens[-1][1] + text
+            tokens[-1] = ('error', text, SyntaxError('type: invalid string syntax (%s)' % text))
+        elif kind == 'number':
+            tokens.append(('number', text, float(text)))
+        elif kind == 'var':
+            tokens.append(('var', text, text[1:]))
+        elif text in WORD_TYPES:
+            tokentype, value = WORD_TYPES[text]
+            tokens.append((tokentype, text, value))
+        elif text[0] == '$':
+            tokens.append(('error', text, SyntaxError('type: invalid variable name "%s"' % text)))
         else:
-            # whitespace
-            if c.strip() == '':
-                if current_token:
-                    tokens.append(current_token)
-                current_token = ''
-            else:
-                if c in ['"', "'"] and index > 0 and exp[index-1].strip() != '':
-                    # <token>"..." is not allowed - requires whitespace, e.g. <token> "..."
-                    raise SyntaxError('tokenize exp: string starting without whitespace after previous item (...%s...)' % exp[max(0,index-5):min(index+5,len(exp))])
-                if c == '"':
-                    in_double_quote = True
-                elif c == "'":
-                    in_single_quote = True
-                current_token += c
-        index += 1
-    if in_double_quote:
-        raise SyntaxError('tokenize exp: expression ended while parsing double quoted string (...%s)' % exp[min(0,-5):])
-    if in_single_quote:
-        raise SyntaxError('tokenize exp: expression ended while parsing single quoted string (...%s)' % exp[min(0,-5):])
-    if current_token:
-        tokens.append(current_token)
-    # print('tokenized %s into `%s`' % (exp, tokens))
+            tokens.append(('error', text, ValueError('type: value of unknown type ' + text)))
     return tokens
 
+class Expression:
+    # an expression compiled once at parse time
+    # source is the original text, code is a list of (kind, arg) pairs where
+    # kind is 'value' (push the literal value arg), 'var' (push the variable
+    # named arg), 'reg' (push register arg, see resolve_slots)
+    # or the OPERATORS function that handles the operator token arg
+    # input and inputnum expressions have no code
+    __slots__ = ('source', 'code')
+
+    def __init__(self, source, code):
+        self.source = source
+        self.code = code
+
+    # compare and display like the source string so flowcharts and
+    # statement dumps look the same as before expressions were compiled
+    def __repr__(self):
+        return repr(self.source)
+
+    def __str__(self):
+        return self.source
+
+    def __eq__(self, other):
+        return isinstance(other, Expression) and self.source == other.source
+
+    def __hash__(self):
+        return hash(self.source)
+
+def compile_tokens(tokens):
+    code = []
+    for tokentype, _, value in tokens:
+        if tokentype in DATA_TYPES:
+            code.append(('value', value))
+        elif tokentype == 'var':
+            code.append(('var', value))
+        elif tokentype == 'error':
+            raise value
+        else:
+            code.append((OPERATORS[value], value))
+    return code
+
 def check_exp(exp):
-    if exp.strip() == 'input': return 'input' # just get user input
-    if exp.strip() == 'inputnum': return 'inputnum' # get user input and convert to number
+    if exp.strip() == 'input': return Expression('input', None) # just get user input
+    if exp.strip() == 'inputnum': return Expression('inputnum', None) # get user input and convert to number
     # make sure exp is formatted correctly and all terms are syntactically valid
     exp = exp.strip()
     assert exp[0] == '[' and exp[-1] == ']', 'check exp: missing delimiters "[" and/or "]" (%s)' % exp
@@ -347,50 +853,86 @@ def check_exp(exp):
     exp = exp[1:-1].strip()
     if len(exp) == 0:
         raise SyntaxError('check exp: empty expression (%s)' % unmodified)
-    # rework inter-expression tokenizing logic to allow spaces in strings
-    tokens = tokenize_exp(exp)
-    for token in tokens:
-        get_type(token)
-    return unmodified
+    return Expression(unmodified, compile_tokens(scan_exp(exp)))
 
-def parse_exp(exp, variables):
-    if exp.strip() == 'input': return ('string', input()) # just get user input
-    if exp.strip() == 'inputnum': # get user input and convert to number
-        user_input = input()
+def evaluate_exp(expression, variables, read_line=input):
+    # evaluate a compiled rpn expression given current variable list
+    # variables is a list of registers for expressions passed through
+    # resolve_slots, and a dict of variable names otherwise
+    # read_line supplies the lines for input and inputnum
+    code = expression.code
+    if code is None:
+        if expression.source == 'input': return read_line() # just get user input
+        user_input = read_line() # get user input and convert to number
         if is_number(user_input):
-            return ('number', float(user_input))
+            return float(user_input)
         raise ValueError('inputnum: expected numerical user input, got ' + user_input)
-    # parse rpn expressions given current variable list
-    exp = exp.strip()
-    assert exp[0] == '[' and exp[-1] == ']', 'exp: missing delimiters "[" and/or "]" (%s)' % exp
-    unmodified = exp
-    exp = exp[1:-1]
-    assert len(exp) > 0, 'exp: empty expression (%s)' % unmodified
     stack = []
-    tokens = tokenize_exp(exp)
-    for token in tokens:
-        tokentype, token = get_type(token)
-        if tokentype in DATA_TYPES:
-            stack.append((tokentype, token))
-        elif tokentype == 'var':
-            if token not in variables:
-                raise ValueError('exp: unknown variable "%s"' % token)
-            tokentype, token = variables[token]
-            stack.append((tokentype, token))
-        elif tokentype == 'unop':
-            stack = process_unop(token, stack)
-        elif tokentype == 'binop':
-            stack = process_binop(token, stack)
-        elif tokentype == 'trinop':
-            stack = process_trinop(token, stack)
-        elif tokentype == 'nop':
-            stack = process_nop(token, stack)
+    for kind, arg in code:
+        if kind == 'value':
+            stack.append(arg)
+        elif kind == 'reg':
+            value = variables[arg]
+            if type(value) is Unset:
+                raise ValueError('exp: unknown variable "%s"' % value.name)
+            stack.append(value)
+        elif kind == 'var':
+            if arg not in variables:
+                raise ValueError('exp: unknown variable "%s"' % arg)
+            stack.append(variables[arg])
         else:
-            raise SyntaxError('exp: unknown token type "%s"' % tokentype)
+            kind(stack)
     if len(stack) > 1:
-        raise ValueError('exp: stack ended with invalid length > 1 of %s (%s)' % (len(stack), stack))
+        raise ValueError('exp: stack ended with invalid length > 1 of %s (%s)' % (len(stack), format_stack(stack)))
     return stack[0]
 
+def parse_exp(exp, variables):
+    # check and evaluate a raw expression string
+    return evaluate_exp(check_exp(exp), variables)
+
+class Unset:
+    # register contents of a variable that has not been set yet
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+def resolve_slots(parsed_statements):
+    # give every variable name a fixed register index
+    # returns the statements with variable names in set, outputvar and
+    # expressions replaced by register indices, and the list of names
+    slots = {}
+
+    def slot(varname):
+        if varname not in slots:
+            slots[varname] = len(slots)
+        return slots[varname]
+
+    def resolve_exp(expression):
+        if expression.code is None:
+            return expression
+        code = [('reg', slot(arg)) if kind == 'var' else (kind, arg) for kind, arg in expression.code]
+        return Expression(expression.source, code)
+
+    def resolve_statement(statement):
+        # malformed statements are left alone for process_statements to report
+        statement_type, *statement_args = statement
+        if statement_type == 'set' and len(statement_args) == 2:
+            return 'set', slot(statement_args[0]), resolve_exp(statement_args[1])
+        if statement_type == 'outputvar' and len(statement_args) == 1:
+            return 'outputvar', slot(statement_args[0])
+        if statement_type == 'outputexp' and len(statement_args) == 1:
+            return 'outputexp', resolve_exp(statement_args[0])
+        if statement_type == 'if' and len(statement_args) == 2:
+            return 'if', resolve_exp(statement_args[0]), resolve_statement(statement_args[1])
+        return statement
+
+    resolved = [resolve_statement(statement) for statement in parsed_statements]
+    return resolved, list(slots)
+
+def new_registers(names):
+    return [Unset(name) for name in names]
+
 def parse_output_stmt(rest):
     # match $(a..zA..Z)(a..zA..Z0..9)*
     rest = rest.strip()
@@ -475,47 +1017,294 @@ def parse_statement(statement_string):
     else:
         raise ValueError('illegal statement start: ' + first_token)
 
-def parse_statements(statement_strings, include_comments=False):
-    # print('statement strings', statement_strings)
+# one piece of program source per match: leading whitespace, then either a
+# comment (a # at the start of a statement, up to the end of the line or the
+# next semicolon, which it swallows when only whitespace comes before it) or
+# a statement up to the next semicolon outside of string literals
+# a semicolon at the end of a line always ends the statement, so that a
+# quote that is never closed cannot swallow the statements after it
+# a quote without a closing quote is an ordinary character, so that the
+# statement fails with the usual tokenize error
+SOURCE_REGEX = re.compile(r"""
+    \s*
+    (?:
+        (?P<comment>\#[^\n;]*)(?P<comment_end>\s*(?:;|\Z))?
+      | (?P<statement>(?:
+            [^;"']+
+          | "(?:[^";]|;(?![ \t\r]*(?:\n|\Z)))*"
+          | '(?:[^';]|;(?![ \t\r]*(?:\n|\Z)))*'
+          | (?P<quote>["'])
+        )*)(?P<end>;?)
+    )
+""", re.VERBOSE)
+
+def source_chunks(source, chunk_size=65536):
+    # str pieces of program source given as a str, bytes, a text or binary
+    # file object or an mmap (which reads like a binary file)
+    if isinstance(source, str):
+        yield source
+        return
+    if not hasattr(source, 'read'):
+        source = io.BytesIO(source)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk if isinstance(chunk, str) else decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+def scan_source(source, chunk_size=65536):
+    # split program source into (kind, text, line, column) pieces in a single
+    # pass, kind is 'statement', 'comment' or 'empty' (a semicolon with
+    # nothing before it) and line and column (both from 1) are where the
+    # piece starts
+    # a piece that may go on in the next chunk is kept and scanned again
+    # with it, so only statements longer than a chunk are scanned twice
+    line = 1
+    line_start = 0 # offset of the current line in buffer, may be negative
+    buffer = ''
+    chunks = source_chunks(source, chunk_size)
+    final = False
+    while not final:
+        chunk = next(chunks, None)
+        final = chunk is None
+        if not final:
+            buffer += chunk
+        pos = 0
+        while True:
+            m = SOURCE_REGEX.match(buffer, pos)
+            if not final and (m.end() == len(buffer) or m.group('quote') is not None):
+                # may be cut off at the end of the chunk
+                break
+            start = m.start('comment') if m.group('comment') is not None else m.start('statement')
+            newlines = buffer.count('\n', pos, start)
+            if newlines:
+                line += newlines
+                line_start = buffer.rfind('\n', pos, start) + 1
+            column = start - line_start + 1
+            pos = m.end()
+            if m.group('comment') is not None:
+                text = m.group('comment')
+                end = m.group('comment_end')
+                if end is None:
+                    # more source follows before the next semicolon
+                    yield 'comment', text.rstrip('\r'), line, column
+                else:
+                    yield 'comment', text.rstrip(), line, column
+                    newlines = end.count('\n')
+                    if newlines:
+                        line += newlines
+                        line_start = m.start('comment_end') + end.rfind('\n') + 1
+                continue
+            text = m.group('statement')
+            newlines = text.count('\n')
+            if newlines:
+                line += newlines
+                line_start = start + text.rfind('\n') + 1
+            if text.strip():
+                yield 'statement', text, line - newlines, column
+            elif m.group('end'):
+                yield 'empty', '', line, pos - line_start
+            else:
+                # end of the source
+                break
+        buffer = buffer[pos:]
+        line_start -= pos
+
+def load_program(source, include_comments=False, warn=print):
+    # parse program source (see source_chunks) and return the statements
+    # and the (line, column) of each of them
+    # warn is called with the text of every warning
     statements = []
-    statement_index = 0
-    while statement_index < len(statement_strings):
-        statement = statement_strings[statement_index]
-        parsed = parse_statement(statement)
-        if parsed == 'comment':
-            # print('parsing comment', statement)
-            statement = statement.strip()
+    positions = []
+    for kind, text, line, column in scan_source(source):
+        if kind == 'comment':
             if include_comments:
-                if '\n' in statement:
-                    statements += [('comment', statement[:statement.find('\n')])]
-                    statement_strings[statement_index] = statement[statement.find('\n')+1:]
-                else: # single-line comment?
-                    statements.append(('comment', statement.strip()))
-                    statement_index += 1
-            else:
-                if '\n' in statement:
-                    # continue removing comment lines until the last one
-                    statement_strings[statement_index] = statement[statement.find('\n')+1:]
-                else:
-                    statement_index += 1
+                statements.append(('comment', text))
+                positions.append((line, column))
+            continue
+        if kind == 'empty':
+            warn('warning: empty statement detected at line %s, column %s' % (line, column))
             continue
-        if parsed == 'empty':
-            if statement_index+1 == len(statement_strings):
-                # print('statements', statements)
-                return statements
-            print('warning: empty statement detected between statements (index {}: {}) and (index {}: {})'.format(
-                statement_index-1, repr(statement_strings[statement_index-1]),
-                statement_index+1, repr(statement_strings[statement_index+1])
-            ))
+        try:
+            statements.append(parse_statement(text))
+        except (SyntaxError, ValueError, AssertionError) as e:
+            raise type(e)('%s (line %s, column %s)' % (e, line, column)) from None
+        positions.append((line, column))
+    return statements, positions
+
+def format_statement(statement):
+    # source text of a parsed statement, for reports and messages
+    statement_type, *statement_args = statement
+    if statement_type == 'set':
+        return 'set $%s %s' % (statement_args[0], statement_args[1])
+    if statement_type == 'outputvar':
+        return 'output $%s' % statement_args[0]
+    if statement_type == 'outputexp':
+        return 'output %s' % statement_args[0]
+    if statement_type in ('mark', 'goto'):
+        return '%s %s' % (statement_type, statement_args[0])
+    if statement_type == 'if':
+        return 'if %s then %s' % (statement_args[0], format_statement(statement_args[1]))
+    if statement_type == 'comment':
+        return statement_args[0]
+    return str(statement)
+
+def format_output(value):
+    # text written for an output statement
+    if type(value) is str:
+        return value
+    return '<{} : {}>'.format(type_of(value), value)
+
+class StreamSink:
+    # output sink that writes lines to a text stream (stdout by default)
+    # lines are collected and written in blocks of about buffer_size
+    # characters, or written and flushed one at a time when line_buffered
+    # line_buffered defaults to whether the stream is interactive
+    def __init__(self, stream=None, line_buffered=None, buffer_size=65536):
+        if stream is None:
+            stream = sys.stdout
+        if line_buffered is None:
+            isatty = getattr(stream, 'isatty', None)
+            line_buffered = bool(isatty and isatty())
+        self.stream = stream
+        self.line_buffered = line_buffered
+        self.buffer_size = buffer_size
+        self.pending = []
+        self.pending_size = 0
+        self.write_line = self.write_flushed_line if line_buffered else self.write_buffered_line
+
+    def write_flushed_line(self, line):
+        self.stream.write(line + '\n')
+        self.stream.flush()
+
+    def write_buffered_line(self, line):
+        self.pending.append(line)
+        self.pending_size += len(line) + 1
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.pending.append('')
+            self.stream.write('\n'.join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+        self.stream.flush()
+
+class MemorySink:
+    # output sink that keeps lines in memory, for embedding
+    def __init__(self):
+        self.lines = []
+
+    def write_line(self, line):
+        self.lines.append(line)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(line + '\n' for line in self.lines)
+
+def is_block_readable(stream):
+    # true for regular files and streams without a file descriptor
+    try:
+        return stat.S_ISREG(os.fstat(stream.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError):
+        return True
+
+class StreamSource:
+    # input source that hands out lines of a text stream (stdin by default)
+    # files and in-memory streams are read in blocks of chunk_size characters
+    # and split into lines, pipes and sockets a line at a time so that a
+    # program answering prompts is not kept waiting for a whole block, and
+    # interactive stdin goes through input() so that prompts and line
+    # editing behave as before
+    def __init__(self, stream=None, chunk_size=65536):
+        if stream is None:
+            stream = sys.stdin
+        isatty = getattr(stream, 'isatty', None)
+        interactive = bool(isatty and isatty())
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.lines = []
+        self.index = 0
+        self.partial = ''
+        self.at_eof = False
+        if interactive and stream is sys.stdin:
+            self.read_line = input
+        elif interactive or not is_block_readable(stream):
+            self.read_line = self.read_single_line
+
+    def read_single_line(self):
+        line = self.stream.readline()
+        if not line:
+            raise EOFError('EOF when reading a line')
+        return line[:-1] if line.endswith('\n') else line
+
+    def fill(self):
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.at_eof = True
+            # last line without a trailing newline
+            self.lines = [self.partial] if self.partial else []
+            self.partial = ''
         else:
-            statements.append(parsed)
-        statement_index += 1
-    # print('statements', statements)
-    return statements
+            self.lines = (self.partial + chunk).split('\n')
+            self.partial = self.lines.pop()
+        self.index = 0
 
-def process_statements(parsed_statements):
-    marker_dict = {}
+    def read_line(self):
+        while self.index >= len(self.lines):
+            if self.at_eof:
+                raise EOFError('EOF when reading a line')
+            self.fill()
+        line = self.lines[self.index]
+        self.index += 1
+        return line
+
+class ListSource:
+    # input source that hands out lines from an in-memory list, for embedding
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.index = 0
+
+    def read_line(self):
+        if self.index >= len(self.lines):
+            raise EOFError('EOF when reading a line')
+        line = self.lines[self.index]
+        self.index += 1
+        return line
+
+def process_statements(parsed_statements, output=None, input_source=None, tracer=None, limits=None):
+    # output is an output sink, a buffered stdout StreamSink by default
+    # input_source supplies input lines, input() by default
+    # with a tracer (see tracing.py) the program runs in the traced loop instead
+    # limits (see limits.py) stop the program with LimitExceeded
+    if tracer is not None:
+        if limits is not None:
+            raise ValueError('limits: not supported with a tracer')
+        from tracing import trace_statements
+        return trace_statements(parsed_statements, tracer, output, input_source)
+    if output is None:
+        output = StreamSink()
+    read_line = input if input_source is None else input_source.read_line
+    parsed_statements, variable_names = resolve_slots(parsed_statements)
+    marker_dict = find_marks(parsed_statements)
+    registers = new_registers(variable_names)
+    on_jump = None
+    if limits is not None:
+        from limits import Budget, statement_counts
+        on_jump = Budget(limits, *statement_counts(parsed_statements), registers, variable_names).jump
+    try:
+        execute_statements(parsed_statements, marker_dict, registers, output.write_line, read_line, on_jump)
+    finally:
+        output.flush()
+
+def find_marks(parsed_statements):
     # first pass - create marker dictionary
+    marker_dict = {}
     for statement_index, statement in enumerate(parsed_statements):
         statement_type, *statement_args = statement
         if statement_type == 'mark':
@@ -525,116 +1314,158 @@ def process_statements(parsed_statements):
             if markname in marker_dict:
                 raise SyntaxError('mark: duplicate marker "%s" (statements %s, %s)' % (markname, marker_dict[markname], statement_index))
             marker_dict[markname] = statement_index
+    return marker_dict
 
-    variable_dict = {}
-    statement_index = 0
+def execute_statements(parsed_statements, marker_dict, registers, write_line, read_line, on_jump=None, on_statement=None):
     # second pass - evaluate everything
+    # parsed_statements come from resolve_slots and registers hold the
+    # variables, which are left as the program leaves them
+    # on_jump(statement index, mark index) is called for every goto taken
+    # and on_statement(statement index) before every statement runs, for
+    # limits, the profiler and tracers
+    statement_index = 0
     while statement_index < len(parsed_statements):
-        statement_type, *statement_args = parsed_statements[statement_index]
-        if statement_type == 'mark':
-            pass
-            # all marks already evaluated in first pass
-        elif statement_type == 'outputvar':
-            if len(statement_args) != 1:
-                raise SyntaxError('output: invalid number of arguments (should be 1, not %s): %s' % (len(statement_args), statement_args))
-            varname = statement_args[0]
-            if varname not in variable_dict:
-                raise ValueError('output: variable "%s" undefined' % varname)
-            vartype, varvalue = variable_dict[varname]
-            if vartype != 'string':
-                print('<{} : {}>'.format(vartype, varvalue))
+        if on_statement is not None:
+            on_statement(statement_index)
+        statement = parsed_statements[statement_index]
+        if statement[0] == 'if':
+            if len(statement) != 3:
+                raise SyntaxError('if: invalid number of arguments (should be 2, not %s): %s' % (len(statement) - 1, list(statement[1:])))
+            if evaluate_guard(statement[1], registers, read_line):
+                statement_index = execute_statement(statement_index, statement[2], marker_dict, registers, write_line, read_line, on_jump, 'if ')
             else:
-                print(varvalue)
-        elif statement_type == 'outputexp':
-            if len(statement_args) != 1:
-                raise SyntaxError('output: invalid number of arguments (should be 1, not %s): %s' % (len(statement_args), statement_args))
-            expression = statement_args[0]
-            parsed_expression = parse_exp(expression, variable_dict)
-            result_type, result_value = parsed_expression
-            if result_type != 'string':
-                print('<{} : {}>'.format(result_type, result_value))
-            else:
-                print(result_value)
-        elif statement_type == 'set':
-            if len(statement_args) != 2:
-                raise SyntaxError('set: invalid number of arguments (should be 2, not %s): %s' % (len(statement_args), statement_args))
-            varname, expression = statement_args
-            parsed_expression = parse_exp(expression, variable_dict)
-            variable_dict[varname] = parsed_expression
-        elif statement_type == 'goto':
-            if len(statement_args) != 1:
-                raise SyntaxError('goto: invalid number of arguments (should be 1, not %s): %s' % (len(statement_args), statement_args))
-            markname = statement_args[0]
-            if markname not in marker_dict:
-                raise ValueError('goto: mark "%s" undefined' % markname)
-            markindex = marker_dict[markname]
-            statement_index = markindex
-            continue
-        elif statement_type == 'if':
-            if len(statement_args) != 2:
-                raise SyntaxError('if: invalid number of arguments (should be 2, not %s): %s' % (len(statement_args), statement_args))
-            guard, body = statement_args
-            parsed_guard = parse_exp(guard, variable_dict)
-            guardtype, guardvalue = parsed_guard
-            if guardtype != 'bool':
-                raise ValueError('if: invalid type of guard (should be bool, not %s): %s' % (guardtype, guardvalue))
-            if guardvalue:
-                body_statement_type, *body_statement_args = body
-                # switch to outputvar, outputexp
-                if body_statement_type == 'outputvar':
-                    if len(body_statement_args) != 1:
-                        raise SyntaxError('output: invalid number of arguments (should be 1, not %s): %s' % (len(body_statement_args), body_statement_args))
-                    varname = body_statement_args[0]
-                    if varname not in variable_dict:
-                        raise ValueError('output: variable "%s" undefined' % varname)
-                    vartype, varvalue = variable_dict[varname]
-                    if vartype != 'string':
-                        print('<{} : {}>'.format(vartype, varvalue))
-                    else:
-                        print(varvalue)
-                elif body_statement_type == 'outputexp':
-                    if len(body_statement_args) != 1:
-                        raise SyntaxError('output: invalid number of arguments (should be 1, not %s): %s' % (len(body_statement_args), body_statement_args))
-                    expression = body_statement_args[0]
-                    parsed_expression = parse_exp(expression, variable_dict)
-                    result_type, result_value = parsed_expression
-                    if result_type != 'string':
-                        print('<{} : {}>'.format(result_type, result_value))
-                    else:
-                        print(result_value)
-                elif body_statement_type == 'set':
-                    if len(body_statement_args) != 2:
-                        raise SyntaxError('if set: invalid number of arguments (should be 2, not %s): %s' % (len(body_statement_args), body_statement_args))
-                    varname, expression = body_statement_args
-                    parsed_expression = parse_exp(expression, variable_dict)
-                    variable_dict[varname] = parsed_expression
-                elif body_statement_type == 'goto':
-                    if len(body_statement_args) != 1:
-                        raise SyntaxError('if goto: invalid number of arguments (should be 1, not %s): %s' % (len(body_statement_args), body_statement_args))
-                    markname = body_statement_args[0]
-                    if markname not in marker_dict:
-                        raise ValueError('if goto: mark "%s" undefined' % markname)
-                    markindex = marker_dict[markname]
-                    statement_index = markindex
-                    continue
-                else:
-                    raise SyntaxError('if: unknown or prohibited statement type "%s"' % body_statement_type)
+                statement_index += 1
+        else:
+            statement_index = execute_statement(statement_index, statement, marker_dict, registers, write_line, read_line, on_jump)
 
-        statement_index += 1
+def evaluate_guard(guard, registers, read_line):
+    # value of the guard of an if statement
+    parsed_guard = evaluate_exp(guard, registers, read_line)
+    if type(parsed_guard) is not bool:
+        raise ValueError('if: invalid type of guard (should be bool, not %s): %s' % (type_of(parsed_guard), parsed_guard))
+    return parsed_guard
+
+def execute_statement(statement_index, statement, marker_dict, registers, write_line, read_line, on_jump=None, prefix=''):
+    # run the statement at statement_index, or with prefix 'if ' the body
+    # of the if statement there, and return the index of the statement to
+    # run next (the aio engine shares this step with execute_statements)
+    statement_type, *statement_args = statement
+    if statement_type == 'mark' and not prefix:
+        pass
+        # all marks already evaluated in first pass
+    elif statement_type == 'outputvar':
+        if len(statement_args) != 1:
+            raise SyntaxError('output: invalid number of arguments (should be 1, not %s): %s' % (len(statement_args), statement_args))
+        varvalue = registers[statement_args[0]]
+        if type(varvalue) is Unset:
+            raise ValueError('output: variable "%s" undefined' % varvalue.name)
+        write_line(format_output(varvalue))
+    elif statement_type == 'outputexp':
+        if len(statement_args) != 1:
+            raise SyntaxError('output: invalid number of arguments (should be 1, not %s): %s' % (len(statement_args), statement_args))
+        expression = statement_args[0]
+        parsed_expression = evaluate_exp(expression, registers, read_line)
+        write_line(format_output(parsed_expression))
+    elif statement_type == 'set':
+        if len(statement_args) != 2:
+            raise SyntaxError('%sset: invalid number of arguments (should be 2, not %s): %s' % (prefix, len(statement_args), statement_args))
+        slot, expression = statement_args
+        parsed_expression = evaluate_exp(expression, registers, read_line)
+        registers[slot] = parsed_expression
+    elif statement_type == 'goto':
+        if len(statement_args) != 1:
+            raise SyntaxError('%sgoto: invalid number of arguments (should be 1, not %s): %s' % (prefix, len(statement_args), statement_args))
+        markname = statement_args[0]
+        if markname not in marker_dict:
+            raise ValueError('%sgoto: mark "%s" undefined' % (prefix, markname))
+        markindex = marker_dict[markname]
+        if on_jump is not None:
+            on_jump(statement_index, markindex)
+        return markindex
+    elif prefix:
+        raise SyntaxError('if: unknown or prohibited statement type "%s"' % statement_type)
+    return statement_index + 1
 
 def parse_content(filecontent, include_comments=False):
-    return parse_statements(filecontent.split(';'), include_comments=include_comments)
+    return load_program(filecontent, include_comments=include_comments)[0]
 
-if __name__ == '__main__':
+def main():
     parser = argparse.ArgumentParser(description='Interpret a StackTo program.')
     parser.add_argument('infile', help='StackTo file to read from')
+    parser.add_argument('-e', '--engine', help='Execution engine: tree-walking interpreter, bytecode VM or translation to python', choices=['tree', 'vm', 'py'], default='tree')
+    parser.add_argument('-c', '--check', help='Report type errors found before running and do not run if there are any', action='store_true')
+    parser.add_argument('-O', '--optimize', help='Optimize before running: precompute constant subexpressions and skip runtime stack and type checks for operators proven correct', action='store_true')
+    parser.add_argument('-u', '--unbuffered', help='Write and flush every output line immediately, even when stdout is not interactive', action='store_true')
+    parser.add_argument('-p', '--profile', help='Run with the statement-level profiler (instead of the chosen engine) and print a report of the hottest statements and loops to stderr', action='store_true')
+    parser.add_argument('-t', '--trace', help='Print every statement entered, goto taken, variable set and output to stderr (tree engine only)', action='store_true')
+    parser.add_argument('-i', '--input', metavar='FILE', help='File to read input and inputnum lines from instead of stdin')
+    from limits import add_limit_arguments, limits_from_arguments
+    add_limit_arguments(parser)
+    parser.add_argument('--save-py', metavar='FILE', help='With the py engine, also write the generated python source to FILE')
+    parser.add_argument('--no-cache', help='Always parse the program instead of loading it from (and saving it to) the compiled program cache', action='store_true')
+    parser.add_argument('--cache-dir', metavar='DIR', help='Directory for compiled program cache files (default: __stackto_cache__ next to the program)')
     args = parser.parse_args()
     infilename = getattr(args, 'infile')
-    with open(infilename, 'r') as f:
-        filecontent = f.read()
-    statements = parse_content(filecontent)
-    print('statements:', statements)
+    engine = getattr(args, 'engine')
+    check = getattr(args, 'check')
+    optimized = getattr(args, 'optimize')
+    use_cache = not getattr(args, 'no_cache')
+    limits = limits_from_arguments(args)
+    if limits is not None and (getattr(args, 'profile') or getattr(args, 'trace')):
+        parser.error('limits are not supported with --profile or --trace')
 
-    process_statements(statements)
+    if use_cache:
+        from cache import load_program_cached
+        # the type check needs the unoptimized statements
+        statements = load_program_cached(infilename, optimized and not check, getattr(args, 'cache_dir'))
+    else:
+        # decoded as utf-8, like the cached path
+        with open(infilename, 'rb') as f:
+            statements = parse_content(f)
 
-    # print('done')
\ No newline at end of file
+    if check:
+        from typecheck import check_types
+        errors = check_types(statements)
+        for error in errors:
+            print('type error:', error, file=sys.stderr)
+        if errors:
+            sys.exit(1)
+    if optimized and use_cache and check:
+        # the warnings were printed when loading the unoptimized statements
+        statements = load_program_cached(infilename, True, getattr(args, 'cache_dir'), lambda warning: None)
+    elif optimized and not use_cache:
+        from optimize import optimize
+        statements = optimize(statements)
+
+    # line buffered when interactive, block buffered when piped
+    output = StreamSink(line_buffered=True if getattr(args, 'unbuffered') else None)
+    inputfilename = getattr(args, 'input')
+    inputfile = open(inputfilename, 'r') if inputfilename else sys.stdin
+    try:
+        input_source = StreamSource(inputfile)
+        if getattr(args, 'profile'):
+            from profiler import profile_statements, format_report
+            profile = profile_statements(statements, output, input_source)
+            print(format_report(profile), file=sys.stderr)
+        elif getattr(args, 'trace'):
+            from tracing import StreamTracer
+            process_statements(statements, output, input_source, StreamTracer())
+        elif engine == 'vm':
+            from vm import process_statements_vm
+            process_statements_vm(statements, output, input_source, limits)
+        elif engine == 'py':
+            from translate import process_statements_py
+            process_statements_py(statements, output, input_source, getattr(args, 'save_py'), limits)
+        else:
+            process_statements(statements, output, input_source, limits=limits)
+    finally:
+        if inputfilename:
+            inputfile.close()
+
+    # print('done')
+
+if __name__ == '__main__':
+    # go through the importable module so that helper modules such as vm.py
+    # see the same definitions as the command line entry point
+    from interpreter import main
+    main()
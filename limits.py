@@ -0,0 +1,135 @@
+import time
+from itertools import accumulate
+from interpreter import ListValue, SetValue, DictValue, type_of
+
+# execution limits for StackTo programs
+# a program only runs for long by jumping back, so the engines report
+# every jump they take to a Budget, which counts the statements and
+# operators run since the previous jump and checks the limits at backward
+# jumps. without limits the engines make no calls at all
+# statements are counted without marks and comments, and an if statement
+# counts the operators of its body whether it runs or not, so every engine
+# counts the same. values are checked at backward jumps as well, so within
+# one pass through a loop they can grow past a limit before it is caught
+# (the stack of an expression only grows beyond the expression by splat,
+# which the list length limit covers)
+
+class LimitExceeded(RuntimeError):
+    # limit is the name of the Limits attribute that was exceeded
+    def __init__(self, limit, message):
+        super().__init__(message)
+        self.limit = limit
+
+class Limits:
+    # None means no limit, time_limit is in seconds of wall-clock time
+    __slots__ = ('max_statements', 'max_operators', 'max_list_length', 'max_string_length', 'time_limit')
+
+    def __init__(self, max_statements=None, max_operators=None, max_list_length=None, max_string_length=None, time_limit=None):
+        self.max_statements = max_statements
+        self.max_operators = max_operators
+        self.max_list_length = max_list_length
+        self.max_string_length = max_string_length
+        self.time_limit = time_limit
+
+def add_limit_arguments(parser):
+    # command line options for every limit, shared by interpreter.py and batch.py
+    parser.add_argument('--max-statements', metavar='N', type=int, help='Stop with an error after running more than N statements')
+    parser.add_argument('--max-operators', metavar='N', type=int, help='Stop with an error after running more than N operators')
+    parser.add_argument('--max-list-length', metavar='N', type=int, help='Stop with an error when a variable holds a list, set or dict of more than N items')
+    parser.add_argument('--max-string-length', metavar='N', type=int, help='Stop with an error when a variable holds a string of more than N characters')
+    parser.add_argument('--time-limit', metavar='SECONDS', type=float, help='Stop with an error after running for more than SECONDS')
+
+def limits_from_arguments(args):
+    # the Limits given by the options of add_limit_arguments, None without any
+    values = [getattr(args, name) for name in Limits.__slots__]
+    if all(value is None for value in values):
+        return None
+    return Limits(*values)
+
+def expression_operators(expression):
+    # number of operators run by one evaluation of an expression
+    if expression is None or expression.code is None:
+        return 0
+    return sum(1 for kind, _ in expression.code if kind not in ('value', 'var', 'reg'))
+
+def statement_operators(statement):
+    statement_type = statement[0]
+    if statement_type == 'set':
+        return expression_operators(statement[2])
+    if statement_type == 'outputexp':
+        return expression_operators(statement[1])
+    if statement_type == 'if':
+        return expression_operators(statement[1]) + statement_operators(statement[2])
+    return 0
+
+def running_totals(weights):
+    # totals[i] is the sum of weights[:i], so that a straight run of
+    # positions costs one subtraction
+    return [0] + list(accumulate(weights))
+
+def statement_counts(statements):
+    # running totals of the statements and operators counted for each
+    # statement by the tree and py engines
+    return (
+        running_totals(0 if statement[0] in ('mark', 'comment') else 1 for statement in statements),
+        running_totals(statement_operators(statement) for statement in statements)
+    )
+
+class Budget:
+    # counters of one run against its limits
+    # the counts are running totals of the statements and operators counted
+    # for each position (statement index or instruction offset), values is the
+    # register list checked at backward jumps (None when the engine passes
+    # the values to check_values itself) and names are the variable names
+    # of the registers or values
+    __slots__ = (
+        'limits', 'statement_counts', 'operator_counts', 'values', 'names', 'order', 'check_sizes',
+        'statements', 'operators', 'segment_start', 'deadline'
+    )
+
+    def __init__(self, limits, statement_counts, operator_counts, values=None, names=()):
+        self.limits = limits
+        self.statement_counts = statement_counts
+        self.operator_counts = operator_counts
+        self.values = values
+        self.names = names
+        # values are checked in the order of their names, so that every
+        # engine reports the same variable when several are too long
+        self.order = sorted(range(len(names)), key=names.__getitem__)
+        self.check_sizes = limits.max_list_length is not None or limits.max_string_length is not None
+        self.statements = 0
+        self.operators = 0
+        self.segment_start = 0
+        self.deadline = None if limits.time_limit is None else time.monotonic() + limits.time_limit
+
+    def jump(self, position, target):
+        # the engine jumps from position to target, returns whether the
+        # values have to be passed to check_values
+        self.statements += self.statement_counts[position+1] - self.statement_counts[self.segment_start]
+        self.operators += self.operator_counts[position+1] - self.operator_counts[self.segment_start]
+        self.segment_start = target
+        if target > position:
+            return False
+        limits = self.limits
+        if limits.max_statements is not None and self.statements > limits.max_statements:
+            raise LimitExceeded('max_statements', 'limit: more than %s statements run' % limits.max_statements)
+        if limits.max_operators is not None and self.operators > limits.max_operators:
+            raise LimitExceeded('max_operators', 'limit: more than %s operators run' % limits.max_operators)
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise LimitExceeded('time_limit', 'limit: time limit of %s seconds exceeded' % limits.time_limit)
+        if self.check_sizes and self.values is not None:
+            self.check_values(self.values)
+            return False
+        return self.check_sizes
+
+    def check_values(self, values):
+        limits = self.limits
+        max_list_length = limits.max_list_length
+        max_string_length = limits.max_string_length
+        for index in self.order:
+            value = values[index]
+            value_type = type(value)
+            if value_type is str and max_string_length is not None and len(value) > max_string_length:
+                raise LimitExceeded('max_string_length', 'limit: string in $%s longer than %s characters (%s)' % (self.names[index], max_string_length, len(value)))
+            if value_type in (ListValue, SetValue, DictValue) and max_list_length is not None and len(value) > max_list_length:
+                raise LimitExceeded('max_list_length', 'limit: %s in $%s longer than %s items (%s)' % (type_of(value), self.names[index], max_list_length, len(value)))
@@ -0,0 +1,136 @@
+from interpreter import UNOPS, BINOPS, TRINOPS, OPERATORS, Expression
+from typecheck import specialize
+from cfg import build_cfg
+
+# load-time optimization passes over parsed StackTo statements
+
+# number of values taken from the top of the stack by each operator
+# \, dropn, top and topn depend on the height of the whole stack
+ARITIES = {}
+ARITIES.update((token, 1) for token in UNOPS)
+ARITIES.update((token, 2) for token in BINOPS)
+ARITIES.update((token, 3) for token in TRINOPS)
+
+WHOLE_STACK_OPERATORS = { '\\', 'dropn', 'top', 'topn' }
+
+def fold_code(code):
+    # replace operators applied to literal values by the values they produce
+    # an operator is only folded when it succeeds on the literals, so
+    # expressions that raise still raise at the same point with the same
+    # message when they run
+    folded = []
+    # number of 'value' entries at the end of folded, which are the values
+    # on top of the stack at that point
+    literals = 0
+    for kind, arg in code:
+        if kind == 'value':
+            folded.append((kind, arg))
+            literals += 1
+            continue
+        if kind in ('var', 'reg') or arg == 'rand':
+            folded.append((kind, arg))
+            literals = 0
+            continue
+        if arg in WHOLE_STACK_OPERATORS:
+            # only known when the whole stack is literals
+            arity = len(folded) if literals == len(folded) else None
+        else:
+            arity = ARITIES[arg] if literals >= ARITIES[arg] else None
+        if arity is None:
+            folded.append((kind, arg))
+            literals = 0
+            continue
+        stack = [value for _, value in folded[len(folded)-arity:]]
+        try:
+            OPERATORS[arg](stack)
+        except Exception:
+            # leave it to fail at run time
+            folded.append((kind, arg))
+            literals = 0
+            continue
+        del folded[len(folded)-arity:]
+        folded.extend(('value', value) for value in stack)
+        literals += len(stack) - arity
+    return folded
+
+def fold_exp(expression):
+    if expression.code is None:
+        return expression
+    return Expression(expression.source, fold_code(expression.code))
+
+def fold_statement(statement):
+    statement_type, *statement_args = statement
+    if statement_type == 'set':
+        return 'set', statement_args[0], fold_exp(statement_args[1])
+    if statement_type == 'outputexp':
+        return 'outputexp', fold_exp(statement_args[0])
+    if statement_type == 'if':
+        guard, body = statement_args
+        return 'if', fold_exp(guard), fold_statement(body)
+    return statement
+
+def fold_constants(statements):
+    # return the statements with constant subexpressions precomputed
+    return [fold_statement(statement) for statement in statements]
+
+def thread_jumps(statements, marks):
+    # retarget goto and if ... goto at marks that are only followed by more
+    # marks and a goto to their final mark
+    # gotos to undefined marks are left alone, since their error message
+    # depends on whether they are inside an if
+    final = {}
+
+    def final_mark(markname):
+        path = []
+        seen = set()
+        while markname not in final and markname not in seen:
+            path.append(markname)
+            seen.add(markname)
+            next_index = marks[markname] + 1
+            while next_index < len(statements) and statements[next_index][0] == 'mark':
+                next_index += 1
+            if next_index == len(statements) or statements[next_index][0] != 'goto' or statements[next_index][1] not in marks:
+                break
+            markname = statements[next_index][1]
+        result = final.get(markname, markname)
+        for name in path:
+            final[name] = result
+        return result
+
+    threaded = []
+    for statement in statements:
+        if statement[0] == 'goto' and statement[1] in marks:
+            statement = 'goto', final_mark(statement[1])
+        elif statement[0] == 'if' and statement[2][0] == 'goto' and statement[2][1] in marks:
+            statement = 'if', statement[1], ('goto', final_mark(statement[2][1]))
+        threaded.append(statement)
+    return threaded
+
+def remove_dead_code(statements):
+    # drop statements that can never run, gotos to the statement they would
+    # reach anyway and marks that nothing jumps to
+    cfg = build_cfg(statements)
+    idom = cfg.immediate_dominators()
+    reachable = [statement for statement_index, statement in enumerate(statements) if idom[cfg.block_of[statement_index]] is not None]
+    kept = []
+    for statement_index, statement in enumerate(reachable):
+        if statement[0] == 'goto':
+            next_index = statement_index + 1
+            while next_index < len(reachable) and reachable[next_index][0] == 'mark' and reachable[next_index][1] != statement[1]:
+                next_index += 1
+            if next_index < len(reachable) and reachable[next_index] == ('mark', statement[1]):
+                continue
+        kept.append(statement)
+    targets = {statement[1] for statement in kept if statement[0] == 'goto'}
+    targets.update(statement[2][1] for statement in kept if statement[0] == 'if' and statement[2][0] == 'goto')
+    return [statement for statement in kept if statement[0] != 'mark' or statement[1] in targets]
+
+def simplify_control_flow(statements):
+    # thread jump chains and remove dead code
+    # duplicate marks are reported here, with the original statement indices
+    cfg = build_cfg(statements)
+    return remove_dead_code(thread_jumps(statements, cfg.marks))
+
+def optimize(statements):
+    # every load-time pass, as used by --optimize
+    return specialize(fold_constants(simplify_control_flow(statements)))
@@ -0,0 +1,109 @@
+import time
+from interpreter import resolve_slots, find_marks, execute_statements, new_registers, format_statement, StreamSink
+
+# statement-level profiler for parsed StackTo programs
+# profile_statements runs a program like process_statements, with the
+# statement and jump hooks of execute_statements, so that the engines pay
+# nothing for profiling when it is off. for every statement it records how
+# often it ran and the time spent in it and on writing its output, and for
+# every goto how often it was taken
+
+class Profile:
+    # per statement index counters, plus taken goto edges keyed on
+    # (goto statement index, mark statement index)
+    # the time of a statement not spent on output went to its guard and
+    # expressions
+    def __init__(self, statements):
+        self.statements = statements
+        self.counts = [0] * len(statements)
+        self.total_time = [0.0] * len(statements)
+        self.output_time = [0.0] * len(statements)
+        self.edges = {}
+        self.elapsed = 0.0
+
+    def loops(self):
+        # (mark index, goto index, times taken, time spent in between) for
+        # every backward goto edge
+        loops = []
+        for (goto_index, mark_index), taken in self.edges.items():
+            if mark_index <= goto_index:
+                loop_time = sum(self.total_time[mark_index:goto_index+1])
+                loops.append((mark_index, goto_index, taken, loop_time))
+        return loops
+
+def profile_statements(parsed_statements, output=None, input_source=None):
+    # run parsed statements and return their Profile
+    if output is None:
+        output = StreamSink()
+    read_line = input if input_source is None else input_source.read_line
+    profile = Profile(parsed_statements)
+    statements, variable_names = resolve_slots(parsed_statements)
+    marker_dict = find_marks(statements)
+    registers = new_registers(variable_names)
+    clock = time.perf_counter
+    counts = profile.counts
+    total_time = profile.total_time
+    output_time = profile.output_time
+    edges = profile.edges
+    # the statement running and when it started
+    running = None
+    started = 0.0
+
+    def on_statement(statement_index):
+        nonlocal running, started
+        now = clock()
+        if running is not None:
+            total_time[running] += now - started
+        running = statement_index
+        started = now
+        counts[statement_index] += 1
+
+    def on_jump(statement_index, mark_index):
+        edge = statement_index, mark_index
+        edges[edge] = edges.get(edge, 0) + 1
+
+    def write_line(line):
+        start = clock()
+        output.write_line(line)
+        output_time[running] += clock() - start
+
+    run_start = clock()
+    try:
+        execute_statements(statements, marker_dict, registers, write_line, read_line, on_jump, on_statement)
+    finally:
+        end = clock()
+        if running is not None:
+            total_time[running] += end - started
+        profile.elapsed = end - run_start
+        output.flush()
+    return profile
+
+def format_report(profile, top=10):
+    # text report of the hottest statements and loops
+    executed = sum(profile.counts)
+    lines = ['profile: %s statements executed in %.3f s' % (executed, profile.elapsed), '']
+    lines.append('hottest statements:')
+    lines.append('%6s %10s %10s %10s %10s  %s' % ('index', 'count', 'total ms', 'exp ms', 'output ms', 'statement'))
+    hottest = sorted(range(len(profile.statements)), key=lambda index: profile.total_time[index], reverse=True)
+    for index in hottest[:top]:
+        if profile.counts[index] == 0:
+            break
+        # exp ms includes the guard
+        exp_time = profile.total_time[index] - profile.output_time[index]
+        lines.append('%6s %10s %10.2f %10.2f %10.2f  %s' % (
+            index, profile.counts[index], profile.total_time[index] * 1000, exp_time * 1000,
+            profile.output_time[index] * 1000, format_statement(profile.statements[index])
+        ))
+    loops = sorted(profile.loops(), key=lambda loop: loop[3], reverse=True)
+    lines.append('')
+    lines.append('hottest loops:')
+    if not loops:
+        lines.append('  (none)')
+    else:
+        lines.append('%6s %6s %10s %10s  %s' % ('mark', 'goto', 'taken', 'total ms', 'loop'))
+        for mark_index, goto_index, taken, loop_time in loops[:top]:
+            lines.append('%6s %6s %10s %10.2f  %s -> %s' % (
+                mark_index, goto_index, taken, loop_time * 1000,
+                format_statement(profile.statements[goto_index]), format_statement(profile.statements[mark_index])
+            ))
+    return '\n'.join(lines)
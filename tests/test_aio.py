@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+from aio import run_async
+from embed import Program
+
+class MemoryWriter:
+    # the parts of an asyncio StreamWriter that run_async uses
+    def __init__(self, fail=False):
+        self.data = b''
+        self.fail = fail
+
+    def write(self, data):
+        if self.fail:
+            raise ConnectionResetError('connection lost')
+        self.data += data
+
+    async def drain(self):
+        pass
+
+def run(program, writer, data=b''):
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await run_async(program, reader, writer)
+    return asyncio.run(main())
+
+def test_input_is_only_read_when_the_statement_runs():
+    writer = MemoryWriter()
+    program = Program.from_source('if [f] then set $x input; output ["?"]; set $y input; output $y; if input then output [1];')
+    with pytest.raises(ValueError) as error:
+        run(program, writer, data=b'a\r\nb\n')
+    assert writer.data == b'?\na\n'
+    assert str(error.value) == 'if: invalid type of guard (should be bool, not string): b'
+
+def test_output_before_an_error_is_written():
+    writer = MemoryWriter()
+    with pytest.raises(ZeroDivisionError):
+        run(Program.from_source('output ["a"]; output [1 0 /];'), writer)
+    assert writer.data == b'a\n'
+
+def test_failing_flush_keeps_the_program_error():
+    with pytest.raises(ZeroDivisionError) as error:
+        run(Program.from_source('output ["a"]; output [1 0 /];'), MemoryWriter(fail=True))
+    assert type(error.value.__cause__) is ConnectionResetError
+
+def test_failing_flush_after_success_is_raised():
+    with pytest.raises(ConnectionResetError):
+        run(Program.from_source('output ["a"];'), MemoryWriter(fail=True))
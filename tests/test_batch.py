@@ -0,0 +1,32 @@
+import pytest
+from batch import find_programs, make_job, run_job, write_expected
+
+def test_pattern_matching_nothing_is_an_error(tmp_path):
+    (tmp_path / 'a.stackto').write_text('output [1];\n')
+    with pytest.raises(ValueError):
+        find_programs([str(tmp_path / '*.stakto')])
+    with pytest.raises(ValueError):
+        find_programs([str(tmp_path / 'empty*')])
+
+def test_programs_in_directory(tmp_path):
+    (tmp_path / 'b.stackto').write_text('output [1];\n')
+    (tmp_path / 'a.stackto').write_text('output [2];\n')
+    assert find_programs([str(tmp_path), str(tmp_path / 'a.stackto')]) == [str(tmp_path / 'a.stackto'), str(tmp_path / 'b.stackto')]
+
+def run(tmp_path, source, expected):
+    (tmp_path / 'a.stackto').write_text(source, encoding='utf-8')
+    (tmp_path / 'a.out').write_bytes(expected.encode('utf-8'))
+    return run_job(make_job(str(tmp_path / 'a.stackto')), use_cache=False)
+
+def test_output_matches_exact_text(tmp_path):
+    assert run(tmp_path, 'output ["é"];\n', 'é\n').status == 'pass'
+
+@pytest.mark.parametrize('expected', ['é', 'é\r\n', 'é\n\n'])
+def test_output_differing_in_newlines_fails(tmp_path, expected):
+    assert run(tmp_path, 'output ["é"];\n', expected).status == 'fail'
+
+def test_update_round_trip(tmp_path):
+    (tmp_path / 'a.stackto').write_text('output ["ü"]; output [$x];\n', encoding='utf-8')
+    result = run_job(make_job(str(tmp_path / 'a.stackto')), use_cache=False)
+    write_expected(result)
+    assert run_job(make_job(str(tmp_path / 'a.stackto')), use_cache=False).status == 'pass'
@@ -0,0 +1,20 @@
+from cache import load_program_cached
+from interpreter import load_program
+
+SOURCE = 'output [1];;\noutput ["é"];\n'
+
+def test_warnings_are_replayed_from_the_cache(tmp_path, capsys):
+    program = tmp_path / 'warn.stackto'
+    program.write_bytes(SOURCE.encode('utf-8'))
+    cache_dir = str(tmp_path / 'cache')
+    for optimized in (False, False, True, True):
+        load_program_cached(str(program), optimized, cache_dir)
+        assert capsys.readouterr().out == 'warning: empty statement detected at line 1, column 12\n'
+
+def test_cached_and_uncached_loads_decode_alike(tmp_path, capsys):
+    program = tmp_path / 'utf8.stackto'
+    program.write_bytes(SOURCE.encode('utf-8'))
+    with open(program, 'rb') as f:
+        statements = load_program(f)[0]
+    assert load_program_cached(str(program), False, str(tmp_path / 'cache')) == statements
+    assert statements[1][1].source == '["é"]'
@@ -0,0 +1,33 @@
+import pytest
+from embed import Program, Interpreter, ENGINES
+from interpreter import MemorySink
+
+SKIP_ON_FIRST_RUN = 'if [$first] then goto skip; output [$x $x <]; output [$x $x -]; mark skip; set $x [5]; set $first [f];'
+
+def run(source, variables, engine, optimize):
+    output = MemorySink()
+    Interpreter(output, engine=engine).run(Program.from_source(source, optimize), variables)
+    return output.lines
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('optimize', [False, True])
+def test_seeded_type_the_program_never_sets(engine, optimize):
+    # the optimizer only proves x to be a number
+    with pytest.raises(SyntaxError) as error:
+        run(SKIP_ON_FIRST_RUN, {'x': True, 'first': False}, engine, optimize)
+    assert str(error.value) == 'binop: < cannot process types "(\'bool\', \'bool\')"'
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('optimize', [False, True])
+def test_seeded_string_for_number_variable(engine, optimize):
+    with pytest.raises(SyntaxError) as error:
+        run('output [$x 1 +]; set $x [1];', {'x': 'abc'}, engine, optimize)
+    assert str(error.value) == 'binop: + cannot process types "(\'string\', \'number\')"'
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_seeded_proven_type_keeps_the_program(engine):
+    program = Program.from_source('output [$x 1 +]; set $x [1];', True)
+    assert program.for_variables({'x': 2}) is program
+    output = MemorySink()
+    Interpreter(output, engine=engine).run(program, {'x': 2})
+    assert output.lines == ['<number : 3.0>']
@@ -0,0 +1,55 @@
+import glob
+import os
+import random
+import pytest
+from embed import Program, Interpreter, ENGINES
+from interpreter import MemorySink, ListSource
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROGRAMS = sorted(
+    os.path.relpath(path, ROOT)
+    for pattern in ('examples/**/*.stackto', 'benchmarks/*.stackto')
+    for path in glob.glob(os.path.join(ROOT, pattern), recursive=True)
+)
+INPUT_LINES = ['5', '3', 'abc', '1']
+
+def run(program, engine, input_lines=()):
+    # output lines and error message, with the same random numbers every run
+    output = MemorySink()
+    random.seed(1)
+    try:
+        Interpreter(output, ListSource(input_lines), engine=engine).run(program, {})
+    except Exception as error:
+        return output.lines, '%s: %s' % (type(error).__name__, error)
+    return output.lines, None
+
+@pytest.mark.parametrize('path', PROGRAMS)
+def test_examples_and_benchmarks_run_the_same_on_every_engine(path):
+    path = os.path.join(ROOT, path)
+    expected = run(Program.from_file(path, use_cache=False), 'tree', INPUT_LINES)
+    for optimize in (False, True):
+        program = Program.from_file(path, optimize, use_cache=False)
+        for engine in ENGINES:
+            assert run(program, engine, INPUT_LINES) == expected, (engine, optimize)
+
+@pytest.mark.parametrize('source', [
+    'output [1 +];',
+    'output [1 "a" -];',
+    'output [$nope];',
+    'output $nope;',
+    'output [1 0 /];',
+    'if [1] then output [1];',
+    'goto nowhere;',
+    'if [t] then goto nowhere;',
+    'set $l [1 2 2 \\]; output [$l 5 nth];',
+    'set $x inputnum; output $x; set $x inputnum;',
+    'set $x input; set $y input; set $z input; set $w input; set $v input;',
+    'set $i [0]; mark loop; set $i [$i 1 +]; if [$i 3 <] then goto loop; output [$i "a" +];',
+])
+def test_errors_match_on_every_engine(source):
+    expected = run(Program.from_source(source), 'tree', INPUT_LINES[1:])
+    assert expected[1] is not None
+    for optimize in (False, True):
+        program = Program.from_source(source, optimize)
+        for engine in ENGINES:
+            assert run(program, engine, INPUT_LINES[1:]) == expected, (engine, optimize)
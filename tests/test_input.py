@@ -0,0 +1,16 @@
+import io
+import os
+from interpreter import StreamSource
+
+def test_pipe_is_read_a_line_at_a_time():
+    # a block read would wait for the writer to send more or close the pipe
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(read_fd) as reader, os.fdopen(write_fd, 'w') as writer:
+        writer.write('first\n')
+        writer.flush()
+        source = StreamSource(reader)
+        assert source.read_line() == 'first'
+
+def test_in_memory_stream_is_read_in_blocks():
+    source = StreamSource(io.StringIO('a\nb'), chunk_size=1)
+    assert [source.read_line(), source.read_line()] == ['a', 'b']
@@ -0,0 +1,66 @@
+import argparse
+import asyncio
+import pytest
+from aio import run_async
+from embed import Program, Interpreter, ENGINES
+from interpreter import MemorySink
+from limits import Limits, LimitExceeded, add_limit_arguments, limits_from_arguments
+
+LOOP = (
+    'set $i [0]; set $l [0 \\]; set $d [0 \\ todict]; set $s [""]; mark loop; set $i [$i 1 +]; '
+    'set $l [$l $i :]; set $d [$d $i 1 put]; set $s [$s "ab" +]; if [$i 100 <] then goto loop; output $i;'
+)
+CASES = [
+    (Limits(max_statements=50), 'max_statements', 'limit: more than 50 statements run'),
+    (Limits(max_operators=50), 'max_operators', 'limit: more than 50 operators run'),
+    # $d and $l both go over, the first name is reported
+    (Limits(max_list_length=10), 'max_list_length', 'limit: dict in $d longer than 10 items (11)'),
+    (Limits(max_string_length=9), 'max_string_length', 'limit: string in $s longer than 9 characters (10)'),
+    (Limits(time_limit=0.0), 'time_limit', 'limit: time limit of 0.0 seconds exceeded'),
+]
+
+class MemoryWriter:
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+def run_aio(program, limits):
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_eof()
+        return await run_async(program, reader, MemoryWriter(), limits=limits)
+    return asyncio.run(main())
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('optimize', [False, True])
+@pytest.mark.parametrize('limits, limit, message', CASES)
+def test_limit_stops_every_engine(engine, optimize, limits, limit, message):
+    with pytest.raises(LimitExceeded) as error:
+        Interpreter(MemorySink(), engine=engine, limits=limits).run(Program.from_source(LOOP, optimize))
+    assert error.value.limit == limit
+    assert str(error.value) == message
+
+@pytest.mark.parametrize('limits, limit, message', CASES)
+def test_limit_stops_aio(limits, limit, message):
+    with pytest.raises(LimitExceeded) as error:
+        run_aio(Program.from_source(LOOP), limits)
+    assert (error.value.limit, str(error.value)) == (limit, message)
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_program_within_limits_runs(engine):
+    output = MemorySink()
+    limits = Limits(max_statements=1000, max_operators=2000, max_list_length=101, max_string_length=200, time_limit=60)
+    Interpreter(output, engine=engine, limits=limits).run(Program.from_source(LOOP))
+    assert output.lines == ['<number : 100.0>']
+
+def test_limit_arguments():
+    parser = argparse.ArgumentParser()
+    add_limit_arguments(parser)
+    assert limits_from_arguments(parser.parse_args([])) is None
+    limits = limits_from_arguments(parser.parse_args(['--max-operators', '5', '--time-limit', '1.5']))
+    assert (limits.max_statements, limits.max_operators, limits.time_limit) == (None, 5, 1.5)
@@ -0,0 +1,25 @@
+import pytest
+from embed import Program, Interpreter, ENGINES
+from interpreter import MemorySink
+
+def run(source, engine, optimize):
+    output = MemorySink()
+    Interpreter(output, engine=engine).run(Program.from_source(source, optimize), {})
+    return output.lines
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('optimize', [False, True])
+def test_setnth_and_append_leave_the_operand_alone(engine, optimize):
+    # the results share a buffer with $a, which must not show their changes
+    source = 'set $a [1 2 2 \\]; set $b [$a 0 9 setnth]; set $c [$a 5 :]; set $d [$a 6 :]; output [$a str]; output [$b str]; output [$c str]; output [$d str]; output [$c $d @ str];'
+    assert run(source, engine, optimize) == ['[1.0, 2.0]', '[9.0, 2.0]', '[1.0, 2.0, 5.0]', '[1.0, 2.0, 6.0]', '[1.0, 2.0, 5.0, 1.0, 2.0, 6.0]']
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('optimize', [False, True])
+def test_copy_taken_in_a_loop(engine, optimize):
+    source = (
+        'set $l [0 \\]; set $i [0]; mark loop; set $l [$l $i :]; if [$i 1 =] then set $s [$l]; '
+        'set $i [$i 1 +]; if [$i 4 <] then goto loop; set $t [$s 0 7 setnth 8 :]; '
+        'output [$s str]; output [$l str]; output [$t str];'
+    )
+    assert run(source, engine, optimize) == ['[0.0, 1.0]', '[0.0, 1.0, 2.0, 3.0]', '[7.0, 1.0, 8.0]']
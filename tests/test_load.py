@@ -0,0 +1,28 @@
+import pytest
+from interpreter import load_program
+
+def test_unterminated_string_stops_at_end_of_line():
+    # the quote must not swallow the next statement up to its first quote
+    with pytest.raises(SyntaxError) as error:
+        load_program('output ["unterminated];\noutput ["b"];\n')
+    assert str(error.value) == 'tokenize exp: expression ended while parsing double quoted string (...nated) (line 1, column 1)'
+
+def test_unterminated_single_quoted_string():
+    with pytest.raises(SyntaxError) as error:
+        load_program("set $x ['a];\r\noutput $x;\n")
+    assert 'expression ended while parsing single quoted string' in str(error.value)
+
+def test_semicolon_inside_string():
+    statements, positions = load_program('output ["a;b"]; output ["c; "];\noutput ["d"];')
+    assert [str(statement[1]) for statement in statements] == ['["a;b"]', '["c; "]', '["d"]']
+    assert positions == [(1, 1), (1, 17), (2, 1)]
+
+def test_comment_ends_at_semicolon():
+    statements, positions = load_program('# note; output ["after"];\n# x\n\n ;\n  output [1];')
+    assert [str(statement[1]) for statement in statements] == ['["after"]', '[1]']
+    assert positions == [(1, 9), (5, 3)]
+
+def test_empty_statement_after_comment_line():
+    warnings = []
+    load_program('# a\noutput [1];\n;', warn=warnings.append)
+    assert warnings == ['warning: empty statement detected at line 3, column 1']
@@ -0,0 +1,80 @@
+import pytest
+from embed import Program, Interpreter, ENGINES
+from interpreter import parse_content, format_statement, MemorySink
+from optimize import fold_constants, simplify_control_flow
+
+def folded(source):
+    # the code of the last expression of the only statement, operators as tokens
+    statement = fold_constants(parse_content(source))[0]
+    return [(kind if kind in ('value', 'var') else 'op', arg) for kind, arg in statement[-1].code]
+
+def test_constant_subexpressions_fold():
+    assert folded('output [1 2 + 3 *];') == [('value', 9.0)]
+    assert folded('output [$x 2 3 + +];') == [('var', 'x'), ('value', 5.0), ('op', '+')]
+    assert folded('output [1 2 3 2 \\ #];') == [('value', 1.0), ('value', 2)]
+
+def test_rand_is_not_folded():
+    assert folded('output [rand 1 +];') == [('op', 'rand'), ('value', 1.0), ('op', '+')]
+
+def test_failing_operator_is_not_folded():
+    assert folded('output [1 0 / 2 +];') == [('value', 1.0), ('value', 0.0), ('op', '/'), ('value', 2.0), ('op', '+')]
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('source, error_type, message', [
+    ('output [1 0 / 2 +];', ZeroDivisionError, 'binop: zero division (/) between 1.0 and 0.0'),
+    ('output [1 2 2 \\ 5 nth];', ValueError, None),
+    ('output [1 "a" -];', SyntaxError, 'binop: - cannot process types "(\'number\', \'string\')"'),
+])
+def test_folding_keeps_runtime_errors(engine, source, error_type, message):
+    # the error is raised when the statement runs, after the output before it
+    errors = []
+    for optimize in (False, True):
+        output = MemorySink()
+        with pytest.raises(error_type) as error:
+            Interpreter(output, engine=engine).run(Program.from_source('output ["before"]; ' + source, optimize), {})
+        assert output.lines == ['before']
+        errors.append(str(error.value))
+    assert errors[0] == errors[1]
+    if message is not None:
+        assert errors[0] == message
+
+def simplified(source):
+    return [format_statement(statement) for statement in simplify_control_flow(parse_content(source))]
+
+def test_jump_chains_are_threaded():
+    source = 'set $i [0]; mark top; if [$i 3 <] then goto a; goto end; mark a; goto b; mark b; set $i [$i 1 +]; goto top; mark end; output $i;'
+    assert simplified(source) == [
+        'set $i [0]', 'mark top', 'if [$i 3 <] then goto b', 'goto end',
+        'mark b', 'set $i [$i 1 +]', 'goto top', 'mark end', 'output $i',
+    ]
+
+def test_dead_code_is_removed():
+    assert simplified('goto a; mark a; mark b; goto c; mark c; output [1];') == ['output [1]']
+    assert simplified('goto end; output [1]; mark end; output [2];') == ['output [2]']
+    assert simplified('mark loop; goto loop; output [1];') == ['mark loop', 'goto loop']
+
+def test_undefined_marks_are_left_alone():
+    assert simplified('if [t] then goto nowhere; goto nowhere; output [1];') == ['if [t] then goto nowhere', 'goto nowhere']
+
+def test_duplicate_mark_is_reported_with_original_indices():
+    with pytest.raises(SyntaxError) as error:
+        simplify_control_flow(parse_content('goto a; mark a; mark a;'))
+    assert str(error.value) == 'mark: duplicate marker "a" (statements 1, 2)'
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('source', [
+    'set $i [0]; mark top; if [$i 3 <] then goto a; goto end; mark a; goto b; mark b; set $i [$i 1 +]; output $i; goto top; mark end; output ["end"];',
+    'goto a; output [1]; mark a; if [f] then goto a; output [2]; goto nowhere;',
+    'if [t] then goto nowhere; output [1];',
+])
+def test_simplified_programs_run_the_same(engine, source):
+    results = []
+    for optimize in (False, True):
+        output = MemorySink()
+        try:
+            Interpreter(output, engine=engine).run(Program.from_source(source, optimize), {})
+            error = None
+        except ValueError as e:
+            error = str(e)
+        results.append((output.lines, error))
+    assert results[0] == results[1]
@@ -0,0 +1,12 @@
+from interpreter import parse_content, MemorySink, ListSource
+from profiler import profile_statements
+
+def test_counts_and_loop_edges():
+    statements = parse_content('set $i [0]; mark loop; set $i [$i 1 +]; if [$i 3 <] then goto loop; output $i;')
+    output = MemorySink()
+    profile = profile_statements(statements, output, ListSource([]))
+    assert output.lines == ['<number : 3.0>']
+    assert profile.counts == [1, 3, 3, 3, 1]
+    assert profile.edges == {(3, 1): 2}
+    assert [loop[:3] for loop in profile.loops()] == [(1, 3, 2)]
+    assert profile.output_time[4] > 0
@@ -0,0 +1,43 @@
+import pytest
+from embed import Program, Interpreter, ENGINES
+from interpreter import MemorySink
+
+def run(source, engine, optimize):
+    output = MemorySink()
+    Interpreter(output, engine=engine).run(Program.from_source(source, optimize), {})
+    return output.lines
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('optimize', [False, True])
+def test_folded_literals(engine, optimize):
+    # with -O the literals fold into constants, which the py engine must name
+    source = 'set $s [1 2 2 \\ toset]; output [1 2 2 \\ toset $s =]; output [1 2 2 \\ todict type]; output [1 2 2 \\ toset 1 2 2 \\ todict <>];'
+    assert run(source, engine, optimize) == ['<bool : True>', 'dict', '<bool : True>']
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('optimize', [False, True])
+def test_set_semantics(engine, optimize):
+    source = 'set $s [3 1 3 3 \\ toset]; set $t [$s 2 add]; output [$s str]; output [$t str]; output [$s 2 contains]; output [$t #]; output [$t 3 remove str];'
+    assert run(source, engine, optimize) == ['{1.0, 3.0}', '{1.0, 2.0, 3.0}', '<bool : False>', '<number : 3>', '{1.0, 2.0}']
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('optimize', [False, True])
+def test_dict_semantics(engine, optimize):
+    source = 'set $d [0 \\ todict "a" 1 put]; set $e [$d "a" 2 put "b" 3 put]; output [$d "a" get]; output [$e "a" get]; output [$e keys str]; output [$e values str];'
+    assert run(source, engine, optimize) == ['<number : 1.0>', '<number : 2.0>', '[a, b]', '[2.0, 3.0]']
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('source, message', [
+    ('output [0 \\ todict "x" get];', 'binop: key x not in dict in binop "get"'),
+    ('output [0 \\ toset 1 remove];', 'binop: 1.0 not in set in binop "remove"'),
+])
+def test_missing_key(engine, source, message):
+    with pytest.raises(ValueError) as error:
+        run(source, engine, False)
+    assert str(error.value) == message
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_list_is_not_a_key(engine):
+    with pytest.raises(SyntaxError) as error:
+        run('output [0 \\ toset 0 \\ add];', engine, False)
+    assert str(error.value) == 'binop: add cannot process types "(\'set\', \'list\')"'
@@ -0,0 +1,31 @@
+from interpreter import parse_content, process_statements, MemorySink, ListSource
+from tracing import Tracer
+
+class RecordingTracer(Tracer):
+    def __init__(self):
+        self.events = []
+
+    def on_statement(self, index, statement):
+        self.events.append(('statement', index))
+
+    def on_goto(self, index, markname, target_index):
+        self.events.append(('goto', index, markname, target_index))
+
+    def on_set(self, index, varname, value):
+        self.events.append(('set', index, varname, value))
+
+    def on_output(self, index, line):
+        self.events.append(('output', index, line))
+
+def test_events():
+    statements = parse_content('set $i [1]; mark loop; set $i [$i 1 +]; if [$i 3 <] then goto loop; output [$i str];')
+    tracer = RecordingTracer()
+    output = MemorySink()
+    process_statements(statements, output, ListSource([]), tracer)
+    assert output.lines == ['3.0']
+    assert tracer.events == [
+        ('statement', 0), ('set', 0, 'i', 1.0),
+        ('statement', 1), ('statement', 2), ('set', 2, 'i', 2.0), ('statement', 3), ('goto', 3, 'loop', 1),
+        ('statement', 1), ('statement', 2), ('set', 2, 'i', 3.0), ('statement', 3),
+        ('statement', 4), ('output', 4, '3.0'),
+    ]
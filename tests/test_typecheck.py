@@ -0,0 +1,47 @@
+import pytest
+from interpreter import parse_content, MemorySink, OPERATORS, FAST_OPERATORS
+from typecheck import infer_variable_types, specialize, check_types
+from embed import Program, Interpreter, ENGINES
+
+LOOP = (
+    'set $i [0]; set $s [""]; mark loop; set $i [$i 1 +]; set $s [$s $i str +]; if [$i 3 <] then goto loop; '
+    'set $x [$i]; if [$i 2 >] then set $x ["a"]; output [$x 1 +];'
+)
+
+def operators(statement):
+    # (token, proven) for every operator of the last expression of a statement
+    return [(arg, kind is FAST_OPERATORS[arg]) for kind, arg in statement[-1].code if kind not in ('value', 'var')]
+
+def test_variable_types():
+    assert infer_variable_types(parse_content(LOOP)) == {
+        'i': {'number'}, 's': {'string'}, 'x': {'number', 'string'},
+    }
+
+def test_seeded_variable_types():
+    assert infer_variable_types(parse_content('set $y [$x 1 +];'), {'x': frozenset({'number'})}) == {'x': {'number'}, 'y': {'number'}}
+
+def test_only_proven_operators_are_unchecked():
+    statements = specialize(parse_content(LOOP))
+    assert operators(statements[3]) == [('+', True)]
+    assert operators(statements[4]) == [('str', True), ('+', True)]
+    # $x may be a string
+    assert operators(statements[8]) == [('+', False)]
+    assert statements[8][-1].code[-1][0] is OPERATORS['+']
+
+def test_short_stack_is_not_proven():
+    statements = specialize(parse_content('output [1 +];'))
+    assert operators(statements[0]) == [('+', False)]
+
+def test_errors_that_always_happen():
+    assert check_types(parse_content('output [1 "a" -]; if [1] then output [1]; output $nope;')) == [
+        'statement 0: exp [1 "a" -]: binop: - cannot process types "number, string"',
+        'statement 1: if: guard [1] can never be bool (number)',
+        'statement 2: output: variable "nope" is never set',
+    ]
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_unproven_operator_still_checks_at_runtime(engine):
+    output = MemorySink()
+    with pytest.raises(SyntaxError) as error:
+        Interpreter(output, engine=engine).run(Program.from_source(LOOP, True), {})
+    assert str(error.value) == 'binop: + cannot process types "(\'string\', \'number\')"'
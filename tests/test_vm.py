@@ -0,0 +1,37 @@
+import pytest
+from interpreter import parse_content, process_statements, MemorySink, ListSource
+from vm import compile_statements, process_statements_vm, OPCODE_NAMES
+
+def run(function, source):
+    output = MemorySink()
+    try:
+        function(parse_content(source), output, ListSource([]))
+    except Exception as error:
+        return output.lines, '%s: %s' % (type(error).__name__, error)
+    return output.lines, None
+
+def test_idioms_are_fused():
+    code, _ = compile_statements(parse_content(
+        'set $i [0]; mark loop; set $i [$i 1 +]; set $j [$i 2 -]; set $l [$l $i :]; set $m [$l 1 :]; '
+        'if [$i 3 <] then goto loop; if [$i $j =] then output [1];'
+    ))
+    assert [OPCODE_NAMES[instruction[0]] for instruction in code] == [
+        'SET', 'ADD_CONST', 'ADD_CONST', 'APPEND', 'APPEND', 'COMPARE_JUMP_IF', 'COMPARE_JUMP_UNLESS', 'OUTPUTEXP',
+    ]
+
+@pytest.mark.parametrize('source', [
+    # ADD_CONST on a string, a bool and an unset variable
+    'set $x ["a"]; set $y [$x 1 +];',
+    'set $x [t]; set $y [$x 1 -];',
+    'set $y [$x 1 +];',
+    # APPEND to a string and a set, and of an unset variable
+    'set $x ["ab"]; set $y [$x 1 :]; output $y;',
+    'set $s [1 2 2 \\ toset]; set $s [$s 3 :];',
+    'set $l [0 \\]; set $y [$l $u :];',
+    # COMPARE_JUMP_IF and COMPARE_JUMP_UNLESS on other types than numbers
+    'set $s ["a"]; set $t ["a"]; if [$s $t =] then output [1]; if [$s $t <>] then output [2];',
+    'set $s ["a"]; if [$s 0 <] then output [1];',
+    'set $s ["a"]; set $t [1]; mark loop; if [$t $s =] then goto loop; output [2];',
+])
+def test_superinstruction_falls_back_like_the_tree_engine(source):
+    assert run(process_statements_vm, source) == run(process_statements, source)
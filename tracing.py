@@ -0,0 +1,86 @@
+import sys
+from interpreter import resolve_slots, find_marks, execute_statements, new_registers, format_output, format_statement, StreamSink
+
+# execution tracing for parsed StackTo programs
+# a tracer receives an event for every statement entered, goto taken,
+# variable written and line output. process_statements hands programs with
+# a tracer to trace_statements, which plugs it into the statement and jump
+# hooks of execute_statements, so that running without a tracer costs
+# nothing extra
+
+class Tracer:
+    # base class for tracers, every event does nothing by default
+    # index is the index of the statement in the parsed statement list,
+    # statement is the parsed statement (with variable names) and line is
+    # the text of an output line
+    def on_statement(self, index, statement):
+        pass
+
+    def on_goto(self, index, markname, target_index):
+        pass
+
+    def on_set(self, index, varname, value):
+        pass
+
+    def on_output(self, index, line):
+        pass
+
+class StreamTracer(Tracer):
+    # tracer that writes one line per event to a text stream (stderr by default)
+    def __init__(self, stream=None):
+        self.stream = sys.stderr if stream is None else stream
+
+    def on_statement(self, index, statement):
+        self.stream.write('trace: %s: %s\n' % (index, format_statement(statement)))
+
+    def on_goto(self, index, markname, target_index):
+        self.stream.write('trace: %s: goto %s (statement %s)\n' % (index, markname, target_index))
+
+    def on_set(self, index, varname, value):
+        self.stream.write('trace: %s: $%s = %s\n' % (index, varname, format_output(value)))
+
+    def on_output(self, index, line):
+        self.stream.write('trace: %s: output %s\n' % (index, line))
+
+class TracedRegisters(list):
+    # registers that call on_set(slot, value) after every variable written
+    __slots__ = ('on_set',)
+
+    def __init__(self, registers, on_set):
+        super().__init__(registers)
+        self.on_set = on_set
+
+    def __setitem__(self, slot, value):
+        list.__setitem__(self, slot, value)
+        self.on_set(slot, value)
+
+def trace_statements(parsed_statements, tracer, output=None, input_source=None):
+    # run parsed statements like process_statements, reporting events to tracer
+    if output is None:
+        output = StreamSink()
+    read_line = input if input_source is None else input_source.read_line
+    statements, variable_names = resolve_slots(parsed_statements)
+    marker_dict = find_marks(statements)
+    # the statement running
+    running = None
+
+    def on_statement(statement_index):
+        nonlocal running
+        running = statement_index
+        tracer.on_statement(statement_index, parsed_statements[statement_index])
+
+    def on_jump(statement_index, mark_index):
+        tracer.on_goto(statement_index, statements[mark_index][1], mark_index)
+
+    def on_set(slot, value):
+        tracer.on_set(running, variable_names[slot], value)
+
+    def write_line(line):
+        tracer.on_output(running, line)
+        output.write_line(line)
+
+    registers = TracedRegisters(new_registers(variable_names), on_set)
+    try:
+        execute_statements(statements, marker_dict, registers, write_line, read_line, on_jump, on_statement)
+    finally:
+        output.flush()
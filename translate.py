@@ -0,0 +1,526 @@
+import math
+from interpreter import OPERATORS, ListValue, SetValue, DictValue, StreamSink, format_stack, type_of
+from cfg import branch_target
+
+# ahead-of-time translation of parsed StackTo statements to python source
+# the program becomes a single function with a local per variable and a
+# dispatch loop over regions, where a region runs from a mark (or the start
+# of the program) to the next mark. a goto sets the region to run next, and
+# a region that jumps back to its own mark runs as a python while loop
+# expressions are unrolled at translation time into one python statement
+# per operator, working on temporaries instead of a stack. common operators
+# are inlined behind a check of their operand types, and fall back to the
+# operator function from OPERATORS (or FAST_OPERATORS for operators proven
+# by --optimize, which are inlined without the check) so that every runtime
+# error has the same type and message as with the other engines
+# a variable is checked for being set where it is read, unless it is set
+# on every path to that point
+
+NUMBER_TYPES = frozenset((int, float))
+SCALAR_TYPES = frozenset((bool, int, float, str))
+
+# sentinel value of variables that have not been set yet
+UNSET = object()
+
+# python expressions for common operators, used as
+#   result = expression if checks else fallback
+# where the operands are substituted for a and b (and {ta} and {tb} for
+# their types), followed by what each operand is checked for. the first
+# alternative whose checks can pass on the literal operands is used
+BINOP_INLINE = {
+    '+':    [('{a} + {b}', 'number', 'number'), ('{a} + {b}', 'string', 'string')],
+    '-':    [('{a} - {b}', 'number', 'number')],
+    '*':    [('{a} * {b}', 'number', 'number')],
+    '/':    [('{a} / {b}', 'number', 'nonzero')],
+    '//':   [('{a} // {b}', 'number', 'nonzero')],
+    '%':    [('{a} % {b}', 'number', 'number')],
+    '<':    [('{a} < {b}', 'number', 'number')],
+    '>':    [('{a} > {b}', 'number', 'number')],
+    '<=':   [('{a} <= {b}', 'number', 'number')],
+    '>=':   [('{a} >= {b}', 'number', 'number')],
+    'min':  [('min({a}, {b})', 'number', 'number')],
+    'max':  [('max({a}, {b})', 'number', 'number')],
+    '=':    [('{a} == {b} if {ta} is {tb} else values_equal({a}, {b})', None, None)],
+    '==':   [('{a} == {b} if {ta} is {tb} else values_equal({a}, {b})', None, None)],
+    '<>':   [('{a} != {b} if {ta} is {tb} else not values_equal({a}, {b})', None, None)],
+    '!=':   [('{a} != {b} if {ta} is {tb} else not values_equal({a}, {b})', None, None)],
+    '&':    [('{a} and {b}', 'bool', 'bool')],
+    '|':    [('{a} or {b}', 'bool', 'bool')],
+    '^':    [('{a} ^ {b}', 'bool', 'bool')],
+    ':':    [('{a}.append({b})', 'list', None)],
+}
+
+UNOP_INLINE = {
+    '!':    [('not {a}', 'bool')],
+    '#':    [('len({a})', 'list')],
+    '~':    [('-{a}', 'number')],
+    '?':    [('bool({a})', 'scalar')],
+    'str':  [('str({a})', 'scalar')],
+    'type': [('TYPE_NAMES[{ta}]', None)],
+}
+
+# what an operand is checked for: the types that pass, the python
+# condition for an operand {x} of unknown type, and for an operand of a
+# passing type the condition that is left and its test of a literal value
+CHECKS = {
+    'number':   ({'number'}, 'type({x}) in NUMBER_TYPES', None, None),
+    'nonzero':  ({'number'}, 'type({x}) in NUMBER_TYPES and {x} != 0', '{x} != 0', lambda value: value != 0),
+    'bool':     ({'bool'}, 'type({x}) is bool', None, None),
+    'string':   ({'string'}, 'type({x}) is str', None, None),
+    'list':     ({'list'}, 'type({x}) is ListValue', None, None),
+    'scalar':   ({'bool', 'number', 'string'}, 'type({x}) in SCALAR_TYPES', None, None),
+}
+
+# proven operators that may still fail on their values (or, for * and
+# str, behave differently for some of the proven types) keep their checks
+UNCHECKED_EXCLUDED = {'*', '/', '//', 'str'}
+
+# type of the result of operators that always give the same type
+RESULT_TYPES = {'#': 'number', 'str': 'string', 'type': 'string', 'toset': 'set', 'todict': 'dict', 'add': 'set', 'put': 'dict'}
+RESULT_TYPES.update((token, 'bool') for token in ('<', '>', '<=', '>=', '=', '==', '<>', '!=', '&', '|', '^', '!', '?', 'contains'))
+RESULT_TYPES.update((token, 'list') for token in ('keys', 'values'))
+
+# operators that leave exactly one value in place of their operands
+ONE_RESULT = {}
+ONE_RESULT.update((token, 1) for token in ('#', '~', '!', '?', 'num', 'str', 'round', 'sum', 'prod', 'type', 'toset', 'todict', 'keys', 'values'))
+ONE_RESULT.update((token, 2) for token in (
+    '<', '>', '<=', '>=', '=', '==', '<>', '!=', '&', '^', '|', '+', '-', '*', '/', '//', '%', '@', ':', 'nth', 'min', 'max', 'split',
+    'contains', 'add', 'get', 'remove'
+))
+ONE_RESULT.update((token, 3) for token in ('setnth', 'put'))
+
+
+def apply1(function, a):
+    stack = [a]
+    function(stack)
+    return stack[0]
+
+def apply2(function, a, b):
+    stack = [a, b]
+    function(stack)
+    return stack[0]
+
+def apply3(function, a, b, c):
+    stack = [a, b, c]
+    function(stack)
+    return stack[0]
+
+def finish(stack):
+    # end of an expression whose stack height is only known at run time
+    if len(stack) > 1:
+        raise ValueError('exp: stack ended with invalid length > 1 of %s (%s)' % (len(stack), format_stack(stack)))
+    return stack[0]
+
+def unknown_variable(name):
+    raise ValueError('exp: unknown variable "%s"' % name)
+
+def guard_error(value):
+    raise ValueError('if: invalid type of guard (should be bool, not %s): %s' % (type_of(value), value))
+
+HEADER = '''\
+# StackTo program translated to python by translate.py
+from random import random
+from interpreter import OPERATORS, FAST_OPERATORS, TYPE_NAMES, Expression, ListValue, SetValue, DictValue, evaluate_exp, format_output, new_list, new_set, new_dict, values_equal
+from translate import NUMBER_TYPES, SCALAR_TYPES, UNSET, apply1, apply2, apply3, finish, unknown_variable, guard_error
+'''
+
+def value_source(value):
+    # python source for a literal value
+    if type(value) is ListValue:
+        return 'new_list([%s])' % ', '.join(value_source(item) for item in value)
+    if type(value) is SetValue:
+        return 'new_set([%s])' % ', '.join(value_source(item) for item in value)
+    if type(value) is DictValue:
+        return 'new_dict([%s])' % ', '.join('(%s, %s)' % (value_source(key), value_source(item)) for key, item in value.items())
+    if type(value) is float and not math.isfinite(value):
+        return "float('%s')" % value
+    return repr(value)
+
+class Item:
+    # a value on the stack of an expression being translated: python source
+    # for it (a literal, variable or temporary, or for the last value of an
+    # expression any python expression), its value when it is a literal and
+    # its type name when that is known
+    __slots__ = ('text', 'literal', 'value', 'type_name')
+
+    def __init__(self, text, literal=False, value=None, type_name=None):
+        self.text = text
+        self.literal = literal
+        self.value = value
+        self.type_name = type_name
+
+class Translator:
+    # with limited, every goto taken is reported to jump(statement index,
+    # mark index) as in execute_statements, and the variables are passed to
+    # check_values at backward gotos when jump asks for them
+    def __init__(self, limited=False):
+        self.limited = limited
+        self.lines = []
+        # source of the module level constants, and the name of each
+        self.constants = []
+        self.constant_names = {}
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def constant(self, source):
+        if source not in self.constant_names:
+            self.constant_names[source] = 'k%s' % len(self.constants)
+            self.constants.append(source)
+        return self.constant_names[source]
+
+    def literal(self, value):
+        source = value_source(value)
+        if type(value) in (ListValue, SetValue, DictValue):
+            # built once, like the folded value in the other engines
+            source = self.constant(source)
+        return Item(source, True, value, type_of(value))
+
+    def operator(self, kind, token):
+        return self.constant('%s[%r]' % ('OPERATORS' if kind is OPERATORS[token] else 'FAST_OPERATORS', token))
+
+    def translate_exp(self, expression, assigned, indent):
+        # emit the statements evaluating expression, returning the Item of its value
+        # assigned is the set of variables known to be set, and grows with the
+        # variables checked here
+        if expression.code is None:
+            return Item('evaluate_exp(%s, None, read_line)' % self.constant('Expression(%r, None)' % expression.source))
+        items = []
+        temporaries = 0
+        # (item, number of lines, expression) of the last temporary
+        last = None
+        # whether the bottom of the stack is in the python list stack
+        spilled = False
+
+        for kind, token in expression.code:
+            if kind == 'value':
+                items.append(self.literal(token))
+                continue
+            if kind == 'var':
+                if token not in assigned:
+                    self.emit(indent, "if v_%s is UNSET: unknown_variable('%s')" % (token, token))
+                    assigned.add(token)
+                items.append(Item('v_' + token))
+                continue
+            arity = ONE_RESULT.get(token)
+            if arity is not None and len(items) >= arity:
+                operands = items[len(items)-arity:]
+                del items[len(items)-arity:]
+                text = self.operator_source(kind, token, operands)
+            elif token == 'dup' and items:
+                items.append(items[-1])
+                continue
+            elif token == 'drop' and items:
+                items.pop()
+                continue
+            elif token == 'swap' and len(items) >= 2:
+                items[-2], items[-1] = items[-1], items[-2]
+                continue
+            elif token == 'rand':
+                text = 'random()'
+            elif (token == '\\' and items and items[-1].literal and type(items[-1].value) in NUMBER_TYPES
+                    and int(items[-1].value) == items[-1].value and 0 <= items[-1].value < len(items)):
+                length = int(items.pop().value)
+                text = 'new_list([%s])' % ', '.join(item.text for item in items[len(items)-length:])
+                del items[len(items)-length:]
+            else:
+                # the stack height matters, run the operator on a real stack
+                texts = [item.text for item in items]
+                del items[:]
+                if not spilled:
+                    self.emit(indent, 'stack = [%s]' % ', '.join(texts))
+                    spilled = True
+                elif texts:
+                    self.emit(indent, 'stack.extend((%s,))' % ', '.join(texts))
+                self.emit(indent, '%s(stack)' % self.operator(kind, token))
+                continue
+            name = 't%s' % temporaries
+            temporaries += 1
+            self.emit(indent, '%s = %s' % (name, text))
+            items.append(Item(name, type_name=RESULT_TYPES.get(token)))
+            last = items[-1], len(self.lines), text
+        if spilled or len(items) != 1:
+            texts = [item.text for item in items]
+            if not spilled:
+                self.emit(indent, 'stack = [%s]' % ', '.join(texts))
+            elif texts:
+                self.emit(indent, 'stack.extend((%s,))' % ', '.join(texts))
+            return Item('finish(stack)')
+        item = items[0]
+        if last is not None and last[0] is item and last[1] == len(self.lines):
+            # use the expression of the last operator directly
+            item.text = '(%s)' % last[2]
+            self.lines.pop()
+        return item
+
+    def operator_source(self, kind, token, operands):
+        # python expression applying an operator that leaves one value to
+        # the operand Items
+        texts = [operand.text for operand in operands]
+        fallback = lambda: 'apply%s(%s, %s)' % (len(operands), self.operator(kind, token), ', '.join(texts))
+        alternatives = BINOP_INLINE.get(token) if len(operands) == 2 else UNOP_INLINE.get(token) if len(operands) == 1 else None
+        if alternatives is None:
+            return fallback()
+        # operators proven by --optimize only need the checks that are not about types
+        checked = kind is OPERATORS[token] or token in UNCHECKED_EXCLUDED
+        names = dict(zip('abc', texts))
+        names.update(zip(('ta', 'tb'), (type(operand.value).__name__ if operand.literal else 'type(%s)' % operand.text for operand in operands)))
+        for template, *requirements in alternatives:
+            conditions = []
+            for operand, requirement in zip(operands, requirements):
+                if requirement is None:
+                    continue
+                passing, condition, residual, literal_test = CHECKS[requirement]
+                if operand.type_name is None:
+                    conditions.append(condition.format(x=operand.text))
+                elif operand.type_name not in passing:
+                    break
+                elif residual is not None:
+                    if not operand.literal:
+                        conditions.append(residual.format(x=operand.text))
+                    elif not literal_test(operand.value):
+                        break
+            else:
+                if not conditions or not checked:
+                    return template.format(**names)
+                return '%s if %s else %s' % (template.format(**names), ' and '.join(conditions), fallback())
+        return fallback()
+
+    def translate_statement(self, statement, statement_index, region, assigned, indent, in_loop, prefix=''):
+        # emit a statement other than a mark, returning False after a goto
+        statement_type, *statement_args = statement
+        if statement_type == 'set':
+            item = self.translate_exp(statement_args[1], assigned, indent)
+            self.emit(indent, 'v_%s = %s' % (statement_args[0], item.text))
+            assigned.add(statement_args[0])
+        elif statement_type == 'outputvar':
+            varname = statement_args[0]
+            if varname not in assigned:
+                self.emit(indent, 'if v_%s is UNSET: raise ValueError(%r)' % (varname, 'output: variable "%s" undefined' % varname))
+                assigned.add(varname)
+            self.emit(indent, 'write_line(format_output(v_%s))' % varname)
+        elif statement_type == 'outputexp':
+            item = self.translate_exp(statement_args[0], assigned, indent)
+            self.emit(indent, 'write_line(format_output(%s))' % item.text)
+        elif statement_type == 'goto':
+            self.translate_goto(statement_args[0], statement_index, region, indent, in_loop, prefix)
+            return False
+        elif statement_type == 'if':
+            guard, body = statement_args
+            item = self.translate_exp(guard, assigned, indent)
+            if item.type_name == 'bool':
+                self.emit(indent, 'if %s:' % item.text)
+            else:
+                self.emit(indent, 'guard = %s' % item.text)
+                self.emit(indent, 'if type(guard) is not bool: guard_error(guard)')
+                self.emit(indent, 'if guard:')
+            if body[0] in ('set', 'outputvar', 'outputexp', 'goto'):
+                self.translate_statement(body, statement_index, region, set(assigned), indent + 1, in_loop, 'if ')
+            else:
+                self.emit(indent + 1, 'raise SyntaxError(%r)' % ('if: unknown or prohibited statement type "%s"' % body[0]))
+        return True
+
+    def translate_goto(self, markname, statement_index, region, indent, in_loop, prefix):
+        if markname not in self.region_of_mark:
+            self.emit(indent, 'raise ValueError(%r)' % ('%sgoto: mark "%s" undefined' % (prefix, markname)))
+            return
+        if self.limited:
+            mark_index = self.marks[markname]
+            if mark_index > statement_index:
+                self.emit(indent, 'jump(%s, %s)' % (statement_index, mark_index))
+            else:
+                self.emit(indent, 'if jump(%s, %s): check_values(%s)' % (statement_index, mark_index, self.values))
+        target = self.region_of_mark[markname]
+        if in_loop and target == region:
+            self.emit(indent, 'continue')
+            return
+        self.emit(indent, 'region = %s' % target)
+        self.emit(indent, 'break' if in_loop else 'continue')
+
+    def translate_region(self, region, assigned, indent):
+        start, end = self.regions[region]
+        statements = self.statements[start:end]
+        in_loop = any(branch_target(statement) is not None and self.region_of_mark.get(branch_target(statement)[0]) == region for statement in statements)
+        if in_loop:
+            self.emit(indent, 'while True:')
+            indent += 1
+        for statement_index, statement in enumerate(statements, start):
+            if statement[0] in ('mark', 'comment'):
+                continue
+            if not self.translate_statement(statement, statement_index, region, assigned, indent, in_loop):
+                return
+        if region + 1 == len(self.regions):
+            self.emit(indent, 'return ' + self.result)
+        else:
+            self.emit(indent, 'region = %s' % (region + 1))
+            if in_loop:
+                self.emit(indent, 'break')
+
+    def translate_dispatch(self, regions, region_assigned, indent):
+        # if tree picking the region to run, with a test per level
+        if len(regions) > 3:
+            middle = len(regions) // 2
+            self.emit(indent, 'if region < %s:' % regions[middle])
+            self.translate_dispatch(regions[:middle], region_assigned, indent + 1)
+            self.emit(indent, 'else:')
+            self.translate_dispatch(regions[middle:], region_assigned, indent + 1)
+            return
+        for position, region in enumerate(regions):
+            if position + 1 < len(regions):
+                self.emit(indent, '%s region == %s:' % ('if' if position == 0 else 'elif', region))
+            else:
+                self.emit(indent, 'else:')
+            self.translate_region(region, set(region_assigned[region]), indent + 1)
+
+    def translate(self, statements):
+        self.statements = statements
+        # duplicate marks fail before the program runs, as in process_statements
+        marks = {}
+        for statement_index, statement in enumerate(statements):
+            if statement[0] == 'mark':
+                markname = statement[1]
+                if markname in marks:
+                    raise SyntaxError('mark: duplicate marker "%s" (statements %s, %s)' % (markname, marks[markname], statement_index))
+                marks[markname] = statement_index
+        self.marks = marks
+        # a region starts at the first of every run of marks
+        self.regions = []
+        self.region_of_mark = {}
+        start = 0
+        for statement_index, statement in enumerate(statements):
+            if statement[0] == 'mark':
+                if statement_index > 0 and statements[statement_index-1][0] != 'mark':
+                    self.regions.append((start, statement_index))
+                    start = statement_index
+                self.region_of_mark[statement[1]] = len(self.regions)
+        self.regions.append((start, len(statements)))
+
+        region_assigned = assigned_variables(statements, self.regions, self.region_of_mark)
+        variables = sorted(variable_names(statements))
+        # the variables are taken from and returned in dicts, with UNSET for
+        # variables that are not set
+        self.result = '{%s}' % ', '.join('%r: v_%s' % (varname, varname) for varname in variables)
+        if self.limited:
+            self.values = '(%s)' % ''.join('v_%s, ' % varname for varname in variables)
+            self.emit(0, 'def run(write_line, read_line, variables, jump, check_values):')
+        else:
+            self.emit(0, 'def run(write_line, read_line, variables):')
+        for varname in variables:
+            self.emit(1, 'v_%s = variables.get(%r, UNSET)' % (varname, varname))
+        reachable = [region for region in range(len(self.regions)) if region_assigned[region] is not None]
+        if len(reachable) == 1:
+            # without marks to jump to from other regions, no dispatch is needed
+            self.translate_region(0, set(region_assigned[0]), 1)
+        else:
+            self.emit(1, 'region = 0')
+            self.emit(1, 'while True:')
+            self.translate_dispatch(reachable, region_assigned, 2)
+        constants = ['%s = %s' % (self.constant_names[source], source) for source in self.constants]
+        return HEADER + '\n'.join(constants + [''] + self.lines) + '\n'
+
+def expression_variables(expression):
+    if expression.code is None:
+        return []
+    return [arg for kind, arg in expression.code if kind == 'var']
+
+def variable_names(statements):
+    names = set()
+    for statement in statements:
+        if statement[0] == 'if':
+            names.update(expression_variables(statement[1]))
+            statement = statement[2]
+        if statement[0] == 'set':
+            names.add(statement[1])
+            names.update(expression_variables(statement[2]))
+        elif statement[0] == 'outputvar':
+            names.add(statement[1])
+        elif statement[0] == 'outputexp':
+            names.update(expression_variables(statement[1]))
+    return names
+
+def assigned_variables(statements, regions, region_of_mark):
+    # the variables set on every path to the start of each region, or None
+    # for regions that are never reached
+    # a variable counts as set once it is set or read (reading it fails
+    # when it is not set)
+    region_assigned = [None] * len(regions)
+    region_assigned[0] = frozenset()
+    worklist = [0]
+
+    def reach(region, assigned):
+        if region_assigned[region] is None:
+            region_assigned[region] = frozenset(assigned)
+        elif not region_assigned[region] <= assigned:
+            region_assigned[region] = region_assigned[region] & assigned
+        else:
+            return
+        worklist.append(region)
+
+    def apply(statement, assigned):
+        # add the variables of a statement other than if and goto
+        if statement[0] == 'set':
+            assigned.update(expression_variables(statement[2]))
+            assigned.add(statement[1])
+        elif statement[0] == 'outputvar':
+            assigned.add(statement[1])
+        elif statement[0] == 'outputexp':
+            assigned.update(expression_variables(statement[1]))
+
+    while worklist:
+        region = worklist.pop()
+        assigned = set(region_assigned[region])
+        start, end = regions[region]
+        for statement in statements[start:end]:
+            if statement[0] == 'goto':
+                if statement[1] in region_of_mark:
+                    reach(region_of_mark[statement[1]], assigned)
+                break
+            if statement[0] == 'if':
+                assigned.update(expression_variables(statement[1]))
+                body = statement[2]
+                if body[0] == 'goto':
+                    if body[1] in region_of_mark:
+                        reach(region_of_mark[body[1]], assigned)
+                # the body may not run, so only its own gotos see its variables
+            else:
+                apply(statement, assigned)
+        else:
+            if region + 1 < len(regions):
+                reach(region + 1, assigned)
+    return region_assigned
+
+def translate_statements(parsed_statements, limited=False):
+    # python source of a module whose run(write_line, read_line, variables)
+    # runs the program, starting from the variables in a dict and returning
+    # them in another
+    # with limited, run also takes the jump and check_values methods of a
+    # limits.Budget, with the variables in sorted order
+    return Translator(limited).translate(parsed_statements)
+
+def compile_program(parsed_statements, filename='<stackto>', limited=False):
+    # the run function of the translated program, and its source
+    source = translate_statements(parsed_statements, limited)
+    namespace = {'__name__': 'stackto_program'}
+    exec(compile(source, filename, 'exec'), namespace)
+    return namespace['run'], source
+
+def process_statements_py(parsed_statements, output=None, input_source=None, source_file=None, limits=None):
+    # translate parsed statements to python and run them, like process_statements
+    # with source_file, the generated source is also written to that file
+    filename = '<stackto>' if source_file is None else source_file
+    run, source = compile_program(parsed_statements, filename, limits is not None)
+    if source_file is not None:
+        with open(source_file, 'w') as f:
+            f.write(source)
+    if output is None:
+        output = StreamSink()
+    read_line = input if input_source is None else input_source.read_line
+    try:
+        if limits is None:
+            run(output.write_line, read_line, {})
+        else:
+            from limits import Budget, statement_counts
+            budget = Budget(limits, *statement_counts(parsed_statements), None, sorted(variable_names(parsed_statements)))
+            run(output.write_line, read_line, {}, budget.jump, budget.check_values)
+    finally:
+        output.flush()
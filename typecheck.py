@@ -0,0 +1,287 @@
+from itertools import product
+from interpreter import DATA_TYPES, UNOPS, BINOPS, TRINOPS, OPERATORS, FAST_OPERATORS, Expression, type_of
+
+# static type and stack height inference for parsed StackTo programs
+# every stack slot is tracked as a (types, constant) pair, where types is
+# the set of type names the slot may hold and constant is its value when
+# it comes straight from a literal (needed for the height argument of
+# \, dropn and topn)
+# variable types are the union of the types of every expression assigned
+# to the variable anywhere in the program, iterated until nothing changes
+# (starting from the types of the variables a program is started with,
+# for embedding code that passes in variables)
+
+ANY = frozenset(DATA_TYPES)
+NOTHING = frozenset()
+
+def types(*names):
+    return frozenset(names)
+
+# result slot types of each operator for one allowed type signature
+UNOP_RESULTS = {
+    '#':        lambda a: (types('number'),),
+    '~':        lambda a: (types('number'),),
+    '!':        lambda a: (types('bool'),),
+    '?':        lambda a: (types('bool'),),
+    'num':      lambda a: (types('number'),),
+    'dup':      lambda a: (types(a), types(a)),
+    'drop':     lambda a: (),
+    'str':      lambda a: (types('string'),),
+    'round':    lambda a: (types('number'),),
+    'sum':      lambda a: (types('number'),),
+    'prod':     lambda a: (types('number'),),
+    'type':     lambda a: (types('string'),),
+    'toset':    lambda a: (types('set'),),
+    'todict':   lambda a: (types('dict'),),
+    'keys':     lambda a: (types('list'),),
+    'values':   lambda a: (types('list'),)
+}
+
+BINOP_RESULTS = {
+    '<':        lambda a, b: (types('bool'),),
+    '>':        lambda a, b: (types('bool'),),
+    '<=':       lambda a, b: (types('bool'),),
+    '>=':       lambda a, b: (types('bool'),),
+    '=':        lambda a, b: (types('bool'),),
+    '==':       lambda a, b: (types('bool'),),
+    '<>':       lambda a, b: (types('bool'),),
+    '!=':       lambda a, b: (types('bool'),),
+    '&':        lambda a, b: (types('bool'),),
+    '^':        lambda a, b: (types('bool'),),
+    '|':        lambda a, b: (types('bool'),),
+    '+':        lambda a, b: (types(a),),
+    '-':        lambda a, b: (types('number'),),
+    '*':        lambda a, b: (types(a),),
+    '/':        lambda a, b: (types('number'),),
+    '//':       lambda a, b: (types('number'),),
+    '%':        lambda a, b: (types('number'),),
+    '@':        lambda a, b: (types('list'),),
+    ':':        lambda a, b: (types('list'),),
+    'swap':     lambda a, b: (types(b), types(a)),
+    'nth':      lambda a, b: (ANY,),
+    'min':      lambda a, b: (types('number'),),
+    'max':      lambda a, b: (types('number'),),
+    'split':    lambda a, b: (types('list'),),
+    'contains': lambda a, b: (types('bool'),),
+    'add':      lambda a, b: (types('set'),),
+    'get':      lambda a, b: (ANY,),
+    'remove':   lambda a, b: (types(a),)
+}
+
+TRINOP_RESULTS = {
+    'setnth':   lambda a, b, c: (types('list'),),
+    'put':      lambda a, b, c: (types('dict'),)
+}
+
+class ExpressionTypes:
+    # result of analyzing one expression
+    # result is the set of types the expression can produce, proven is the
+    # set of code offsets whose operators cannot fail their stack height
+    # and type checks, and errors are the checks that always fail
+    __slots__ = ('result', 'proven', 'errors')
+
+    def __init__(self):
+        self.result = ANY
+        self.proven = set()
+        self.errors = []
+
+def format_types(slot_types):
+    return '/'.join(sorted(slot_types))
+
+def apply_typed_op(token, arity, allowed, results, stack, analysis, offset, kind):
+    # pop arity slots and push the union of the results over every
+    # argument type combination the operator accepts
+    if len(stack) < arity:
+        analysis.errors.append('%s: stack too short for "%s" (height %s, need >= %s)' % (kind, token, len(stack), arity))
+        return None
+    arguments = [slot_types for slot_types, _ in stack[len(stack)-arity:]]
+    del stack[len(stack)-arity:]
+    if NOTHING in arguments:
+        # an argument can never be computed (unassigned variable)
+        return None
+    outputs = None
+    all_allowed = True
+    for typesig in product(*arguments):
+        if (typesig[0] if arity == 1 else typesig) not in allowed:
+            all_allowed = False
+            continue
+        typesig_outputs = results(*typesig)
+        if outputs is None:
+            outputs = list(typesig_outputs)
+        else:
+            outputs = [a | b for a, b in zip(outputs, typesig_outputs)]
+    if outputs is None:
+        analysis.errors.append('%s: %s cannot process types "%s"' % (kind, token, ', '.join(format_types(argument) for argument in arguments)))
+        return None
+    if all_allowed:
+        analysis.proven.add(offset)
+    stack.extend((output, None) for output in outputs)
+    return stack
+
+def apply_height_op(token, stack, analysis, offset):
+    # \, dropn, topn: the height must be a literal for the result to be known
+    if len(stack) < 1:
+        analysis.errors.append('nop: stack too short for op %s (height 0)' % token)
+        return None
+    slot_types, length = stack.pop()
+    if 'number' not in slot_types:
+        if slot_types:
+            analysis.errors.append('nop: %s cannot process type %s as stack height' % (token, format_types(slot_types)))
+        return None
+    if slot_types != types('number') or length is None:
+        return None
+    if int(length) != length:
+        analysis.errors.append('nop: %s cannot process non-integer %s as stack height' % (token, length))
+        return None
+    length = int(length)
+    if len(stack) < length:
+        analysis.errors.append('nop: stack too short for op %s and height %s (height left is %s)' % (token, length, len(stack)))
+        return None
+    if length < 0:
+        analysis.errors.append('nop: %s cannot process negative stack height "%s"' % (token, length))
+        return None
+    analysis.proven.add(offset)
+    # same slicing as the operators, including their behavior for 0
+    if token == '\\':
+        if length > 0:
+            del stack[-length:]
+        stack.append((types('list'), None))
+    elif token == 'dropn':
+        del stack[-length:]
+    else:
+        del stack[:-length]
+    return stack
+
+def analyze_exp(expression, variable_types):
+    analysis = ExpressionTypes()
+    if expression.code is None:
+        analysis.result = types('string') if expression.source == 'input' else types('number')
+        return analysis
+    stack = []
+    for offset, (kind, arg) in enumerate(expression.code):
+        if kind == 'value':
+            stack.append((types(type_of(arg)), arg))
+        elif kind == 'var':
+            stack.append((variable_types.get(arg, NOTHING), None))
+        elif arg in UNOPS:
+            if arg == 'splat':
+                # pushes an unknown number of values
+                if stack and stack[-1][0] and 'list' not in stack[-1][0]:
+                    analysis.errors.append('unop: splat cannot process types "%s"' % format_types(stack[-1][0]))
+                stack = None
+            else:
+                stack = apply_typed_op(arg, 1, UNOPS[arg], UNOP_RESULTS[arg], stack, analysis, offset, 'unop')
+        elif arg in BINOPS:
+            stack = apply_typed_op(arg, 2, BINOPS[arg], BINOP_RESULTS[arg], stack, analysis, offset, 'binop')
+        elif arg in TRINOPS:
+            stack = apply_typed_op(arg, 3, TRINOPS[arg], TRINOP_RESULTS[arg], stack, analysis, offset, 'trinop')
+        elif arg in ('\\', 'dropn', 'topn'):
+            stack = apply_height_op(arg, stack, analysis, offset)
+        elif arg == 'top':
+            if len(stack) < 1:
+                analysis.errors.append('nop: stack too short for op top (height 0)')
+                stack = None
+            else:
+                del stack[:-1]
+                analysis.proven.add(offset)
+        elif arg == 'rand':
+            stack.append((types('number'), None))
+            analysis.proven.add(offset)
+        if stack is None:
+            # nothing more is known about this expression
+            return analysis
+    if len(stack) != 1:
+        analysis.errors.append('exp: stack ends with %s values instead of 1' % len(stack))
+        return analysis
+    analysis.result = stack[0][0]
+    return analysis
+
+def walk_statements(statements):
+    # yield (statement index, statement) for every statement, including if bodies
+    for statement_index, statement in enumerate(statements):
+        yield statement_index, statement
+        if statement[0] == 'if':
+            yield statement_index, statement[2]
+
+def infer_variable_types(statements, initial_types=None):
+    # initial_types maps variables that are set before the program starts
+    # to the set of their possible types
+    assignments = [(statement[1], statement[2]) for _, statement in walk_statements(statements) if statement[0] == 'set']
+    variable_types = {} if initial_types is None else dict(initial_types)
+    changed = True
+    while changed:
+        changed = False
+        for varname, expression in assignments:
+            old = variable_types.get(varname, NOTHING)
+            new = old | analyze_exp(expression, variable_types).result
+            if new != old:
+                variable_types[varname] = new
+                changed = True
+    return variable_types
+
+def statement_expressions(statement):
+    statement_type, *statement_args = statement
+    if statement_type == 'set':
+        return [statement_args[1]]
+    if statement_type == 'outputexp':
+        return [statement_args[0]]
+    if statement_type == 'if':
+        return [statement_args[0]] + statement_expressions(statement_args[1])
+    return []
+
+def check_types(statements, variable_types=None):
+    # return a list of errors that will always happen if the statement runs
+    if variable_types is None:
+        variable_types = infer_variable_types(statements)
+    errors = []
+    for statement_index, statement in walk_statements(statements):
+        statement_type = statement[0]
+        if statement_type == 'outputvar' and statement[1] not in variable_types:
+            errors.append('statement %s: output: variable "%s" is never set' % (statement_index, statement[1]))
+        if statement_type == 'if':
+            guard_types = analyze_exp(statement[1], variable_types).result
+            if guard_types and 'bool' not in guard_types:
+                errors.append('statement %s: if: guard %s can never be bool (%s)' % (statement_index, statement[1].source, format_types(guard_types)))
+            expressions = [statement[1]]
+        else:
+            expressions = statement_expressions(statement)
+        for expression in expressions:
+            if expression.code is None:
+                continue
+            for kind, arg in expression.code:
+                if kind == 'var' and arg not in variable_types:
+                    errors.append('statement %s: exp %s: variable "%s" is never set' % (statement_index, expression.source, arg))
+            for error in analyze_exp(expression, variable_types).errors:
+                errors.append('statement %s: exp %s: %s' % (statement_index, expression.source, error))
+    return errors
+
+def specialize_exp(expression, variable_types):
+    # operators that are not proven get their checked version back, so that
+    # specialized statements can be specialized again
+    if expression.code is None:
+        return expression
+    proven = analyze_exp(expression, variable_types).proven
+    code = [
+        (kind, arg) if kind in ('value', 'var') else (FAST_OPERATORS[arg] if offset in proven else OPERATORS[arg], arg)
+        for offset, (kind, arg) in enumerate(expression.code)
+    ]
+    if all(entry[0] is kind for entry, (kind, _) in zip(code, expression.code)):
+        return expression
+    return Expression(expression.source, code)
+
+def specialize_statement(statement, variable_types):
+    statement_type, *statement_args = statement
+    if statement_type == 'set':
+        return 'set', statement_args[0], specialize_exp(statement_args[1], variable_types)
+    if statement_type == 'outputexp':
+        return 'outputexp', specialize_exp(statement_args[0], variable_types)
+    if statement_type == 'if':
+        guard, body = statement_args
+        return 'if', specialize_exp(guard, variable_types), specialize_statement(body, variable_types)
+    return statement
+
+def specialize(statements, initial_types=None):
+    # return the statements with proven operators replaced by unchecked ones
+    # (and the others by checked ones), see infer_variable_types for initial_types
+    variable_types = infer_variable_types(statements, initial_types)
+    return [specialize_statement(statement, variable_types) for statement in statements]
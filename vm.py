@@ -0,0 +1,263 @@
+from operator import lt, gt, le, ge, eq, ne
+from interpreter import evaluate_exp, type_of, resolve_slots, new_registers, Unset, ListValue, format_output, StreamSink
+
+# bytecode engine for parsed StackTo statements
+# compile_statements flattens the statement list into instructions, with
+# marks removed and goto targets resolved to instruction offsets, and
+# run_code executes them in a single dispatch loop
+
+# every instruction is a 3-tuple (opcode, a, b)
+# variables live in a flat register list, indexed by the slots from resolve_slots
+# SET         a = register, b = expression
+# OUTPUTVAR   a = register
+# OUTPUTEXP   a = expression
+# JUMP        a = target offset
+# JUMP_IF     a = guard expression, b = target offset taken when guard is true
+# JUMP_UNLESS a = guard expression, b = target offset taken when guard is false
+# FAIL        a = exception type, b = message (goto to an undefined mark)
+# superinstructions for common idioms, each keeps the expression it
+# replaces and evaluates that instead when the operands have other types
+# ADD_CONST           a = register, b = (source register, number, expression)
+#                     for set $x [$y 1 +] and set $x [$y 1 -] (number negated)
+# APPEND              a = register, b = (list register, item, item is a register, expression)
+#                     for set $x [$y $z :] and set $x [$y 1 :]
+# COMPARE_JUMP_IF     a = (compare, left register, right, right is a register, guard), b = target
+# COMPARE_JUMP_UNLESS a = (compare, left register, right, right is a register, guard), b = target
+#                     for guards like [$n $max =] and [$n 0 <=] comparing numbers
+SET, OUTPUTVAR, OUTPUTEXP, JUMP, JUMP_IF, JUMP_UNLESS, FAIL, ADD_CONST, APPEND, COMPARE_JUMP_IF, COMPARE_JUMP_UNLESS = range(11)
+
+OPCODE_NAMES = ['SET', 'OUTPUTVAR', 'OUTPUTEXP', 'JUMP', 'JUMP_IF', 'JUMP_UNLESS', 'FAIL', 'ADD_CONST', 'APPEND', 'COMPARE_JUMP_IF', 'COMPARE_JUMP_UNLESS']
+
+NUMBER_TYPES = frozenset((int, float))
+
+COMPARISONS = {'<': lt, '>': gt, '<=': le, '>=': ge, '=': eq, '==': eq, '<>': ne, '!=': ne}
+
+def check_args(name, statement_args, count):
+    if len(statement_args) != count:
+        raise SyntaxError('%s: invalid number of arguments (should be %s, not %s): %s' % (name, count, len(statement_args), statement_args))
+
+def compile_statements(parsed_statements):
+    # returns the instruction list and the variable name of each register
+    parsed_statements, variable_names = resolve_slots(parsed_statements)
+
+    # first pass - find marker statement indices
+    marker_dict = {}
+    for statement_index, statement in enumerate(parsed_statements):
+        statement_type, *statement_args = statement
+        if statement_type == 'mark':
+            check_args('mark', statement_args, 1)
+            markname = statement_args[0]
+            if markname in marker_dict:
+                raise SyntaxError('mark: duplicate marker "%s" (statements %s, %s)' % (markname, marker_dict[markname], statement_index))
+            marker_dict[markname] = statement_index
+
+    # second pass - emit instructions, jumps still refer to mark names
+    code = []
+    mark_offsets = {}
+
+    def emit_goto(markname, prefix):
+        if markname in marker_dict:
+            code.append([JUMP, markname, None])
+        else:
+            # undefined marks are only an error once the goto is reached
+            code.append((FAIL, ValueError, '%s: mark "%s" undefined' % (prefix, markname)))
+
+    def emit_body(statement, prefix):
+        statement_type, *statement_args = statement
+        if statement_type == 'outputvar':
+            check_args('output', statement_args, 1)
+            code.append((OUTPUTVAR, statement_args[0], None))
+        elif statement_type == 'outputexp':
+            check_args('output', statement_args, 1)
+            code.append((OUTPUTEXP, statement_args[0], None))
+        elif statement_type == 'set':
+            check_args(prefix + 'set', statement_args, 2)
+            varname, expression = statement_args
+            code.append((SET, varname, expression))
+        elif statement_type == 'goto':
+            check_args(prefix + 'goto', statement_args, 1)
+            emit_goto(statement_args[0], prefix + 'goto')
+        elif prefix:
+            raise SyntaxError('if: unknown or prohibited statement type "%s"' % statement_type)
+        # like process_statements, other top-level statements (comments) are skipped
+
+    for statement in parsed_statements:
+        statement_type, *statement_args = statement
+        if statement_type == 'mark':
+            mark_offsets[statement_args[0]] = len(code)
+        elif statement_type == 'if':
+            check_args('if', statement_args, 2)
+            guard, body = statement_args
+            if body[0] == 'goto' and len(body) == 2 and body[1] in marker_dict:
+                code.append([JUMP_IF, guard, body[1]])
+            else:
+                # skip over the body when the guard is false
+                code.append((JUMP_UNLESS, guard, len(code) + 2))
+                emit_body(body, 'if ')
+        else:
+            emit_body(statement, '')
+
+    # third pass - resolve mark names to offsets and fuse idioms
+    for offset, instruction in enumerate(code):
+        if type(instruction) is list:
+            opcode, a, b = instruction
+            if opcode == JUMP:
+                instruction = JUMP, mark_offsets[a], None
+            else:
+                instruction = JUMP_IF, a, mark_offsets[b]
+        code[offset] = fuse_instruction(instruction)
+    return code, variable_names
+
+def fuse_instruction(instruction):
+    # replace an instruction matching one of the idioms by its superinstruction
+    opcode, a, b = instruction
+    if opcode == SET and b.code is not None and len(b.code) == 3:
+        (source_kind, source), (item_kind, item), (operator_kind, token) = b.code
+        if source_kind == 'reg' and type(operator_kind) is not str:
+            if token in ('+', '-') and item_kind == 'value' and type(item) in NUMBER_TYPES:
+                return ADD_CONST, a, (source, item if token == '+' else -item, b)
+            if token == ':' and item_kind in ('reg', 'value'):
+                return APPEND, a, (source, item, item_kind == 'reg', b)
+    elif opcode in (JUMP_IF, JUMP_UNLESS) and a.code is not None and len(a.code) == 3:
+        (left_kind, left), (right_kind, right), (operator_kind, token) = a.code
+        if (left_kind == 'reg' and type(operator_kind) is not str and token in COMPARISONS
+                and (right_kind == 'reg' or right_kind == 'value' and type(right) in NUMBER_TYPES)):
+            fused_opcode = COMPARE_JUMP_IF if opcode == JUMP_IF else COMPARE_JUMP_UNLESS
+            return fused_opcode, (COMPARISONS[token], left, right, right_kind == 'reg', a), b
+    return instruction
+
+def instruction_expression(instruction):
+    # the expression an instruction evaluates, or None
+    opcode, a, b = instruction
+    if opcode == SET:
+        return b
+    if opcode in (OUTPUTEXP, JUMP_IF, JUMP_UNLESS):
+        return a
+    if opcode in (ADD_CONST, APPEND):
+        return b[-1]
+    if opcode in (COMPARE_JUMP_IF, COMPARE_JUMP_UNLESS):
+        return a[-1]
+    return None
+
+def format_instruction(instruction):
+    opcode, a, b = instruction
+    if opcode == FAIL:
+        return '%s %s(%r)' % (OPCODE_NAMES[opcode], a.__name__, b)
+    if opcode in (ADD_CONST, APPEND):
+        return '%s %s %s' % (OPCODE_NAMES[opcode], a, b[-1])
+    if opcode in (COMPARE_JUMP_IF, COMPARE_JUMP_UNLESS):
+        return '%s %s %s' % (OPCODE_NAMES[opcode], a[-1], b)
+    return ' '.join(str(arg) for arg in [OPCODE_NAMES[opcode], a, b] if arg is not None)
+
+def disassemble(code):
+    return '\n'.join('%4d  %s' % (offset, format_instruction(instruction)) for offset, instruction in enumerate(code))
+
+def run_code(code, variable_names, output=None, input_source=None, registers=None, on_jump=None):
+    # registers holds the variables (fresh ones by default), which are left
+    # as the program leaves them
+    # on_jump(offset, target offset) is called for every jump taken
+    if output is None:
+        output = StreamSink()
+    read_line = input if input_source is None else input_source.read_line
+    if registers is None:
+        registers = new_registers(variable_names)
+    write_line = output.write_line
+    pc = 0
+    end = len(code)
+    try:
+        while pc < end:
+            opcode, a, b = code[pc]
+            if opcode == SET:
+                registers[a] = evaluate_exp(b, registers, read_line)
+            elif opcode == ADD_CONST:
+                source, number, expression = b
+                value = registers[source]
+                if type(value) in NUMBER_TYPES:
+                    registers[a] = value + number
+                else:
+                    registers[a] = evaluate_exp(expression, registers, read_line)
+            elif opcode == COMPARE_JUMP_IF or opcode == COMPARE_JUMP_UNLESS:
+                compare, left, right, right_is_register, guard = a
+                left = registers[left]
+                if right_is_register:
+                    right = registers[right]
+                if type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+                    guard = compare(left, right)
+                else:
+                    guard = evaluate_exp(guard, registers, read_line)
+                    if type(guard) is not bool:
+                        raise ValueError('if: invalid type of guard (should be bool, not %s): %s' % (type_of(guard), guard))
+                if guard is (opcode == COMPARE_JUMP_IF):
+                    if on_jump is not None:
+                        on_jump(pc, b)
+                    pc = b
+                    continue
+            elif opcode == JUMP_IF:
+                guard = evaluate_exp(a, registers, read_line)
+                if type(guard) is not bool:
+                    raise ValueError('if: invalid type of guard (should be bool, not %s): %s' % (type_of(guard), guard))
+                if guard:
+                    if on_jump is not None:
+                        on_jump(pc, b)
+                    pc = b
+                    continue
+            elif opcode == JUMP_UNLESS:
+                guard = evaluate_exp(a, registers, read_line)
+                if type(guard) is not bool:
+                    raise ValueError('if: invalid type of guard (should be bool, not %s): %s' % (type_of(guard), guard))
+                if not guard:
+                    if on_jump is not None:
+                        on_jump(pc, b)
+                    pc = b
+                    continue
+            elif opcode == JUMP:
+                if on_jump is not None:
+                    on_jump(pc, a)
+                pc = a
+                continue
+            elif opcode == APPEND:
+                source, item, item_is_register, expression = b
+                value = registers[source]
+                if item_is_register:
+                    item = registers[item]
+                if type(value) is ListValue and type(item) is not Unset:
+                    registers[a] = value.append(item)
+                else:
+                    registers[a] = evaluate_exp(expression, registers, read_line)
+            elif opcode == OUTPUTVAR:
+                value = registers[a]
+                if type(value) is Unset:
+                    raise ValueError('output: variable "%s" undefined' % value.name)
+                write_line(format_output(value))
+            elif opcode == OUTPUTEXP:
+                value = evaluate_exp(a, registers, read_line)
+                write_line(format_output(value))
+            else:
+                raise a(b)
+            pc += 1
+    finally:
+        output.flush()
+
+def code_counts(code):
+    # running totals of the statements and operators counted for each
+    # instruction under limits, the body of an if counts with the
+    # instruction that skips it
+    from limits import expression_operators, running_totals
+    statements = [1] * len(code)
+    operators = [0] * len(code)
+    for offset, instruction in enumerate(code):
+        operators[offset] = expression_operators(instruction_expression(instruction))
+        if offset > 0 and code[offset-1][0] in (JUMP_UNLESS, COMPARE_JUMP_UNLESS):
+            statements[offset] = 0
+            operators[offset-1] += operators[offset]
+            operators[offset] = 0
+    return running_totals(statements), running_totals(operators)
+
+def process_statements_vm(parsed_statements, output=None, input_source=None, limits=None):
+    code, variable_names = compile_statements(parsed_statements)
+    registers = new_registers(variable_names)
+    on_jump = None
+    if limits is not None:
+        from limits import Budget
+        on_jump = Budget(limits, *code_counts(code), registers, variable_names).jump
+    run_code(code, variable_names, output, input_source, registers, on_jump)